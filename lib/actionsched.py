@@ -0,0 +1,162 @@
+"""
+The multiple objects action scheduler.
+
+Orders the objects of a multiple objects action so the parents are started
+before their children, and the children are stopped before their parents.
+In parallel mode, the objects are submitted to a bounded pool of worker
+processes, each object as soon as its dependencies are done and a worker
+slot is free.
+"""
+import time
+
+try:
+    from multiprocessing.connection import wait as wait_sentinels
+except ImportError:
+    wait_sentinels = None
+
+from converters import print_duration
+from rcUtilities import resolve_path
+
+POLL_INTERVAL = 0.1
+
+PARENTS_FIRST_ACTIONS = (
+    "provision",
+    "start",
+)
+
+CHILDREN_FIRST_ACTIONS = (
+    "purge",
+    "shutdown",
+    "stop",
+    "unprovision",
+)
+
+
+class ActionScheduler(object):
+    """
+    Schedule the <action> on <svcs>, with at most <max_parallel> concurrent
+    workers.
+
+    A failed object action does not block its dependent objects actions,
+    like in the unordered execution.
+    """
+    def __init__(self, svcs, action, max_parallel=1, log=None):
+        self.svcs = svcs
+        self.action = action
+        self.max_parallel = max(max_parallel, 1)
+        self.log = log
+        self.deps = self.dependencies()
+        self.results = {}
+
+    def related(self, svc):
+        if self.action in PARENTS_FIRST_ACTIONS:
+            return svc.parents
+        if self.action in CHILDREN_FIRST_ACTIONS:
+            return svc.children
+        return []
+
+    def dependencies(self):
+        """
+        Return a dict of the selected objects each object must wait for.
+        """
+        paths = set([svc.path for svc in self.svcs])
+        deps = {}
+        for svc in self.svcs:
+            try:
+                related = self.related(svc)
+            except Exception:
+                related = []
+            related = set([resolve_path(path.split("@")[0], svc.namespace) for path in related])
+            deps[svc.path] = (related & paths) - set([svc.path])
+        return deps
+
+    def order(self):
+        """
+        Return the objects in an order respecting the dependencies, and
+        otherwise preserving the selection order. The objects in a
+        dependency loop are appended in selection order.
+        """
+        ordered = []
+        done = set()
+        pending = list(self.svcs)
+        while pending:
+            ready = [svc for svc in pending if not (self.deps[svc.path] - done)]
+            if not ready:
+                self.warn_loop(pending)
+                ready = pending
+            for svc in ready:
+                done.add(svc.path)
+                ordered.append(svc)
+            pending = [svc for svc in pending if svc.path not in done]
+        return ordered
+
+    def warn_loop(self, svcs):
+        if self.log:
+            self.log.warning("dependency loop between %s: ignore the "
+                             "dependencies", ", ".join([svc.path for svc in svcs]))
+
+    def run(self, spawn):
+        """
+        Call <spawn> for each object when it is ready and a worker slot is
+        free. <spawn> returns a started multiprocessing.Process.
+
+        Return the {path: (exitcode, duration)} dict.
+        """
+        begin = time.time()
+        pending = self.order()
+        running = {}
+        done = set()
+        while pending or running:
+            for svc in list(pending):
+                if len(running) >= self.max_parallel:
+                    break
+                if self.deps[svc.path] - done:
+                    continue
+                pending.remove(svc)
+                running[svc.path] = (spawn(svc), time.time())
+            if not running:
+                # the remaining objects wait for objects not done, which
+                # order() reported as a loop.
+                for svc in pending:
+                    self.deps[svc.path] = set()
+                continue
+            self.wait([proc for proc, _ in running.values()])
+            for path, (proc, _begin) in list(running.items()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                del running[path]
+                done.add(path)
+                self.results[path] = (proc.exitcode, time.time() - _begin)
+                self.report(path)
+        self.report_summary(time.time() - begin)
+        return self.results
+
+    @staticmethod
+    def wait(procs):
+        """
+        Wait until a worker terminates.
+        """
+        if wait_sentinels:
+            wait_sentinels([proc.sentinel for proc in procs])
+            return
+        while all(proc.is_alive() for proc in procs):
+            time.sleep(POLL_INTERVAL)
+
+    def report(self, path):
+        if not self.log:
+            return
+        ret, duration = self.results[path]
+        if ret == 0:
+            self.log.info("%s: %s done in %s", path, self.action, print_duration(duration))
+        else:
+            self.log.warning("%s: %s failed (%s) in %s", path, self.action, ret, print_duration(duration))
+
+    def report_summary(self, duration):
+        if not self.log or not self.results:
+            return
+        errors = len([ret for ret, _ in self.results.values() if ret != 0])
+        total = sum([_duration for _, _duration in self.results.values()])
+        self.log.info("%s on %d objects done in %s, %d errors, %s cumulated "
+                      "objects action duration", self.action, len(self.results),
+                      print_duration(duration), errors, print_duration(total))
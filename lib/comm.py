@@ -11,6 +11,7 @@ import threading
 import zlib
 import time
 import select
+import struct
 import sys
 from errno import ECONNREFUSED, EPIPE, EBUSY, EALREADY
 
@@ -68,6 +69,19 @@ BLACKLIST_LOCK = threading.RLock()
 # new messages
 BLACKLIST_THRESHOLD = 5
 
+# The binary message framing:
+#
+#   magic (4) | version (1) | length of the remaining bytes (4) |
+#   header length (2) | header | iv (16) | ciphertext
+#
+# The header is the json-encoded clustername and nodename. The ciphertext
+# is the raw aes encrypted, zlib compressed, compact json payload.
+FRAME_MAGIC = b"OSVB"
+FRAME_VERSION = 1
+FRAME_PREFIX = struct.Struct(">4sBI")
+FRAME_HEADER_LEN = struct.Struct(">H")
+FRAME_IV_LEN = 16
+
 class Headers(object):
     node = "o-node"
     secret = "o-secret"
@@ -342,18 +356,19 @@ class Crypt(object):
             cluster_names = self.cluster_names
         else:
             cluster_names = [cluster_name]
-        message = bdecode(message).rstrip("\0\x00")
-        try:
-            message = json.loads(message)
-        except ValueError:
-            message_len = len(message)
-            if message_len > 40:
-                self.log.error("misformatted encrypted message from %s: %s",
-                               sender_id, message[:30]+"..."+message[-10:])
-            elif message_len > 0:
-                self.log.error("misformatted encrypted message from %s",
-                               sender_id)
-            return None, None, None
+        if self.is_frame(message):
+            try:
+                message, iv, data = self.parse_frame(message)
+            except ValueError as exc:
+                self.log.error("misformatted binary message from %s: %s",
+                               sender_id, exc)
+                return None, None, None
+        else:
+            iv = None
+            data = None
+            message = self.decode_envelope(message, sender_id)
+            if message is None:
+                return None, None, None
         msg_clustername = message.get("clustername")
         msg_nodename = message.get("nodename")
         if secret is None:
@@ -372,13 +387,14 @@ class Crypt(object):
             return None, None, None
         if msg_nodename is None:
             return None, None, None
-        iv = message.get("iv")
         if iv is None:
-            return None, None, None
+            iv = message.get("iv")
+            if iv is None:
+                return None, None, None
+            iv = base64.urlsafe_b64decode(to_bytes(iv))
+            data = base64.urlsafe_b64decode(to_bytes(message["data"]))
         if self.blacklisted(sender_id):
             return None, None, None
-        iv = base64.urlsafe_b64decode(to_bytes(iv))
-        data = base64.urlsafe_b64decode(to_bytes(message["data"]))
         try:
             data = self._decrypt(data, cluster_key, iv)
         except Exception as exc:
@@ -392,6 +408,24 @@ class Crypt(object):
         except ValueError as exc:
             return msg_clustername, msg_nodename, data
 
+    def decode_envelope(self, message, sender_id=None):
+        """
+        Return the json envelope dict of a base64 encrypted message, or None
+        if the message is misformatted.
+        """
+        message = bdecode(message).rstrip("\0\x00")
+        try:
+            return json.loads(message)
+        except ValueError:
+            message_len = len(message)
+            if message_len > 40:
+                self.log.error("misformatted encrypted message from %s: %s",
+                               sender_id, message[:30]+"..."+message[-10:])
+            elif message_len > 0:
+                self.log.error("misformatted encrypted message from %s",
+                               sender_id)
+            return
+
     def encrypt(self, data, cluster_name=None, secret=None, encode=True):
         """
         Encrypt and return data in a wrapping structure.
@@ -424,6 +458,86 @@ class Crypt(object):
             return (json.dumps(message)+'\0').encode()
         return json.dumps(message)
 
+    def encrypt_frame(self, data, cluster_name=None, secret=None):
+        """
+        Encrypt and return data in a binary frame.
+        """
+        if cluster_name is None:
+            cluster_name = self.cluster_name
+        if secret is None:
+            cluster_key = self.cluster_key
+        else:
+            cluster_key = secret
+        if cluster_key is None:
+            return
+        iv = self.gen_iv()
+        try:
+            data = json.dumps(data, separators=(",", ":")).encode()
+        except (UnicodeDecodeError, TypeError):
+            # already binary data
+            pass
+        header = json.dumps({
+            "clustername": cluster_name,
+            "nodename": rcEnv.nodename,
+        }, separators=(",", ":")).encode()
+        body = FRAME_HEADER_LEN.pack(len(header)) + header + iv + \
+               self._encrypt(data, cluster_key, iv)
+        return FRAME_PREFIX.pack(FRAME_MAGIC, FRAME_VERSION, len(body)) + body
+
+    @staticmethod
+    def is_frame(message):
+        """
+        Return True if <message> starts like a binary frame.
+        """
+        return isinstance(message, (bytes, bytearray, memoryview)) and \
+               bytes(message[:len(FRAME_MAGIC)]) == FRAME_MAGIC
+
+    @staticmethod
+    def frame_len(message):
+        """
+        Return the total length of the binary frame starting <message>, or
+        None if <message> is not a binary frame or too short to tell.
+        """
+        if len(message) < FRAME_PREFIX.size:
+            return
+        magic, _, length = FRAME_PREFIX.unpack_from(message)
+        if magic != FRAME_MAGIC:
+            return
+        return FRAME_PREFIX.size + length
+
+    def parse_frame(self, message):
+        """
+        Return the header dict, iv and ciphertext of a binary frame.
+        Raise ValueError if the frame is malformed.
+        """
+        try:
+            _, version, length = FRAME_PREFIX.unpack_from(message)
+        except struct.error:
+            raise ValueError("truncated frame prefix")
+        if version != FRAME_VERSION:
+            raise ValueError("unsupported frame version %d" % version)
+        end = FRAME_PREFIX.size + length
+        if len(message) < end:
+            raise ValueError("truncated frame: %d/%d bytes" % (len(message), end))
+        if length < FRAME_HEADER_LEN.size:
+            raise ValueError("frame too short: %d bytes" % length)
+        offset = FRAME_PREFIX.size
+        header_len, = FRAME_HEADER_LEN.unpack_from(message, offset)
+        if length < FRAME_HEADER_LEN.size + header_len + FRAME_IV_LEN:
+            raise ValueError("frame too short for a %d bytes header: %d bytes" % (header_len, length))
+        offset += FRAME_HEADER_LEN.size
+        try:
+            header = json.loads(bdecode(bytes(message[offset:offset+header_len])))
+        except RuntimeError:
+            # too deeply nested
+            raise ValueError("frame header is not a dict")
+        if not isinstance(header, dict):
+            raise ValueError("frame header is not a dict")
+        offset += header_len
+        iv = bytes(message[offset:offset+FRAME_IV_LEN])
+        offset += FRAME_IV_LEN
+        return header, iv, bytes(message[offset:end])
+
     def blacklisted(self, sender_id):
         """
         Return True if the sender's problem count is above threshold.
@@ -791,6 +905,21 @@ class Crypt(object):
         data = json.loads(bdecode(data))
         return data
 
+    def h2_conn_request(self, conn, data, sp, method="GET"):
+        """
+        Send a request on the already opened h2 connection <conn> and return
+        the result. Unlike h2_daemon_request(), the transport errors are
+        raised, so the caller can decide to retry on a new connection.
+        """
+        secret = self.get_secret(sp, None)
+        path = self.h2_path_from_data(data)
+        headers = self.h2_headers(secret=secret, multiplexed=data.get("multiplexed"), af=sp.af)
+        body = self.h2_body_from_data(data)
+        headers.update({"Content-Length": str(len(body))})
+        stream_id = conn.request(method, path, headers=headers, body=body)
+        resp = conn.get_response(stream_id)
+        return json.loads(bdecode(resp.read()))
+
     def raw_daemon_request(self, data, server=None, node=None, with_result=True, silent=False,
                            cluster_name=None, secret=None, timeout=0, sp=None, method="GET"):
         """
@@ -5,6 +5,7 @@ import re
 import os
 import copy
 import codecs
+import json
 
 import six
 import rcExceptions as ex
@@ -13,8 +14,19 @@ from rcUtilities import is_string, try_decode, read_cf, eval_expr, unset_lazy, \
                         lazy, makedirs, factory, read_cf_comments
 from rcGlobalEnv import rcEnv
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = dict
+
 SECRETS = []
 
+RE_REF = re.compile(r'{\w*[\w#][\w\.\[\]:\/]*}')
+RE_EXPR = re.compile(r'\$\((.+)\)')
+
+# path => (signature, parsed config data)
+CONFIG_CACHE = {}
+
 class ExtConfigMixin(object):
     def __init__(self, default_status_groups=None):
         self.ref_cache = {}
@@ -630,7 +642,7 @@ class ExtConfigMixin(object):
             return s
         done = ""
         while True:
-            m = re.search(r'{\w*[\w#][\w\.\[\]:\/]*}', s)
+            m = RE_REF.search(s)
             if m is None:
                 return done + s
             ref = m.group(0).strip("{}").lower()
@@ -658,7 +670,7 @@ class ExtConfigMixin(object):
         if not is_string(s):
             return s
         while True:
-            m = re.search(r'\$\((.+)\)', s)
+            m = RE_EXPR.search(s)
             if m is None:
                 return s
             expr = m.group(1)
@@ -674,11 +686,18 @@ class ExtConfigMixin(object):
 
     def handle_references(self, s, scope=False, impersonate=None, cd=None,
                           section=None):
-        cacheable = self.cacheable(s)
+        if not is_string(s) or ("{" not in s and "$(" not in s):
+            # nothing to resolve
+            return s
+        # the implicit section of the references, and the {rid} and
+        # {rindex} references, depend on the section
+        cacheable = cd is None
         if cacheable:
-            key = (str(s), scope, impersonate)
-            if key in self.ref_cache:
+            key = (s, scope, impersonate, section)
+            try:
                 return self.ref_cache[key]
+            except KeyError:
+                pass
         try:
             val = self._handle_references(s, scope=scope,
                                           impersonate=impersonate,
@@ -696,18 +715,6 @@ class ExtConfigMixin(object):
             self.ref_cache[key] = val
         return val
 
-    @staticmethod
-    def cacheable(s):
-        try:
-            s = str(s)
-        except:
-            return False
-        if "{rid}" in s or "{rindex}" in s:
-            # those can take different values in the same service,
-            # being section-dependent
-            return False
-        return True
-
     def oget_scopes(self, *args, **kwargs):
         data = {}
         for node in self.cluster_nodes:
@@ -1319,10 +1326,38 @@ class ExtConfigMixin(object):
             if cat is None or section.startswith(cat+"#"):
                 yield section
 
+    def config_cache_fpath(self, cf):
+        """
+        Return the path of the on-disk parsed config cache of <cf>, or None
+        if the parsed config is only cached in memory.
+        """
+        return
+
     def parse_config_file(self, cf=None):
+        """
+        Return the parsed config of <cf>, from the memory or on-disk cache
+        if the files are unchanged since cached.
+        """
         self.clear_ref_cache()
         if cf is None:
             cf = self.paths.cf
+        sig = config_signature(cf)
+        key = tuple(cf) if isinstance(cf, list) else cf
+        try:
+            cached_sig, data = CONFIG_CACHE[key]
+        except KeyError:
+            cached_sig, data = None, None
+        if cached_sig != sig:
+            cache_fpath = self.config_cache_fpath(cf) if sig else None
+            data = config_cache_load(cache_fpath, sig)
+            if data is None:
+                data = self._parse_config_file(cf)
+                config_cache_store(cache_fpath, sig, data)
+            CONFIG_CACHE[key] = (sig, data)
+        # the callers can modify the returned data
+        return type(data)((section, type(_data)(_data)) for section, _data in data.items())
+
+    def _parse_config_file(self, cf):
         try:
             config = read_cf(cf)
         except Exception as exc:
@@ -1427,6 +1462,62 @@ class ExtConfigMixin(object):
                     ofile.write(buff)
         except Exception as exc:
             raise ex.excError("failed to write %s: %s" % (cf, exc))
+        self.drop_config_cache(cf)
         self.unset_all_lazy()
         self.clear_ref_cache()
 
+    def drop_config_cache(self, cf):
+        """
+        Drop the parsed config caches of <cf>, and of the files lists
+        including <cf>, in case the rewrite did not change its signature.
+        """
+        for key in list(CONFIG_CACHE):
+            if key == cf or (isinstance(key, tuple) and cf in key):
+                CONFIG_CACHE.pop(key, None)
+        fpath = self.config_cache_fpath(cf)
+        if fpath is None:
+            return
+        try:
+            os.unlink(fpath)
+        except OSError:
+            pass
+
+
+def config_signature(cf):
+    """
+    Return the (path, mtime, size, inode) list of the existing <cf> files.
+    """
+    sig = []
+    for fpath in cf if isinstance(cf, list) else [cf]:
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            continue
+        sig.append([fpath, getattr(st, "st_mtime_ns", st.st_mtime), st.st_size, st.st_ino])
+    return sig
+
+
+def config_cache_load(fpath, sig):
+    if fpath is None:
+        return
+    try:
+        with open(fpath, "r") as ofile:
+            cache = json.load(ofile, object_pairs_hook=OrderedDict)
+    except (IOError, OSError, ValueError):
+        return
+    if cache.get("sig") != sig:
+        return
+    return cache.get("data")
+
+
+def config_cache_store(fpath, sig, data):
+    if fpath is None or not sig:
+        return
+    tmpf = fpath + ".tmp"
+    try:
+        fd = os.open(tmpf, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o0600)
+        with os.fdopen(fd, "w") as ofile:
+            json.dump({"sig": sig, "data": data}, ofile, separators=(",", ":"))
+        os.rename(tmpf, fpath)
+    except (IOError, OSError):
+        pass
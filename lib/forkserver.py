@@ -0,0 +1,397 @@
+"""
+The daemon actions fork server.
+
+A process started by the daemon, with the nodemgr and svcmgr modules
+already imported, forking a child per action request. Each child runs the
+command like a new svcmgr or nodemgr process would, with its own
+environment, locks and logs, but without paying the interpreter startup
+and modules import costs.
+
+The daemon talks to the server through a unix socket pair, using
+newline-terminated json messages:
+
+    request:  {"id": <n>, "mgr": "svcmgr", "argv": [...], "env": {...}, "devnull": true}
+    reply:    {"id": <n>, "pid": <pid>} or {"id": <n>, "error": <str>}
+    exit:     {"pid": <pid>, "ret": <exit code>}
+"""
+from __future__ import print_function
+
+import errno
+import json
+import os
+import random
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import six
+import rcExceptions as ex
+
+PRELOAD = [
+    "mgr",
+    "nodemgr",
+    "svcmgr",
+    "node",
+    "svc",
+    "svcBuilder",
+    "resources",
+    "resourceset",
+    "rcScheduler",
+    "rcStatus",
+    "compliance",
+    "checks",
+]
+MGRS = ("nodemgr", "svcmgr")
+REAP_INTERVAL = 0.2
+WAIT_INTERVAL = 0.1
+START_TIMEOUT = 10
+
+
+def send(sock, data):
+    sock.sendall((json.dumps(data) + "\n").encode())
+
+
+class ForkServer(object):
+    """
+    The fork server side, executed by the forkserver.py process.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.buff = b""
+
+    @staticmethod
+    def preload():
+        for modname in PRELOAD:
+            try:
+                __import__(modname)
+            except Exception:
+                # let the children report the error
+                pass
+        # the os-specific node module
+        try:
+            from rcUtilities import ximport
+            ximport("node")
+        except Exception:
+            pass
+
+    def loop(self):
+        while True:
+            self.reap()
+            try:
+                ready, _, _ = select.select([self.sock], [], [], REAP_INTERVAL)
+            except (OSError, select.error):
+                continue
+            if not ready:
+                continue
+            try:
+                data = self.sock.recv(65536)
+            except socket.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                # the daemon closed the channel. let the running children
+                # terminate on their own.
+                break
+            self.buff += data
+            while b"\n" in self.buff:
+                line, self.buff = self.buff.split(b"\n", 1)
+                self.handle(line)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                # ECHILD
+                return
+            if pid == 0:
+                return
+            if os.WIFSIGNALED(status):
+                ret = -os.WTERMSIG(status)
+            else:
+                ret = os.WEXITSTATUS(status)
+            send(self.sock, {"pid": pid, "ret": ret})
+
+    def handle(self, line):
+        try:
+            req = json.loads(line.decode())
+            if req.get("mgr") not in MGRS:
+                raise ValueError("unsupported mgr %s" % req.get("mgr"))
+        except ValueError as exc:
+            send(self.sock, {"error": str(exc)})
+            return
+        try:
+            pid = os.fork()
+        except OSError as exc:
+            send(self.sock, {"id": req.get("id"), "error": str(exc)})
+            return
+        if pid == 0:
+            self.child(req)
+        send(self.sock, {"id": req.get("id"), "pid": pid})
+
+    def child(self, req):
+        ret = 1
+        try:
+            self.sock.close()
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.environ.clear()
+            os.environ.update(req.get("env") or {})
+            if req.get("devnull"):
+                fd = os.open(os.devnull, os.O_RDWR)
+                for _fd in (0, 1, 2):
+                    os.dup2(fd, _fd)
+                os.close(fd)
+            random.seed()
+            ret = self.run(req["mgr"], req["argv"])
+        except SystemExit as exc:
+            ret = exc.code
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            ret = 1
+        finally:
+            if ret is None:
+                ret = 0
+            elif not isinstance(ret, int):
+                ret = 1
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except Exception:
+                pass
+            os._exit(ret)
+
+    @staticmethod
+    def run(mgr, argv):
+        from rcGlobalEnv import rcEnv
+        sys.argv = [os.path.join(rcEnv.paths.pathlib, mgr + ".py")] + argv
+        if mgr == "nodemgr":
+            import nodemgr
+            return nodemgr.main(argv)
+        import svcmgr
+        return svcmgr.Mgr()(argv)
+
+
+class ForkedProc(object):
+    """
+    A Popen-like handle of a fork server child.
+    """
+    stdin = None
+    stdout = None
+    stderr = None
+
+    def __init__(self, client, pid):
+        self.client = client
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            self.client.collect()
+        return self.returncode
+
+    def wait(self):
+        while self.poll() is None:
+            time.sleep(WAIT_INTERVAL)
+        return self.returncode
+
+    def communicate(self, input=None):
+        self.wait()
+        return None, None
+
+    def send_signal(self, sig):
+        if self.returncode is not None:
+            return
+        os.kill(self.pid, sig)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+
+class ForkServerClient(object):
+    """
+    The daemon side of the fork server. The server process is started on
+    first spawn(), and restarted if found dead.
+    """
+    def __init__(self, log=None):
+        self.log = log
+        self.lock = threading.RLock()
+        self.proc = None
+        self.sock = None
+        self.buff = b""
+        self.seq = 0
+        self.procs = {}
+        self.replies = {}
+        self.orphans = {}
+
+    def start(self):
+        from rcGlobalEnv import rcEnv
+        sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        fd = child_sock.fileno()
+        cmd = rcEnv.python_cmd + [os.path.join(rcEnv.paths.pathlib, "forkserver.py"), str(fd)]
+        kwargs = {"stdin": open(os.devnull, "r"), "cwd": os.getcwd()}
+        if six.PY2:
+            kwargs["close_fds"] = False
+        else:
+            kwargs["pass_fds"] = [fd]
+        try:
+            self.proc = subprocess.Popen(cmd, **kwargs)
+        finally:
+            child_sock.close()
+            kwargs["stdin"].close()
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.buff = b""
+        if self.log:
+            self.log.info("fork server started, pid %d", self.proc.pid)
+
+    def stop(self):
+        with self.lock:
+            if self.sock is None:
+                return
+            self.sock.close()
+            self.sock = None
+            try:
+                self.proc.wait()
+            except OSError:
+                pass
+            self.lost()
+
+    def alive(self):
+        return self.sock is not None and self.proc is not None and self.proc.poll() is None
+
+    def spawn(self, mgr, argv, env=None, devnull=False):
+        """
+        Ask the fork server to execute the <mgr> command with <argv>
+        arguments, and return a ForkedProc.
+        """
+        with self.lock:
+            if not self.alive():
+                self.lost()
+                self.start()
+            self.seq += 1
+            req_id = self.seq
+            try:
+                self.sock.setblocking(True)
+                send(self.sock, {
+                    "id": req_id,
+                    "mgr": mgr,
+                    "argv": argv,
+                    "env": dict(env if env is not None else os.environ),
+                    "devnull": devnull,
+                })
+            except socket.error as exc:
+                self.lost()
+                raise ex.excError("fork server send error: %s" % exc)
+            finally:
+                if self.sock:
+                    self.sock.setblocking(False)
+            limit = time.time() + START_TIMEOUT
+            while req_id not in self.replies:
+                if time.time() > limit or not self.collect(timeout=WAIT_INTERVAL):
+                    raise ex.excError("fork server reply timeout")
+            reply = self.replies.pop(req_id)
+            if isinstance(reply, dict):
+                raise ex.excError("fork server: %s" % reply.get("error"))
+            return reply
+
+    def collect(self, timeout=0):
+        """
+        Process the messages sent by the fork server. Return False if the
+        server is lost.
+        """
+        with self.lock:
+            if self.orphans:
+                self.poll_orphans()
+            if self.sock is None:
+                return False
+            try:
+                ready, _, _ = select.select([self.sock], [], [], timeout)
+            except (OSError, select.error):
+                return True
+            if not ready:
+                return True
+            try:
+                data = self.sock.recv(65536)
+            except socket.error as exc:
+                if exc.args[0] in (errno.EAGAIN, errno.EINTR):
+                    return True
+                data = None
+            if not data:
+                self.lost()
+                return False
+            self.buff += data
+            while b"\n" in self.buff:
+                line, self.buff = self.buff.split(b"\n", 1)
+                self.handle(json.loads(line.decode()))
+            return True
+
+    def handle(self, msg):
+        if "id" in msg:
+            if "pid" in msg:
+                # register the child before processing the next messages,
+                # which may include its exit
+                proc = ForkedProc(self, msg["pid"])
+                self.procs[proc.pid] = proc
+                self.replies[msg["id"]] = proc
+            else:
+                self.replies[msg["id"]] = msg
+        elif "pid" in msg:
+            proc = self.procs.pop(msg["pid"], None)
+            if proc:
+                proc.returncode = msg["ret"]
+        elif self.log:
+            self.log.error("fork server: %s", msg.get("error"))
+
+    def lost(self):
+        """
+        The server is gone. Its children are now reparented, so the exit
+        codes won't be reported: poll the pids existence instead.
+        """
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.orphans.update(self.procs)
+        self.procs = {}
+        self.replies = {}
+
+    def poll_orphans(self):
+        for pid, proc in list(self.orphans.items()):
+            try:
+                os.kill(pid, 0)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    continue
+                proc.returncode = 1
+                del self.orphans[pid]
+
+
+def main():
+    fd = int(sys.argv[1])
+    try:
+        maxfd = os.sysconf("SC_OPEN_MAX")
+    except (AttributeError, ValueError):
+        maxfd = 1024
+    os.closerange(3, fd)
+    os.closerange(fd + 1, min(maxfd, 65536))
+    sock = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fd)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = ForkServer(sock)
+    server.preload()
+    server.loop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Filesystem changes watcher.
+
+Use inotify, through the libc, to collect the paths of the files created,
+modified or deleted in a set of directory trees. On platforms without
+inotify, the watcher init raises ex.excInitError, and the callers are
+expected to fallback to polling.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+
+import rcExceptions as ex
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _libc():
+    if not hasattr(os, "uname") or os.uname()[0] != "Linux":
+        raise ex.excInitError("inotify is not supported on this platform")
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError) as exc:
+        raise ex.excInitError("inotify is not supported: %s" % exc)
+    return libc
+
+
+class FsWatcher(object):
+    """
+    Watch directory trees, up to a depth, and accumulate the changed paths.
+
+    The directories created in a watched tree are watched too, and the
+    files they already contain are reported as changed. Directories events
+    are always reported, files events only if <match> returns True for the
+    file path. The watches <mask> defaults to the files creations,
+    closes after write, moves and deletions.
+
+    If the kernel events queue overflows or a watch can not be added, the
+    next changes() call reports a rescan is needed, as changes may have
+    been missed. The directories a watch could not be added to are kept in
+    the unwatched set, as their changes won't ever be reported.
+    """
+    def __init__(self, callback=None, match=None, mask=WATCH_MASK):
+        self.libc = _libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise ex.excInitError("inotify init error: %s" % os.strerror(ctypes.get_errno()))
+        self.callback = callback
+        self.match = match
+        self.mask = mask
+        self.lock = threading.Lock()
+        self.watches = {}
+        self.dirs = {}
+        self.changed = set()
+        self.unwatched = set()
+        self.rescan = False
+        self.thread = None
+        self._stop = False
+
+    def add_tree(self, path, depth=0):
+        """
+        Watch the directory <path> and its subdirectories up to <depth>
+        levels below.
+        """
+        path = os.path.normpath(path)
+        if path in self.dirs:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, path.encode(), self.mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            self.rescan = True
+            raise ex.excError("inotify watch %s error: %s" % (path, os.strerror(err)))
+        self.watches[wd] = (path, depth)
+        self.dirs[path] = wd
+        if depth <= 0:
+            return
+        try:
+            entries = os.listdir(path)
+        except OSError:
+            return
+        for entry in entries:
+            subpath = os.path.join(path, entry)
+            if os.path.isdir(subpath):
+                self.add_tree(subpath, depth-1)
+
+    def report_tree(self, path, depth):
+        """
+        Report the files found in a newly watched directory as changed.
+        """
+        try:
+            entries = os.listdir(path)
+        except OSError:
+            return
+        for entry in entries:
+            subpath = os.path.join(path, entry)
+            if os.path.isdir(subpath):
+                self.changed.add(subpath)
+                if depth > 0:
+                    self.report_tree(subpath, depth-1)
+            elif self.match is None or self.match(subpath):
+                self.changed.add(subpath)
+
+    def read(self):
+        """
+        Read and process the pending inotify events. Return True if changes
+        were recorded.
+        """
+        try:
+            buff = os.read(self.fd, 65536)
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return False
+            raise
+        offset = 0
+        changed = False
+        with self.lock:
+            while offset + EVENT_HEADER.size <= len(buff):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buff, offset)
+                offset += EVENT_HEADER.size
+                name = buff[offset:offset+length].rstrip(b"\0").decode("utf-8", "replace")
+                offset += length
+                changed |= self.process_event(wd, mask, name)
+        return changed
+
+    def process_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.rescan = True
+            return True
+        try:
+            path, depth = self.watches[wd]
+        except KeyError:
+            return False
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            if self.dirs.get(path) == wd:
+                del self.dirs[path]
+            return False
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.changed.add(path)
+            return True
+        fpath = os.path.join(path, name) if name else path
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and depth > 0:
+                try:
+                    self.add_tree(fpath, depth-1)
+                except ex.excError:
+                    self.unwatched.add(fpath)
+                self.report_tree(fpath, depth-1)
+            self.changed.add(fpath)
+            return True
+        if self.match is not None and not self.match(fpath):
+            return False
+        self.changed.add(fpath)
+        return True
+
+    def changes(self):
+        """
+        Return and reset the changed paths set, and a flag set if a full
+        rescan is needed.
+        """
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            rescan, self.rescan = self.rescan, False
+        return changed, rescan
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop = True
+        if self.thread is None:
+            self.close()
+
+    def close(self):
+        os.close(self.fd)
+
+    def loop(self):
+        while not self._stop:
+            try:
+                ready, _, _ = select.select([self.fd], [], [], 1)
+            except (OSError, select.error):
+                continue
+            if not ready:
+                continue
+            if self.read() and self.callback:
+                self.callback()
+        self.close()
@@ -15,6 +15,8 @@ class Handler(object):
     prototype = []
     stream = False
     multiplex = "on-demand"
+    # True if the handler waits for a cluster event before returning
+    long_poll = False
 
     def rbac(self, nodename, thr=None, **kwargs):
         options = self.parse_options(kwargs)
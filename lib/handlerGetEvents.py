@@ -62,13 +62,7 @@ class Handler(handler.Handler):
                     selector=options.selector
                 ),
             }
-            if thr.h2conn:
-                _msg = fevent
-            elif thr.encrypted:
-                _msg = thr.encrypt(fevent)
-            else:
-                _msg = thr.msg_encode(fevent)
-            thr.event_queue.put(_msg)
+            thr.event_queue.put(fevent)
         if not thr in thr.parent.events_clients:
             thr.parent.events_clients.append(thr)
         if not stream_id in thr.events_stream_ids:
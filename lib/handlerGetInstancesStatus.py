@@ -0,0 +1,52 @@
+import handler
+
+class Handler(handler.Handler):
+    """
+    Return the instances status of the selected objects, indexed by path
+    and node.
+
+    The response etag can be passed back in the next request, so the
+    response contains only the json_delta patch to apply to the previous
+    response data, if the daemon still knows the changes since.
+    """
+    routes = (
+        ("GET", "instances_status"),
+        (None, "instances_status"),
+    )
+    prototype = [
+        {
+            "name": "selector",
+            "desc": "An object selector expression to filter the dataset with.",
+            "required": False,
+            "format": "string",
+        },
+        {
+            "name": "namespace",
+            "desc": "A namespace name to filter the dataset with.",
+            "required": False,
+            "format": "string",
+        },
+        {
+            "name": "etag",
+            "desc": "The etag of the last response received, to get only the changes since.",
+            "required": False,
+            "format": "string",
+        },
+    ]
+    access = {
+        "roles": ["guest"],
+        "namespaces": "ANY",
+    }
+
+    # This handler filters data based on user grants.
+    # Don't allow multiplexing to avoid filtering with escalated privs
+    multiplex = "never"
+
+    def action(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        return thr.instances_status(
+            etag=options.etag,
+            namespace=options.namespace,
+            namespaces=thr.get_namespaces(),
+            selector=options.selector,
+        )
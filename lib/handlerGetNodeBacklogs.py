@@ -1,11 +1,13 @@
 import os
+import time
 
 import handler
+import logreader
 from rcGlobalEnv import rcEnv
 
 class Handler(handler.Handler):
     """
-    Return the object logs back to <backlog> bytes.
+    Return the node logs back to <backlog> bytes, or <since> a duration ago.
     """
     routes = (
         ("GET", "node_backlogs"),
@@ -19,11 +21,20 @@ class Handler(handler.Handler):
             "default": "10k",
             "desc": "The per-instance backlog size.",
         },
+        {
+            "name": "since",
+            "required": False,
+            "format": "duration",
+            "default": None,
+            "desc": "Return the records of this last period, across the log rotation, instead of a backlog size.",
+        },
     ]
 
     def action(self, nodename, thr=None, stream_id=None, **kwargs):
         options = self.parse_options(kwargs)
         logfile = os.path.join(rcEnv.paths.pathlog, "node.log")
+        if options.since is not None:
+            return logreader.read_since(logfile, time.time() - options.since)
         ofile = thr._action_logs_open(logfile, options.backlog, "node")
         return thr.read_file_lines(ofile)
 
@@ -1,13 +1,16 @@
 import os
+import time
 
 import handler
+import logreader
 import osvcd_shared as shared
 from rcUtilities import split_path
 from rcExceptions import HTTP
 
 class Handler(handler.Handler):
     """
-    Return the <path> object logs back to <backlog> bytes.
+    Return the <path> object logs back to <backlog> bytes, or <since> a
+    duration ago.
     """
     routes = (
         ("GET", "object_backlogs"),
@@ -28,6 +31,13 @@ class Handler(handler.Handler):
             "default": "10k",
             "desc": "The per-instance backlog size.",
         },
+        {
+            "name": "since",
+            "required": False,
+            "format": "duration",
+            "default": None,
+            "desc": "Return the records of this last period, across the log rotation, instead of a backlog size.",
+        },
     ]
     access = {
         "roles": ["guest"],
@@ -40,6 +50,8 @@ class Handler(handler.Handler):
         if svc is None:
             raise HTTP(404, "%s not found" % options.path)
         logfile = os.path.join(svc.log_d, svc.name+".log")
+        if options.since is not None:
+            return logreader.read_since(logfile, time.time() - options.since)
         ofile = thr._action_logs_open(logfile, options.backlog, svc.path)
         return thr.read_file_lines(ofile)
 
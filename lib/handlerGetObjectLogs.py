@@ -50,5 +50,6 @@ class Handler(handler.Handler):
             "o": self,
             "fn": "h2_push_logs",
             "args": [ofile, True],
+            "watched": thr.parent.watch_log(logfile),
         })
 
@@ -0,0 +1,96 @@
+import time
+
+import handler
+import osvcd_shared as shared
+
+MAX_TIMEOUT = 30
+
+class Handler(handler.Handler):
+    """
+    Return the last relay heartbeat payloads emitted by the nodes of the
+    <cluster_id> cluster, indexed by nodename.
+
+    The slots not updated after the <gen> generation of the <epoch> epoch
+    are omitted. If no slot is updated yet, wait up to <timeout> for a
+    slot update. The <timeout> is capped to 30 seconds.
+    """
+    routes = (
+        ("GET", "relay_slots"),
+        (None, "relay_slots"),
+    )
+    prototype = [
+        {
+            "name": "cluster_id",
+            "desc": "The cluster.id keyword value of the emitting nodes.",
+            "required": False,
+            "format": "string",
+            "default": "",
+        },
+        {
+            "name": "slots",
+            "desc": "The names of the nodes to fetch the last heartbeat message from. All the cluster nodes if not set.",
+            "required": False,
+            "format": "list",
+            "default": [],
+        },
+        {
+            "name": "epoch",
+            "desc": "The relay epoch returned by the previous request. A different epoch means the relay restarted, and all the slots are returned.",
+            "required": False,
+            "format": "string",
+            "default": "",
+        },
+        {
+            "name": "gen",
+            "desc": "The relay generation returned by the previous request. Only the slots updated after this generation are returned.",
+            "required": False,
+            "format": "integer",
+            "default": 0,
+        },
+        {
+            "name": "timeout",
+            "desc": "How long to wait for a slot update, if none is updated after <gen>. This duration is capped to %d seconds." % MAX_TIMEOUT,
+            "required": False,
+            "format": "duration",
+            "default": 0,
+        },
+    ]
+    access = {
+        "roles": ["heartbeat"],
+    }
+    long_poll = True
+
+    def action(self, nodename, thr=None, **kwargs):
+        options = self.parse_options(kwargs)
+        gen = options.gen if options.epoch == shared.RELAY_EPOCH else 0
+        deadline = time.time() + min(options.timeout or 0, MAX_TIMEOUT)
+        with shared.RELAY_LOCK:
+            while True:
+                slots = self.updated_slots(options.cluster_id, options.slots, gen)
+                left = deadline - time.time()
+                if slots or left <= 0 or (thr and thr.stopped()):
+                    break
+                # wake up regularly to honor the listener stop
+                shared.RELAY_CHANGED.wait(min(left, 1))
+            return {
+                "status": 0,
+                "epoch": shared.RELAY_EPOCH,
+                "gen": shared.RELAY_GEN,
+                "slots": slots,
+            }
+
+    @staticmethod
+    def updated_slots(cluster_id, slots, gen):
+        data = {}
+        prefix = cluster_id + "/"
+        for key, slot in shared.RELAY_DATA.items():
+            if not key.startswith(prefix) or slot.get("gen", 0) <= gen:
+                continue
+            slot_nodename = key[len(prefix):]
+            if slots and slot_nodename not in slots:
+                continue
+            data[slot_nodename] = {
+                "data": slot["msg"],
+                "updated": slot["updated"],
+            }
+        return data
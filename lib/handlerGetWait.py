@@ -44,6 +44,7 @@ class Handler(handler.Handler):
         "roles": ["guest"],
         "namespaces": "ANY",
     }
+    long_poll = True
 
     def action(self, nodename, thr=None, stream_id=None, **kwargs):
         thr.selector = "**"
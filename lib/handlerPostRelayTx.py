@@ -49,12 +49,15 @@ class Handler(handler.Handler):
         options = self.parse_options(kwargs)
         key = "/".join([options.cluster_id, nodename])
         with shared.RELAY_LOCK:
+            shared.RELAY_GEN += 1
             shared.RELAY_DATA[key] = {
                 "msg": options.msg,
                 "updated": time.time(),
+                "gen": shared.RELAY_GEN,
                 "cluster_name": options.cluster_name,
                 "cluster_id": options.cluster_id,
                 "ipaddr": options.addr[0],
             }
+            shared.RELAY_CHANGED.notify_all()
         return {"status": 0}
 
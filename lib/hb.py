@@ -150,19 +150,51 @@ class Hb(shared.OsvcThread):
             addr = intf.ipaddr
         return addr
 
-    def get_message(self, nodename=None):
+    def peers_binary(self, nodename=None):
+        """
+        Return True if the peer node, or all the hb peer nodes if <nodename>
+        is not specified, announced the binary message framing support.
+        """
+        if nodename is None:
+            nodenames = [node for node in self.hb_nodes if node != rcEnv.nodename]
+        else:
+            nodenames = [nodename]
+        if not nodenames:
+            return False
+        for node in nodenames:
+            try:
+                features = shared.CLUSTER_DATA[node]["features"]
+            except (KeyError, TypeError):
+                return False
+            if not isinstance(features, list) or "hb_binary" not in features:
+                return False
+        return True
+
+    def get_message(self, nodename=None, binary=False):
+        """
+        Return the message to send to <nodename>, or to all peers if not
+        specified, and its length.
+
+        If <binary> is True, the message is a binary frame. Use it only if
+        peers_binary() is True.
+        """
+        if binary:
+            encrypt = self.encrypt_frame
+        else:
+            encrypt = lambda data: self.encrypt(data, encode=False)
         begin, num = self.get_oldest_gen(nodename)
         if num == 0:
             # we're alone for now. don't send a full status payload.
             # sent a presence announce payload instead.
             self.log.debug("ping node %s", nodename if nodename else "*")
-            message = self.encrypt({
+            message = encrypt({
                 "kind": "ping",
                 "compat": shared.COMPAT_VERSION,
+                "features": shared.FEATURES,
                 "gen": self.get_gen(),
                 "monitor": self.get_node_monitor(),
                 "updated": time.time(), # for hb and relay readers
-            }, encode=False)
+            })
             return message, len(message) if message else 0
         if begin == 0 or begin > shared.GEN:
             self.log.debug("send full node data to %s", nodename if nodename else "*")
@@ -172,11 +204,22 @@ class Hb(shared.OsvcThread):
                 # no pertinent data to send yet (pre-init)
                 self.log.debug("no pertinent data to send yet (pre-init)")
                 return None, 0
+            if binary:
+                if shared.HB_BIN_MSG is not None:
+                    return shared.HB_BIN_MSG, shared.HB_BIN_MSG_LEN
+                with shared.HB_MSG_LOCK:
+                    with shared.CLUSTER_DATA_LOCK:
+                        shared.HB_BIN_MSG = encrypt(shared.CLUSTER_DATA[rcEnv.nodename])
+                    if shared.HB_BIN_MSG is None:
+                        shared.HB_BIN_MSG_LEN = 0
+                    else:
+                        shared.HB_BIN_MSG_LEN = len(shared.HB_BIN_MSG)
+                    return shared.HB_BIN_MSG, shared.HB_BIN_MSG_LEN
             if shared.HB_MSG is not None:
                 return shared.HB_MSG, shared.HB_MSG_LEN
             with shared.HB_MSG_LOCK:
                 with shared.CLUSTER_DATA_LOCK:
-                    shared.HB_MSG = self.encrypt(shared.CLUSTER_DATA[rcEnv.nodename], encode=False)
+                    shared.HB_MSG = encrypt(shared.CLUSTER_DATA[rcEnv.nodename])
                 if shared.HB_MSG is None:
                     shared.HB_MSG_LEN = 0
                 else:
@@ -189,12 +232,12 @@ class Hb(shared.OsvcThread):
                 if gen <= begin:
                     continue
                 data[gen] = delta
-            message = self.encrypt({
+            message = encrypt({
                 "kind": "patch",
                 "deltas": data,
                 "gen": self.get_gen(),
                 "updated": time.time(), # for hb and relay readers
-            }, encode=False)
+            })
             return message, len(message) if message else 0
 
     def store_rx_data(self, data, nodename):
@@ -241,6 +284,8 @@ class Hb(shared.OsvcThread):
                         break
                     try:
                         json_delta.patch(shared.CLUSTER_DATA[nodename], deltas[str(gen)])
+                        for change in deltas[str(gen)]:
+                            shared.node_data_changed(nodename, *change[0])
                         current_gen = gen
                         shared.REMOTE_GEN[nodename] = gen
                         shared.LOCAL_GEN[nodename] = our_gen_on_peer
@@ -275,6 +320,9 @@ class Hb(shared.OsvcThread):
                     rcEnv.nodename: our_gen_on_peer,
                 }
                 shared.CLUSTER_DATA[nodename]["monitor"] = data["monitor"]
+                if "features" in data:
+                    shared.CLUSTER_DATA[nodename]["features"] = data["features"]
+                shared.node_data_changed(nodename)
                 self.log.debug("reset node %s dataset gen, peer has gen %d of our dataset",
                               nodename, shared.LOCAL_GEN[nodename])
                 change = True
@@ -295,6 +343,7 @@ class Hb(shared.OsvcThread):
                 data["services"]["status"] = shared.CLUSTER_DATA[nodename].get("services", {}).get("status", {})
             with shared.CLUSTER_DATA_LOCK:
                 shared.CLUSTER_DATA[nodename] = data
+                shared.node_data_changed(nodename)
                 new_gen = data.get("gen", {}).get(nodename, 0)
                 shared.LOCAL_GEN[nodename] = our_gen_on_peer
                 self.on_nodes_info_change()
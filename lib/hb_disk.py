@@ -3,11 +3,13 @@ Disk Heartbeat
 """
 import sys
 import os
+import io
 import mmap
 import stat
 import errno
 import contextlib
 import json
+import struct
 import time
 
 import osvcd_shared as shared
@@ -29,6 +31,10 @@ class HbDisk(Hb):
 
     MAX_SLOTS = METASIZE // mmap.PAGESIZE
 
+    # binary slot header: magic, updated timestamp, message length
+    SLOT_MAGIC = b"OSVD"
+    SLOT_HEADER = struct.Struct(">4sdI")
+
     def status(self, **kwargs):
         data = Hb.status(self, **kwargs)
         data["stats"] = self.stats
@@ -42,6 +48,7 @@ class HbDisk(Hb):
 
     def configure(self):
         self.dev = None
+        self.fo = None
         self.reset_stats()
         self._configure()
 
@@ -84,6 +91,7 @@ class HbDisk(Hb):
                 raise ex.excAbortAction("%s must be a char device" % new_dev)
 
         if new_dev != self.dev:
+            self.close_fo()
             self.dev = new_dev
             self.flags = new_flags
             self.peer_config = {}
@@ -92,11 +100,18 @@ class HbDisk(Hb):
         with self.hb_fo() as fo:
             self.load_peer_config(fo=fo)
 
-    @contextlib.contextmanager
-    def hb_fo(self):
+    def open_fo(self):
+        """
+        Return the device file object, opening it if not already done.
+
+        The file object is unbuffered, so reads and writes are done directly
+        from and to the page-aligned mmap buffers, as required by directio.
+        """
+        if self.fo is not None:
+            return self.fo
         try:
             fd = os.open(self.dev, self.flags)
-            fo = os.fdopen(fd, 'rb+')
+            self.fo = io.FileIO(fd, "r+")
         except OSError as exc:
             if exc.errno == errno.EINVAL:
                 raise ex.excAbortAction("%s directio is not supported" % self.dev)
@@ -104,17 +119,74 @@ class HbDisk(Hb):
                 raise ex.excAbortAction("error opening %s: %s" % (self.dev, str(exc)))
         except Exception as exc:
             raise ex.excAbortAction("error opening %s: %s" % (self.dev, str(exc)))
+        return self.fo
+
+    def close_fo(self):
+        if getattr(self, "fo", None) is None:
+            return
+        try:
+            self.fo.close()
+        except (OSError, IOError):
+            pass
+        self.fo = None
+
+    @contextlib.contextmanager
+    def hb_fo(self):
+        """
+        Yield the device file object, kept open across loops. Close it on
+        error, so the next loop reopens the device.
+        """
+        fo = self.open_fo()
         try:
             yield fo
         except Exception as exc:
             self.log.error("%s: %s", self.dev, exc)
-        finally:
-            # closing fo also closes fd
-            try:
-                os.fsync(fd)
-            except OSError as exc:
-                self.duplog("error", "%(exc)s", exc=str(exc), nodename="")
-            fo.close()
+            self.close_fo()
+
+    def sync(self, fo):
+        """
+        Flush the device write cache, unless the device is opened with
+        synchronous io.
+        """
+        if self.flags & getattr(os, "O_SYNC", 0):
+            return
+        try:
+            os.fsync(fo.fileno())
+        except OSError as exc:
+            self.duplog("error", "%(exc)s", exc=str(exc), nodename="")
+
+    @staticmethod
+    def page_align(size):
+        return -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    @staticmethod
+    def read_into(fo, buff, offset, start=0, end=None):
+        """
+        Read the device at <offset>+<start> into <buff>[<start>:<end>].
+        The boundaries must be page-aligned for directio.
+        """
+        try:
+            view = memoryview(buff)[start:end]
+        except TypeError:
+            # the py2 mmap does not support the buffer protocol
+            fo.seek(offset, os.SEEK_SET)
+            return fo.readinto(buff)
+        fo.seek(offset + start, os.SEEK_SET)
+        return fo.readinto(view)
+
+    @staticmethod
+    def write_from(fo, buff, offset, end=None):
+        """
+        Write <buff>[:<end>] to the device at <offset>. <end> must be
+        page-aligned for directio.
+        """
+        fo.seek(offset, os.SEEK_SET)
+        try:
+            view = memoryview(buff)[:end]
+        except TypeError:
+            # the py2 mmap does not support the buffer protocol
+            view = buff
+        fo.write(view)
 
     @staticmethod
     def meta_slot_offset(slot):
@@ -122,8 +194,7 @@ class HbDisk(Hb):
 
     def meta_read_slot(self, slot, fo=None):
         offset = self.meta_slot_offset(slot)
-        fo.seek(offset, os.SEEK_SET)
-        fo.readinto(self.meta_slot_buff)
+        self.read_into(fo, self.meta_slot_buff, offset)
         try:
             return bdecode(self.meta_slot_buff[:mmap.PAGESIZE])
         except Exception as exc:
@@ -136,20 +207,60 @@ class HbDisk(Hb):
         self.meta_slot_buff.seek(0)
         self.meta_slot_buff.write(data)
         offset = self.meta_slot_offset(slot)
-        fo.seek(offset, os.SEEK_SET)
-        fo.write(self.meta_slot_buff)
-        fo.flush()
+        self.write_from(fo, self.meta_slot_buff, offset)
+        self.sync(fo)
 
     def slot_offset(self, slot):
         return self.METASIZE + slot * self.SLOTSIZE
 
-    def read_slot(self, slot, fo=None):
+    def read_slot(self, slot, fo=None, last_updated=None):
+        """
+        Return the slot data as a dict with "msg" and "updated" keys.
+
+        The binary slot format embeds these in a fixed header, the legacy
+        format is a nul-terminated json document.
+
+        Only the first page of the slot is read, then the pages holding the
+        rest of the message if any. If the binary header "updated" value is
+        <last_updated>, the message is not read and "msg" is None.
+        """
         offset = self.slot_offset(slot)
-        fo.seek(offset, os.SEEK_SET)
-        fo.readinto(self.slot_buff)
-        data = bdecode(self.slot_buff[:])
-        end = data.index("\0")
-        return data[:end]
+        self.read_into(fo, self.slot_buff, offset, end=mmap.PAGESIZE)
+        if self.slot_buff[:len(self.SLOT_MAGIC)] == self.SLOT_MAGIC:
+            _, updated, length = self.SLOT_HEADER.unpack_from(self.slot_buff)
+            if updated == last_updated:
+                return {
+                    "msg": None,
+                    "updated": updated,
+                }
+            start = self.SLOT_HEADER.size
+            end = start + length
+            if end > self.SLOTSIZE:
+                raise ex.excError("invalid message length %d" % length)
+            if end > mmap.PAGESIZE:
+                self.read_into(fo, self.slot_buff, offset, start=mmap.PAGESIZE, end=self.page_align(end))
+            return {
+                "msg": self.slot_buff[start:end],
+                "updated": updated,
+            }
+        end = self.slot_buff.find(b"\0", 0, mmap.PAGESIZE)
+        if end < 0:
+            self.read_into(fo, self.slot_buff, offset, start=mmap.PAGESIZE)
+            end = self.slot_buff.find(b"\0", 0)
+        if end < 0:
+            raise ex.excError("unterminated message")
+        return json.loads(bdecode(self.slot_buff[:end]))
+
+    def format_slot(self, message, binary=False):
+        """
+        Return the slot data embedding <message>.
+        """
+        if binary:
+            return self.SLOT_HEADER.pack(self.SLOT_MAGIC, time.time(), len(message)) + message
+        return (json.dumps({
+            "msg": message,
+            "updated": time.time(),
+        })+'\0').encode()
 
     def write_slot(self, slot, data, fo=None):
         if len(data) > self.SLOTSIZE:
@@ -158,9 +269,8 @@ class HbDisk(Hb):
         self.slot_buff.seek(0)
         self.slot_buff.write(data)
         offset = self.slot_offset(slot)
-        fo.seek(offset, os.SEEK_SET)
-        fo.write(self.slot_buff)
-        fo.flush()
+        self.write_from(fo, self.slot_buff, offset, end=self.page_align(len(data)))
+        self.sync(fo)
 
     def load_peer_config(self, fo=None, verbose=True):
         for nodename in self.hb_nodes:
@@ -230,6 +340,7 @@ class HbDiskTx(HbDisk):
             while True:
                 self.do()
                 if self.stopped():
+                    self.close_fo()
                     sys.exit(0)
                 with shared.HB_TX_TICKER:
                     shared.HB_TX_TICKER.wait(self.default_hb_period)
@@ -248,20 +359,20 @@ class HbDiskTx(HbDisk):
         slot = self.peer_config[rcEnv.nodename]["slot"]
         if slot < 0:
             return
-        message, message_bytes = self.get_message()
+        binary = self.peers_binary()
+        message, message_bytes = self.get_message(binary=binary)
         if message is None:
             return
 
-        data = (json.dumps({
-            "msg": message,
-            "updated": time.time(),
-        })+'\0').encode()
+        data = self.format_slot(message, binary=binary)
         try:
             self.write_slot(slot, data, fo=fo)
             self.set_last()
             self.push_stats(message_bytes)
             #self.log.info("written to %s slot %s", self.dev, slot)
         except Exception as exc:
+            if isinstance(exc, (OSError, IOError)):
+                self.close_fo()
             self.push_stats()
             if self.get_last().success:
                 self.log.error("write to %s slot %d error: %s", self.dev,
@@ -276,6 +387,7 @@ class HbDiskRx(HbDisk):
     """
     def __init__(self, name):
         HbDisk.__init__(self, name, role="rx")
+        # the last read slots updated timestamps, indexed by slot
         self.last_updated = {}
 
     def run(self):
@@ -299,6 +411,7 @@ class HbDiskRx(HbDisk):
                         self.load_peer_config(fo=fo)
             self.do()
             if self.stopped():
+                self.close_fo()
                 sys.exit(0)
             with shared.HB_TX_TICKER:
                 shared.HB_TX_TICKER.wait(self.default_hb_period)
@@ -313,13 +426,26 @@ class HbDiskRx(HbDisk):
 
     def _do(self, fo):
         self.reload_config()
+        reopen = False
         for nodename, data in self.peer_config.items():
             if nodename == rcEnv.nodename:
                 continue
-            if data["slot"] < 0:
+            slot = data["slot"]
+            if slot < 0:
                 continue
             try:
-                slot_data = json.loads(self.read_slot(data["slot"], fo=fo))
+                last_updated = self.last_updated.get(slot)
+                slot_data = self.read_slot(slot, fo=fo, last_updated=last_updated)
+                updated = slot_data["updated"]
+                if slot_data["msg"] is None or updated == last_updated:
+                    # remote tx has not rewritten its slot
+                    #self.log.info("node %s has not updated its slot", nodename)
+                    continue
+                if updated < time.time() - self.timeout:
+                    # discard too old dataset
+                    continue
+                # don't decrypt this dataset again, even if invalid
+                self.last_updated[slot] = updated
                 _clustername, _nodename, _data = self.decrypt(slot_data["msg"])
                 if _clustername != self.cluster_name:
                     continue
@@ -332,27 +458,21 @@ class HbDiskRx(HbDisk):
                     self.log.warning("node %s has written its data in node %s "
                                      "reserved slot", _nodename, nodename)
                     nodename = _nodename
-                updated = slot_data["updated"]
-                last_updated = self.last_updated.get(nodename)
-                if last_updated is not None and last_updated == updated:
-                    # remote tx has not rewritten its slot
-                    #self.log.info("node %s has not updated its slot", nodename)
-                    continue
-                if updated < time.time() - self.timeout:
-                    # discard too old dataset
-                    continue
-                self.last_updated[nodename] = updated
                 self.store_rx_data(_data, nodename)
-                self.push_stats(len(slot_data))
+                self.push_stats(len(slot_data["msg"]))
                 self.set_last(nodename)
             except Exception as exc:
+                if isinstance(exc, (OSError, IOError)):
+                    reopen = True
                 self.push_stats()
                 if self.get_last(nodename).success:
                     self.log.error("read from %s slot %d (%s) error: %s", self.dev,
-                                   data["slot"], nodename, str(exc))
+                                   slot, nodename, str(exc))
                 self.set_last(nodename, success=False)
             finally:
                 self.set_beating(nodename)
+        if reopen:
+            self.close_fo()
 
 
 
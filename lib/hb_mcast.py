@@ -9,6 +9,8 @@ import uuid
 import json
 import time
 
+from six.moves import queue
+
 import rcExceptions as ex
 import osvcd_shared as shared
 from rcGlobalEnv import rcEnv
@@ -18,6 +20,88 @@ from hb import Hb
 MAX_MESSAGES = 100
 MAX_FRAGMENTS = 1000
 
+# the bytes reserved by the pending fragmented messages of a sender. The
+# largest legit message is MAX_FRAGMENTS fragments of max_data bytes.
+MAX_PENDING_BYTES = 2 * 1024 * 1024
+
+# the complete messages are decrypted by a fixed pool of workers, each with
+# a bounded queue. The messages of a sender are always handled by the same
+# worker, so they are handled in order.
+DECRYPT_WORKERS = 4
+MAX_QUEUED = 100
+
+# binary fragment header: magic, message uuid, fragment index, fragments count
+FRAGMENT_MAGIC = b"OSVF"
+FRAGMENT_HEADER = struct.Struct(">4s16sHH")
+
+class Fragments(object):
+    """
+    The reassembly buffer of a fragmented message.
+
+    The binary message fragments all have the same size, except the last
+    one, so they are copied at their final offset in a buffer allocated
+    when the first fragment arrives. The legacy json message fragments are
+    joined when the message is complete.
+
+    The fragments headers are not authenticated, so the fragments larger
+    than the sender <max_size> are rejected, and add() refuses to reserve
+    more than the <budget> bytes it is passed.
+    """
+    def __init__(self, total, max_size):
+        self.total = total
+        self.max_size = max_size
+        self.received = set()
+        self.stride = None
+        self.buff = None
+        self.tail = None
+        self.chunks = None
+        self.size = 0
+
+    def add(self, idx, chunk, budget=None):
+        """
+        Store the <idx> fragment. Return True if the message is complete.
+        Raise ValueError if the fragment is invalid or needs more than
+        <budget> bytes.
+        """
+        if idx < 1 or idx > self.total or idx in self.received:
+            return False
+        if len(chunk) > self.max_size:
+            raise ValueError("fragment %d size %d, max %d" % (idx, len(chunk), self.max_size))
+        if not isinstance(chunk, memoryview) or idx == self.total:
+            needed = len(chunk)
+        elif self.stride is None:
+            needed = len(chunk) * (self.total - 1)
+        else:
+            needed = 0
+        if budget is not None and needed > budget:
+            raise ValueError("pending fragments size exceeds %d bytes" % MAX_PENDING_BYTES)
+        self.size += needed
+        if not isinstance(chunk, memoryview):
+            if self.chunks is None:
+                self.chunks = {}
+            self.chunks[idx] = chunk
+        elif idx == self.total:
+            self.tail = bytes(chunk)
+        else:
+            if self.stride is None:
+                self.stride = len(chunk)
+                self.buff = bytearray(needed)
+            elif len(chunk) != self.stride:
+                raise ValueError("fragment %d size %d, expected %d" % (idx, len(chunk), self.stride))
+            offset = (idx - 1) * self.stride
+            self.buff[offset:offset+self.stride] = chunk
+        self.received.add(idx)
+        return len(self.received) == self.total
+
+    def message(self):
+        if self.chunks is not None:
+            return "".join(self.chunks[idx] for idx in sorted(self.chunks))
+        if self.buff is None:
+            return self.tail
+        self.buff.extend(self.tail)
+        return self.buff
+
+
 class HbMcast(Hb):
     """
     A class factorizing common methods and properties for the multicast
@@ -78,7 +162,6 @@ class HbMcast(Hb):
             self.intf = "any"
             self.src_addr = "0.0.0.0"
             self.mreq = struct.pack("4sl", group, socket.INADDR_ANY)
-        self.max_handlers = len(self.hb_nodes) * 4
 
         # log changes
         changes = []
@@ -160,24 +243,28 @@ class HbMcastTx(HbMcast):
     def do(self):
         self.janitor_procs()
         self.reload_config()
-        message, message_bytes = self.get_message()
+        binary = self.peers_binary()
+        message, message_bytes = self.get_message(binary=binary)
         if message is None:
             return
 
         #self.log.info("sending to %s:%s", self.addr, self.port)
         try:
             idx = 1
-            mid = str(uuid.uuid4())
+            mid = uuid.uuid4()
             total = message_bytes // self.max_data
             if message_bytes % self.max_data:
                 total += 1
             for chunk in chunker(message, self.max_data):
-                payload = (json.dumps({
-                    "id": mid,
-                    "i": idx,
-                    "n": total,
-                    "c": chunk,
-                }) + "\0").encode()
+                if binary:
+                    payload = FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, mid.bytes, idx, total) + chunk
+                else:
+                    payload = (json.dumps({
+                        "id": str(mid),
+                        "i": idx,
+                        "n": total,
+                        "c": chunk,
+                    }) + "\0").encode()
                 sent = self.sock.sendto(payload, self.group)
                 #self.log.info("send %s %d/%d", mid, idx, total)
                 idx += 1
@@ -202,10 +289,12 @@ class HbMcastRx(HbMcast):
     """
     The multicast heartbeat rx class.
     """
-    fragments = {}
-
     def __init__(self, name):
         HbMcast.__init__(self, name, role="rx")
+        self.fragments = {}
+        self.queues = []
+        self.last_messages = {}
+        self.buff = bytearray(shared.MAX_MSG_SIZE)
 
     def _configure(self):
         changed = self.apply_changes()
@@ -244,54 +333,91 @@ class HbMcastRx(HbMcast):
             self.configure()
         except ex.excAbortAction:
             return
+        self.start_workers()
 
         while True:
             self.do()
             if self.stopped():
+                self.stop_workers()
                 self.join_threads()
                 self.sock.close()
                 sys.exit(0)
 
-    def do(self):
-        def handle(data, addr):
+    def start_workers(self):
+        for _ in range(DECRYPT_WORKERS):
+            worker_queue = queue.Queue(maxsize=MAX_QUEUED)
+            thr = threading.Thread(target=self.worker, args=(worker_queue,))
+            thr.daemon = True
+            thr.start()
+            self.threads.append(thr)
+            self.queues.append(worker_queue)
+
+    def stop_workers(self):
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        self.queues = []
+
+    def worker(self, worker_queue):
+        while True:
+            task = worker_queue.get()
+            if task is None:
+                return
             try:
-                thr = threading.Thread(target=self.handle_client, args=(data, addr))
-                thr.start()
-                self.threads.append(thr)
-            except RuntimeError as exc:
-                self.log.warning(exc)
+                self.handle_client(*task)
+            except Exception as exc:
+                self.log.exception(exc)
+
+    def handle(self, message, addr):
+        """
+        Queue the complete <message> for decryption by the worker assigned
+        to the sender.
+        """
+        worker_queue = self.queues[hash(addr) % len(self.queues)]
+        try:
+            worker_queue.put_nowait((message, addr))
+        except queue.Full:
+            self.log.warning("drop message received from %s: too many queued messages (%d)",
+                             addr, MAX_QUEUED)
 
+    def do(self):
         self.reload_config()
         self.janitor_procs()
-        self.janitor_threads()
 
         try:
-            data, addr = self.sock.recvfrom(shared.MAX_MSG_SIZE)
-            self.push_stats(len(data))
+            size, addr = self.sock.recvfrom_into(self.buff)
+            self.push_stats(size)
         except socket.timeout:
             self.set_peers_beating()
             return
+        self.handle_datagram(memoryview(self.buff)[:size], addr)
+
+    def handle_datagram(self, data, addr):
+        """
+        Reassemble the fragmented messages, and pass the complete messages
+        to handle().
+        """
+        if data[:len(FRAGMENT_MAGIC)] == FRAGMENT_MAGIC:
+            try:
+                _, mid, idx, total = FRAGMENT_HEADER.unpack_from(data)
+            except struct.error:
+                return
+            chunk = data[FRAGMENT_HEADER.size:]
+        else:
+            data = data.tobytes()
+            try:
+                payload = json.loads(bdecode(data).rstrip("\0\x00"))
+            except (ValueError, TypeError) as exc:
+                # old format ? try decrypt. will blacklist if failed.
+                self.handle(data, addr)
+                return
 
-        if len(self.threads) >= self.max_handlers:
-            self.log.warning("drop message received from %s: too many running handlers (%d)",
-                             addr, self.max_handlers)
-            self.fragments = {}
-            return
-
-        try:
-            payload = json.loads(bdecode(data).rstrip("\0\x00"))
-        except (ValueError, TypeError) as exc:
-            # old format ? try decrypt. will blacklist if failed.
-            handle(data, addr)
-            return
-
-        try:
-            mid = payload["id"]
-            chunk = payload["c"]
-            idx = payload["i"]
-            total = payload["n"]
-        except KeyError:
-            return
+            try:
+                mid = payload["id"]
+                chunk = payload["c"]
+                idx = payload["i"]
+                total = payload["n"]
+            except KeyError:
+                return
 
         # verify message DoS
         if addr not in self.fragments:
@@ -301,28 +427,40 @@ class HbMcastRx(HbMcast):
             self.fragments[addr] = {}
 
         # verify fragment DoS
-        if mid not in self.fragments[addr]:
-            self.fragments[addr][mid] = {}
-        elif len(self.fragments[addr][mid]) > MAX_FRAGMENTS:
-            self.log.warning("too many pending message fragments. purge")
-            del self.fragments[addr][mid]
+        if total > MAX_FRAGMENTS:
+            self.log.warning("too many message fragments (%d). drop", total)
             return
 
-        # store fragment
-        self.fragments[addr][mid][idx] = chunk
-
-        if len(self.fragments[addr][mid]) != total:
-            # not yet complete
-            return
-
-        #self.log.debug("message %s complete", mid)
-        message = ""
-        for idx in sorted(self.fragments[addr][mid].keys()):
-            message += self.fragments[addr][mid][idx]
-        handle(message, addr)
+        if total == 1:
+            # not fragmented
+            message = chunk.tobytes() if isinstance(chunk, memoryview) else chunk
+        else:
+            if mid not in self.fragments[addr]:
+                self.fragments[addr][mid] = Fragments(total, self.max_data)
+            pending = sum(frags.size for frags in self.fragments[addr].values())
+            try:
+                complete = self.fragments[addr][mid].add(idx, chunk, budget=MAX_PENDING_BYTES-pending)
+            except (ValueError, TypeError) as exc:
+                self.log.warning("drop message from %s: %s", addr, exc)
+                del self.fragments[addr][mid]
+                return
+            if not complete:
+                return
+            #self.log.debug("message %s complete", mid)
+            message = self.fragments[addr][mid].message()
+        self.handle(message, addr)
         self.fragments[addr] = {}
 
     def handle_client(self, message, addr):
+        last = self.last_messages.get(addr)
+        if last and last[0] == message and last[2] > time.time() - self.timeout:
+            # the sender resent its cached message: the data did not change
+            # since we last stored it, save the decryption.
+            nodename = last[1]
+            self.set_last(nodename)
+            self.set_beating(nodename)
+            self.set_peers_beating()
+            return
         clustername, nodename, data = self.decrypt(message, sender_id=addr[0])
         if clustername != self.cluster_name:
             # surely from drp node
@@ -339,6 +477,7 @@ class HbMcastRx(HbMcast):
         try:
             self.store_rx_data(data, nodename)
             self.set_last(nodename)
+            self.last_messages[addr] = (message, nodename, time.time())
         except Exception as exc:
             if self.get_last(nodename).success:
                 self.log.error("%s", exc)
@@ -128,6 +128,11 @@ class HbRelayRx(HbRelay):
     def __init__(self, name):
         HbRelay.__init__(self, name, role="rx")
         self.last_updated = {}
+        # the relay_slots generation cursor
+        self.relay_epoch = ""
+        self.relay_gen = 0
+        # False if the relay does not support the batched relay_slots fetch
+        self.relay_slots = True
 
     def run(self):
         self.set_tid()
@@ -147,35 +152,52 @@ class HbRelayRx(HbRelay):
             with shared.HB_TX_TICKER:
                 shared.HB_TX_TICKER.wait(self.default_hb_period)
 
+    def peers(self):
+        return [nodename for nodename in self.hb_nodes if nodename != rcEnv.nodename]
+
     def do(self):
         self.janitor_procs()
         self.reload_config()
-        for nodename in self.hb_nodes:
-            if nodename == rcEnv.nodename:
-                continue
+        if self.relay_slots:
+            self.do_slots()
+        else:
+            self.do_slot_by_slot()
+
+    def do_slots(self):
+        """
+        Fetch the peers slots updated since the last fetch, in a single
+        request.
+        """
+        peers = self.peers()
+        try:
+            slots = self.receive_slots(peers)
+        except ex.excError as exc:
+            for nodename in peers:
+                self.push_stats()
+                if self.get_last(nodename).success:
+                    self.log.error("read from relay %s slots error: %s", self.relay, str(exc))
+                self.set_last(nodename, success=False)
+                self.set_beating(nodename)
+            return
+        if slots is None:
+            self.log.info("relay %s does not support the batched slots fetch, "
+                          "fall back to slot by slot fetch", self.relay)
+            self.relay_slots = False
+            self.do_slot_by_slot()
+            return
+        for nodename in peers:
+            try:
+                if nodename in slots:
+                    updated, slot_data = slots[nodename]
+                    self.handle_slot(nodename, updated, slot_data)
+            finally:
+                self.set_beating(nodename)
+
+    def do_slot_by_slot(self):
+        for nodename in self.peers():
             try:
                 updated, slot_data = self.receive(nodename)
-                _clustername, _nodename, _data = self.decrypt(slot_data, sender_id=self.relay)
-                if _clustername != self.cluster_name:
-                    continue
-                if _nodename is None:
-                    # invalid crypt
-                    #self.log.warning("can't decrypt data in node %s slot",
-                    #                 nodename)
-                    continue
-                if _nodename != nodename:
-                    self.log.warning("node %s has written its data in node %s "
-                                     "reserved slot", _nodename, nodename)
-                    nodename = _nodename
-                last_updated = self.last_updated.get(nodename)
-                if last_updated is not None and last_updated == updated:
-                    # remote tx has not rewritten its slot
-                    #self.log.info("node %s has not updated its slot", nodename)
-                    continue
-                self.last_updated[nodename] = updated
-                self.store_rx_data(_data, nodename)
-                self.push_stats(len(_data))
-                self.set_last(nodename)
+                self.handle_slot(nodename, updated, slot_data)
             except Exception as exc:
                 self.push_stats()
                 if self.get_last(nodename).success:
@@ -185,6 +207,71 @@ class HbRelayRx(HbRelay):
             finally:
                 self.set_beating(nodename)
 
+    def handle_slot(self, nodename, updated, slot_data):
+        try:
+            _clustername, _nodename, _data = self.decrypt(slot_data, sender_id=self.relay)
+            if _clustername != self.cluster_name:
+                return
+            if _nodename is None:
+                # invalid crypt
+                #self.log.warning("can't decrypt data in node %s slot",
+                #                 nodename)
+                return
+            if _nodename != nodename:
+                self.log.warning("node %s has written its data in node %s "
+                                 "reserved slot", _nodename, nodename)
+                nodename = _nodename
+            last_updated = self.last_updated.get(nodename)
+            if last_updated is not None and last_updated == updated:
+                # remote tx has not rewritten its slot
+                #self.log.info("node %s has not updated its slot", nodename)
+                return
+            self.last_updated[nodename] = updated
+            self.store_rx_data(_data, nodename)
+            self.push_stats(len(_data))
+            self.set_last(nodename)
+        except Exception as exc:
+            self.push_stats()
+            if self.get_last(nodename).success:
+                self.log.error("read from relay %s slot %s error: %s", self.relay,
+                               nodename, str(exc))
+            self.set_last(nodename, success=False)
+
+    def receive_slots(self, peers):
+        """
+        Return the {nodename: (updated, data)} dict of the <peers> slots
+        updated since the last call, or None if the relay does not support
+        the relay_slots request.
+        """
+        request = {
+            "action": "relay_slots",
+            "options": {
+                "cluster_id": self.cluster_id,
+                "slots": peers,
+                "epoch": self.relay_epoch,
+                "gen": self.relay_gen,
+            },
+        }
+        resp = self.daemon_get(request, cluster_name="join", server="raw://"+self.relay, secret=self.secret)
+        if resp is None:
+            raise ex.excError("no response reading relay slots")
+        if resp.get("status") == 501:
+            return
+        if resp.get("status", 1) != 0:
+            raise ex.excError("return status not 0 reading relay slots")
+        if not isinstance(resp.get("slots"), dict) or resp.get("gen") is None:
+            raise ex.excError("no 'slots' or 'gen' key in response reading relay slots")
+        slots = {}
+        for nodename, slot in resp["slots"].items():
+            try:
+                # python3
+                slots[nodename] = slot["updated"], bytes(slot["data"], "ascii")
+            except TypeError:
+                slots[nodename] = slot["updated"], slot["data"]
+        self.relay_epoch = resp.get("epoch", "")
+        self.relay_gen = resp["gen"]
+        return slots
+
     def receive(self, nodename):
         request = {
             "action": "relay_rx",
@@ -3,6 +3,7 @@ Unicast Heartbeat module
 """
 import sys
 import socket
+import select
 import threading
 import time
 
@@ -10,7 +11,14 @@ import six
 import rcExceptions as ex
 import osvcd_shared as shared
 from rcGlobalEnv import rcEnv
+from comm import FRAME_MAGIC, FRAME_PREFIX
 from hb import Hb
+from storage import Storage
+
+# reconnect backoff bounds, in seconds
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
 
 class HbUcast(Hb):
     """
@@ -78,12 +86,155 @@ class HbUcast(Hb):
 
         self.max_handlers = len(self.hb_nodes) * 4
 
+
+class UcastPeer(object):
+    """
+    The connection to a unicast heartbeat peer, with its own sender thread
+    so a slow or unreachable peer does not delay the transmission to the
+    others.
+
+    The connection is kept open between messages if the peer supports the
+    binary framing (older peers close the connection after each message).
+    """
+    def __init__(self, hb, nodename):
+        self.hb = hb
+        self.nodename = nodename
+        self.sock = None
+        self.message = None
+        self.message_bytes = 0
+        self.persistent = False
+        self.backoff = 0
+        self.next_connect = 0
+        self.connected_once = False
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.stats = Storage({
+            "reconnects": 0,
+            "send_latency": 0.0,
+            "max_send_latency": 0.0,
+        })
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, message, message_bytes, persistent=False):
+        """
+        Queue a message for the sender thread. A message not yet sent is
+        replaced, as it is superseded by the new one.
+        """
+        with self.cond:
+            self.message = message
+            self.message_bytes = message_bytes
+            self.persistent = persistent
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.message is None and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    self.close()
+                    return
+                message = self.message
+                message_bytes = self.message_bytes
+                persistent = self.persistent
+                self.message = None
+            try:
+                self.do(message, message_bytes, persistent)
+            except Exception as exc:
+                self.hb.log.exception(exc)
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+        self.sock = None
+
+    def connect(self, config, persistent=False):
+        """
+        Open the connection to the peer. Only the persistent connections
+        re-openings are counted as reconnects, as the legacy peers need a
+        new connection per message.
+        """
+        if persistent and self.connected_once:
+            self.stats.reconnects += 1
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(1)
+            sock.bind((self.hb.peer_config[rcEnv.nodename]["addr"], 0))
+            sock.connect((config["addr"], config["port"]))
+        except Exception:
+            sock.close()
+            raise
+        if persistent:
+            self.connected_once = True
+        self.sock = sock
+
+    def do(self, message, message_bytes, persistent):
+        config = self.hb.peer_config.get(self.nodename)
+        if config is None:
+            return
+        begin = time.time()
+        if begin < self.next_connect:
+            # in reconnect backoff
+            self.hb.set_beating(self.nodename)
+            return
+        try:
+            if self.sock is None:
+                self.connect(config, persistent=persistent)
+            self.sock.sendall(message)
+            self.backoff = 0
+            self.hb.set_last(self.nodename)
+            self.hb.push_stats(message_bytes)
+        except socket.timeout as exc:
+            self.close()
+            self.set_backoff()
+            self.hb.push_stats()
+            if self.hb.get_last(self.nodename).success:
+                self.hb.log.warning("send to %s (%s:%d) timeout", self.nodename,
+                                    config["addr"], config["port"])
+            self.hb.set_last(self.nodename, success=False)
+        except socket.error as exc:
+            self.close()
+            self.set_backoff()
+            self.hb.push_stats()
+            if self.hb.get_last(self.nodename).success:
+                self.hb.log.warning("send to %s (%s:%d) error: %s", self.nodename,
+                                    config["addr"], config["port"], str(exc))
+            self.hb.set_last(self.nodename, success=False)
+        finally:
+            if not persistent:
+                self.close()
+            latency = time.time() - begin
+            self.stats.send_latency = latency
+            if latency > self.stats.max_send_latency:
+                self.stats.max_send_latency = latency
+            self.hb.set_beating(self.nodename)
+
+    def set_backoff(self):
+        if self.backoff:
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        else:
+            self.backoff = MIN_BACKOFF
+        self.next_connect = time.time() + self.backoff
+
+
 class HbUcastTx(HbUcast):
     """
     The unicast heartbeat tx class.
     """
     def __init__(self, name):
         HbUcast.__init__(self, name, role="tx")
+        self.peer_conns = {}
 
     def run(self):
         self.set_tid()
@@ -96,6 +247,7 @@ class HbUcastTx(HbUcast):
             while True:
                 self.do()
                 if self.stopped():
+                    self.stop_peer_conns()
                     sys.exit(0)
                 with shared.HB_TX_TICKER:
                     shared.HB_TX_TICKER.wait(self.default_hb_period)
@@ -105,53 +257,54 @@ class HbUcastTx(HbUcast):
     def status(self, **kwargs):
         data = HbUcast.status(self, **kwargs)
         data["config"] = {}
+        for nodename, peer in list(self.peer_conns.items()):
+            try:
+                data["peers"][nodename].update(peer.stats)
+            except KeyError:
+                continue
         return data
 
+    def stop_peer_conns(self, keep=None):
+        for nodename in list(self.peer_conns):
+            if keep and nodename in keep:
+                continue
+            self.peer_conns[nodename].stop()
+            del self.peer_conns[nodename]
+
     def do(self):
         self.janitor_procs()
         self.reload_config()
-        message, message_bytes = self.get_message()
-        if message is None:
-            return
+        messages = {}
+        peers = [nodename for nodename in self.peer_config if nodename != rcEnv.nodename]
+        self.stop_peer_conns(keep=peers)
 
-        for nodename, config in self.peer_config.items():
-            if nodename == rcEnv.nodename:
+        for nodename in peers:
+            binary = self.peers_binary(nodename)
+            if binary not in messages:
+                messages[binary] = self.get_message(binary=binary)
+            message, message_bytes = messages[binary]
+            if message is None:
                 continue
-            self._do(message, message_bytes, nodename, config)
+            if not binary:
+                message = (message+"\0").encode()
+            if nodename not in self.peer_conns:
+                self.peer_conns[nodename] = UcastPeer(self, nodename)
+            self.peer_conns[nodename].send(message, message_bytes, persistent=binary)
 
-    def _do(self, message, message_bytes, nodename, config):
-        try:
-            #self.log.info("sending to %s:%s", config["addr"], config["port"])
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            sock.bind((self.peer_config[rcEnv.nodename]["addr"], 0))
-            sock.connect((config["addr"], config["port"]))
-            sock.sendall((message+"\0").encode())
-            self.set_last(nodename)
-            self.push_stats(message_bytes)
-        except socket.timeout as exc:
-            self.push_stats()
-            if self.get_last(nodename).success:
-                self.log.warning("send to %s (%s:%d) timeout", nodename,
-                                 config["addr"], config["port"])
-            self.set_last(nodename, success=False)
-        except socket.error as exc:
-            self.push_stats()
-            if self.get_last(nodename).success:
-                self.log.warning("send to %s (%s:%d) error: %s", nodename,
-                                 config["addr"], config["port"], str(exc))
-            self.set_last(nodename, success=False)
-        finally:
-            self.set_beating(nodename)
-            sock.close()
 
 class HbUcastRx(HbUcast):
     """
     The unicast heartbeat rx class.
+
+    A single thread multiplexes the listening socket and the peer
+    connections. The peers supporting the binary framing keep their
+    connection open and send length-prefixed frames, the older peers send
+    a single nul-terminated message per connection.
     """
     def __init__(self, name):
         HbUcast.__init__(self, name, role="rx")
         self.sock = None
+        self.clients = {}
 
     def _configure(self):
         HbUcast._configure(self)
@@ -160,6 +313,7 @@ class HbUcastRx(HbUcast):
         self.config_change = False
         if self.sock:
             self.sock.close()
+        self.close_clients()
         lexc = None
         for _ in range(3):
             try:
@@ -177,7 +331,7 @@ class HbUcastRx(HbUcast):
         self.sock.bind((self.peer_config[rcEnv.nodename]["addr"],
                         self.peer_config[rcEnv.nodename]["port"]))
         self.sock.listen(5)
-        self.sock.settimeout(2)
+        self.sock.setblocking(0)
 
     def run(self):
         self.set_tid()
@@ -193,52 +347,126 @@ class HbUcastRx(HbUcast):
         while True:
             self.do()
             if self.stopped():
-                self.join_threads()
+                self.close_clients()
                 self.sock.close()
                 sys.exit(0)
 
+    def status(self, **kwargs):
+        data = HbUcast.status(self, **kwargs)
+        data["stats"]["connections"] = len(self.clients)
+        return data
+
     def do(self):
         self.reload_config()
         self.janitor_procs()
-        self.janitor_threads()
 
         try:
-            conn, addr = self.sock.accept()
-        except socket.timeout:
-            return
+            readable, _, _ = select.select([self.sock] + list(self.clients), [], [], 2)
+        except (select.error, socket.error, ValueError) as exc:
+            self.log.warning("select: %s", exc)
+            readable = []
         finally:
             self.set_peers_beating()
-        if len(self.threads) >= self.max_handlers:
-            self.log.warning("drop message received from %s: too many running handlers (%d)",
+        for sock in readable:
+            if sock is self.sock:
+                self.accept()
+            else:
+                self.read_client(sock)
+        self.janitor_clients()
+
+    def accept(self):
+        try:
+            conn, addr = self.sock.accept()
+        except socket.error:
+            return
+        if len(self.clients) >= self.max_handlers:
+            self.log.warning("drop connection from %s: too many connections (%d)",
                              addr, self.max_handlers)
+            conn.close()
             return
+        conn.setblocking(0)
+        self.clients[conn] = Storage({
+            "addr": addr,
+            "buff": six.b(""),
+            "last": time.time(),
+        })
+
+    def close_client(self, conn):
+        try:
+            del self.clients[conn]
+        except KeyError:
+            pass
         try:
-            thr = threading.Thread(target=self.handle_client, args=(conn, addr))
-            thr.start()
-            self.threads.append(thr)
-        except RuntimeError as exc:
-            self.log.warning(exc)
             conn.close()
+        except socket.error:
+            pass
 
-    def handle_client(self, conn, addr):
+    def close_clients(self):
+        for conn in list(self.clients):
+            self.close_client(conn)
+
+    def janitor_clients(self):
+        """
+        Close the connections idle for longer than the heartbeat timeout.
+        """
+        limit = time.time() - (self.timeout or self.default_hb_period) * 2
+        for conn, client in list(self.clients.items()):
+            if client.last < limit:
+                self.close_client(conn)
+
+    def read_client(self, conn):
+        client = self.clients.get(conn)
+        if client is None:
+            return
         try:
-            self._handle_client(conn, addr)
-        finally:
-            conn.close()
+            chunk = conn.recv(65536)
+        except socket.error:
+            chunk = None
+        if not chunk:
+            # eof: a legacy sender may not have terminated its message
+            if client.buff:
+                self.handle_message(client.buff, client.addr)
+            self.close_client(conn)
+            return
+        client.last = time.time()
+        client.buff += chunk
+        for message in self.split_messages(client):
+            self.handle_message(message, client.addr)
 
-    def _handle_client(self, conn, addr):
-        chunks = []
-        buff_size = 4096
-        while True:
-            chunk = conn.recv(buff_size)
-            if chunk:
-                chunks.append(chunk)
-            if not chunk or chunk.endswith(b"\x00"):
-                break
-        data = six.b("").join(chunks)
-        self.push_stats(len(data))
-        del chunks
+    def split_messages(self, client):
+        """
+        Extract the complete messages from the client buffer.
 
+        Binary frames are length-prefixed, legacy messages are
+        nul-terminated.
+        """
+        messages = []
+        buff = client.buff
+        while buff:
+            if buff[:1] == FRAME_MAGIC[:1]:
+                if len(buff) < FRAME_PREFIX.size:
+                    break
+                length = self.frame_len(buff)
+                if length is None:
+                    # corrupted stream
+                    buff = six.b("")
+                    break
+                if len(buff) < length:
+                    break
+                messages.append(buff[:length])
+                buff = buff[length:]
+            else:
+                idx = buff.find(six.b("\0"))
+                if idx < 0:
+                    break
+                if idx > 0:
+                    messages.append(buff[:idx+1])
+                buff = buff[idx+1:]
+        client.buff = buff
+        return messages
+
+    def handle_message(self, data, addr):
+        self.push_stats(len(data))
         clustername, nodename, data = self.decrypt(data, sender_id=addr[0])
         if clustername != self.cluster_name:
             return
@@ -0,0 +1,68 @@
+"""
+The host state snapshots.
+
+The fs, loop and ip resources status evaluations all need the same host
+datasets: the mounts table, the loop devices backing files and the network
+interfaces addresses. Each dataset is loaded once, then shared by all the
+resources evaluated by the process until:
+
+* the snapshot is older than its ttl
+* or the snapshots generation is bumped by invalidate(), which the
+  resources actions and the refreshed status evaluations do, as they
+  change or need a fresh view of the host state.
+"""
+import threading
+import time
+
+TTL = 5
+
+LOCK = threading.Lock()
+GENERATION = 0
+SNAPSHOTS = {}
+LOADING = {}
+
+
+def generation():
+    return GENERATION
+
+
+def invalidate():
+    """
+    Bump the generation, so the next get() reload the datasets.
+    """
+    global GENERATION
+    with LOCK:
+        GENERATION += 1
+        SNAPSHOTS.clear()
+
+
+def get(key, fn, ttl=TTL):
+    """
+    Return the <key> dataset snapshot, loaded by <fn> if absent, outdated
+    or expired.
+
+    Concurrent callers, like the parallel status evaluator threads, wait
+    for the dataset loaded by the first caller instead of loading their own.
+    """
+    while True:
+        with LOCK:
+            gen = GENERATION
+            snapshot = SNAPSHOTS.get(key)
+            if snapshot and snapshot[0] == gen and time.time() - snapshot[1] < ttl:
+                return snapshot[2]
+            loading = LOADING.get(key)
+            if loading is None:
+                loading = LOADING[key] = threading.Event()
+                break
+        loading.wait()
+    try:
+        begin = time.time()
+        data = fn()
+        with LOCK:
+            if gen == GENERATION:
+                SNAPSHOTS[key] = (gen, begin, data)
+        return data
+    finally:
+        with LOCK:
+            del LOADING[key]
+        loading.set()
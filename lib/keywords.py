@@ -18,6 +18,13 @@ class KeyInvalidValue(Exception):
     pass
 
 class Keyword(object):
+    __slots__ = (
+        "section", "keyword", "rtype", "generic", "at", "top", "required",
+        "default", "default_text", "candidates", "strict_candidates",
+        "depends", "text", "provisioning", "convert", "inheritance",
+        "scope_order", "example",
+    )
+
     def __init__(self, section, keyword,
                  rtype=None,
                  required=False,
@@ -69,11 +76,6 @@ class Keyword(object):
     def __lt__(self, o):
         return self.section + self.keyword < o.section + o.keyword
 
-    def __getattribute__(self, attr):
-        if attr == "default":
-            return copy.copy(object.__getattribute__(self, attr))
-        return object.__getattribute__(self, attr)
-
     def deprecated(self):
         if self.keyword in self.top.deprecated_keywords:
             return True
@@ -229,11 +231,17 @@ class Section(object):
         self.section = section
         self.top = top
         self.keywords = []
+        # keyword name => keywords with this name, in declaration order
+        self.index = {}
+        # (rtype, keyword name) => resolved keyword, or None
+        self.resolved = {}
 
     def __iadd__(self, o):
         if not isinstance(o, Keyword):
             return self
         self.keywords.append(o)
+        self.index.setdefault(o.keyword, []).append(o)
+        self.resolved = {}
         return self
 
     def dump(self):
@@ -344,15 +352,26 @@ class Section(object):
             if len(l) != 2:
                 return
             keyword, _ = l
+        try:
+            return self.resolved[(rtype, keyword)]
+        except KeyError:
+            pass
+        key = self._getkey(keyword, rtype)
+        self.resolved[(rtype, keyword)] = key
+        return key
+
+    def _getkey(self, keyword, rtype=None):
+        """
+        Resolve the deprecated keyword aliases, and return the first
+        declared keyword matching <rtype>.
+        """
         if rtype:
             fkey = ".".join((self.section, rtype, keyword))
             if self.top is not None and fkey in self.top.deprecated_keywords:
                 keyword = self.top.deprecated_keywords[fkey]
                 if keyword is None:
                     return
-            for k in self.keywords:
-                if k.keyword != keyword:
-                    continue
+            for k in self.index.get(keyword, []):
                 if isinstance(k.rtype, (tuple, list)) and rtype in k.rtype:
                     return k
                 if rtype == k.rtype:
@@ -363,9 +382,7 @@ class Section(object):
             fkey = ".".join((self.section, keyword))
             if self.top is not None and fkey in self.top.deprecated_keywords:
                 keyword = self.top.deprecated_keywords[fkey]
-            for k in self.keywords:
-                if k.keyword != keyword:
-                    continue
+            for k in self.index.get(keyword, []):
                 if isinstance(k.rtype, (tuple, list)) and None in k.rtype:
                     return k
                 if k.rtype is None:
@@ -554,7 +571,7 @@ class KeywordStore(dict):
             if key.default is None:
                 raise MissKeyNoDefault("No default value for required key '%s' in section '%s'"%(key.keyword, rid))
             print("Implicitely add [%s] %s = %s" % (rid, key.keyword, str(key.default)))
-            completion[key.keyword] = key.default
+            completion[key.keyword] = copy.copy(key.default)
 
         # purge unknown keywords and provisioning keywords
         completion = self.purge_keywords_from_dict(completion, section)
@@ -0,0 +1,201 @@
+"""
+The node and objects log files reader.
+
+Parse the log records written by the rcLogger file handlers, and serve
+time range backlogs without parsing the records out of the range: the
+records are appended in time order, so the first record of the range is
+found by bisecting the file on the record timestamps. The rotated log
+file is read only if the range starts before the current log file.
+"""
+import gzip
+import os
+import re
+import time
+
+RE_LOG_LINE = re.compile(r"^[0-9]{4}-[0-9]{2}-[0-9]{2} [0-2][0-9]:[0-6][0-9]:[0-6][0-9],[0-9]{3} .* \| ")
+
+# the records are not strictly ordered, as concurrent writers take their
+# timestamp before waiting for the file write.
+SLACK = 2
+
+# stop bisecting when the window is smaller than this size, and parse
+MIN_WINDOW = 4096
+
+TIME_CACHE = {}
+TIME_CACHE_SIZE = 1024
+
+
+def parse_time(date_s, time_s):
+    """
+    Return the timestamp of a "%Y-%m-%d" <date_s> and "%H:%M:%S,%f"
+    <time_s> local time.
+
+    The records of the same second share the costly conversion of the
+    date and time to epoch.
+    """
+    second_s, msec_s = time_s.split(",", 1)
+    key = date_s + " " + second_s
+    try:
+        second = TIME_CACHE[key]
+    except KeyError:
+        second = time.mktime(time.strptime(key, "%Y-%m-%d %H:%M:%S"))
+        if len(TIME_CACHE) >= TIME_CACHE_SIZE:
+            TIME_CACHE.clear()
+        TIME_CACHE[key] = second
+    return second + int(msec_s) / 1000.
+
+
+def parse(buff):
+    head, message = buff.split(" | ", 1)
+    date_s, time_s, lvl, meta = head.split(None, 3)
+    d = {
+        "t": parse_time(date_s, time_s),
+        "l": lvl,
+        "m": message.rstrip().split("\n"),
+        "x": {},
+    }
+    for m in meta.split():
+        k, v = m.split(":", 1)
+        d["x"][k] = v
+    return d
+
+
+def read_records(ofile, since=None):
+    """
+    Return the list of records parsed from the <ofile> current position,
+    skipping the records older than <since> if set.
+    """
+    data = []
+    buff = ""
+
+    def push(_buff):
+        try:
+            record = parse(_buff)
+        except ValueError:
+            return
+        if since is not None and record["t"] < since:
+            return
+        data.append(record)
+
+    while True:
+        line = ofile.readline()
+        if not line:
+            break
+        if RE_LOG_LINE.match(line):
+            if buff:
+                # new msg, push pending buff
+                push(buff)
+            buff = line
+        else:
+            buff += line
+    if buff:
+        # EOF, push pending buff
+        push(buff)
+    return data
+
+
+def record_time(ofile, offset):
+    """
+    Return the timestamp of the first record starting after <offset>, or
+    None if there is no such record.
+    """
+    ofile.seek(offset)
+    if offset:
+        # drop the line the offset cut
+        ofile.readline()
+    while True:
+        line = ofile.readline()
+        if not line:
+            return
+        if not RE_LOG_LINE.match(line):
+            continue
+        date_s, time_s = line.split(None, 2)[:2]
+        try:
+            return parse_time(date_s, time_s)
+        except ValueError:
+            continue
+
+
+def seek_time(ofile, since):
+    """
+    Position <ofile> before the first record not older than <since>, at
+    the start of a line.
+    """
+    ofile.seek(0, 2)
+    low = 0
+    high = ofile.tell()
+    since = since - SLACK
+    while high - low > MIN_WINDOW:
+        middle = (low + high) // 2
+        t = record_time(ofile, middle)
+        if t is None or t >= since:
+            high = middle
+        else:
+            low = middle
+    ofile.seek(low)
+    if low:
+        ofile.readline()
+
+
+def rotated_logfile(logfile):
+    """
+    Return the path of the last rotated log file, compressed by the
+    rcLogger rotator, or None if it does not exist.
+    """
+    fpath = logfile + ".1.gz"
+    if os.path.exists(fpath):
+        return fpath
+
+
+def read_since(logfile, since):
+    """
+    Return the <logfile> records not older than the <since> timestamp,
+    including the records of the rotated log file if the range starts
+    before the current log file.
+    """
+    data = []
+    try:
+        ofile = open(logfile, "r")
+    except (IOError, OSError):
+        ofile = None
+    try:
+        if ofile:
+            first = record_time(ofile, 0)
+        else:
+            first = None
+        if first is None or first > since:
+            fpath = rotated_logfile(logfile)
+            if fpath:
+                with gzip.open(fpath, "rt") as rfile:
+                    data = read_records(rfile, since=since)
+        if ofile:
+            seek_time(ofile, since)
+            data += read_records(ofile, since=since)
+    finally:
+        if ofile:
+            ofile.close()
+    return data
+
+
+def follow(ofile):
+    """
+    Return the records appended to <ofile> since the last call, and the
+    file object to use for the next call, which is a new one if the log
+    file was rotated.
+
+    The listener calls it when its log files watcher reports a change of
+    the file, or at every loop if the changes are not watched.
+    """
+    try:
+        if os.stat(ofile.name).st_ino != os.fstat(ofile.fileno()).st_ino:
+            # rotated: flush the old file, then continue on the new one
+            data = read_records(ofile)
+            ofile.close()
+            ofile = open(ofile.name, "r")
+            return data + read_records(ofile), ofile
+    except (IOError, OSError):
+        # rotation in progress
+        return [], ofile
+    if os.fstat(ofile.fileno()).st_size <= ofile.tell():
+        return [], ofile
+    return read_records(ofile), ofile
@@ -33,6 +33,7 @@ except ImportError:
     pass
 
 import svcBuilder
+from actionsched import ActionScheduler
 import xmlrpcClient
 from network import NetworksMixin
 from rcGlobalEnv import rcEnv
@@ -2442,6 +2443,7 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
         """
         The services action wrapper.
         Takes care of
+        * ordering of the action per the services parents and children
         * parallelization of the action in per-service subprocesses
         * collection and aggregation of returned data and errors
         """
@@ -2478,11 +2480,6 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
             print("action '%s' is not allowed on multiple services" % action, file=sys.stderr)
             return 1
 
-        if self.can_parallel(action, svcs, options):
-            from multiprocessing import Process
-            data.procs = {}
-            data.svcs = {}
-
         timeout = 0
         if not options.local and options.wait:
             # submit all async actions and wait only after to avoid
@@ -2490,25 +2487,27 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
             timeout = convert_duration(options.time)
             options.wait = False
 
-        def running():
-            count = 0
-            for proc in data.procs.values():
-                if proc.is_alive():
-                    count += 1
-            return count
+        if self.can_parallel(action, svcs, options):
+            from multiprocessing import Process
 
-        for svc in svcs:
-            if self.can_parallel(action, svcs, options):
-                while running() >= self.max_parallel:
-                    time.sleep(1)
-                data.svcs[svc.path] = svc
-                data.procs[svc.path] = Process(
+            def spawn(svc):
+                proc = Process(
                     target=self.service_action_worker,
                     name='worker_'+svc.path,
                     args=[svc, action, options],
                 )
-                data.procs[svc.path].start()
-            else:
+                proc.start()
+                return proc
+
+            sched = ActionScheduler(svcs, action, max_parallel=self.max_parallel, log=self.log)
+            for path, (ret, _) in sched.run(spawn).items():
+                errs[path] = ret
+                if ret > 0:
+                    # ret is negative when the worker is killed by signal.
+                    # in this case, we don't want to decrement the err counter.
+                    err += ret
+        else:
+            for svc in ActionScheduler(svcs, action, log=self.log).order():
                 try:
                     ret = svc.action(action, options)
                     if need_aggregate:
@@ -2542,15 +2541,6 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
                 except ex.excSignal:
                     break
 
-        if self.can_parallel(action, svcs, options):
-            for path in data.procs:
-                data.procs[path].join()
-                ret = data.procs[path].exitcode
-                errs[path] = ret
-                if ret > 0:
-                    # r is negative when data.procs[path] is killed by signal.
-                    # in this case, we don't want to decrement the err counter.
-                    err += ret
         if timeout:
             for svc in svcs:
                 if errs.get(svc.path, -1) != 0:
@@ -3957,6 +3947,41 @@ class Node(Crypt, ExtConfigMixin, NetworksMixin):
         )
         return data
 
+    @lazy
+    def instances_status_cache(self):
+        return {}
+
+    def _instances_status(self, selector=None, namespace=None, server=None, silent=False):
+        """
+        Return the instances status of the selected objects, indexed by path
+        and node. Repeated calls only fetch the changes since the previous
+        call, and patch its dataset.
+        """
+        key = (selector, namespace, server)
+        cache = self.instances_status_cache.get(key)
+        data = self.daemon_get(
+            {
+                "action": "instances_status",
+                "options": {
+                    "selector": selector,
+                    "namespace": namespace,
+                    "etag": cache["etag"] if cache else None,
+                },
+            },
+            server=server,
+            silent=silent,
+            timeout=5,
+        )
+        if not isinstance(data, dict) or "etag" not in data:
+            return data
+        if data.get("full") or cache is None:
+            instances = data.get("data", {})
+        else:
+            import json_delta
+            instances = json_delta.patch(cache["data"], data["patch"])
+        self.instances_status_cache[key] = {"etag": data["etag"], "data": instances}
+        return instances
+
     def daemon_lock_release(self):
         self._daemon_unlock(self.options.name, self.options.id)
 
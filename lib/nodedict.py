@@ -310,6 +310,13 @@ KEYWORDS = [
         "convert": "integer",
         "text": "Allow a maximum of :kw:`max_parallel` subprocesses to run simultaneously on :cmd:`svcmgr --parallel <action>` commands."
     },
+    {
+        "section": "node",
+        "keyword": "action_executor",
+        "default": "process",
+        "candidates": ["process", "forkserver"],
+        "text": "The method the daemon uses to execute the scheduled tasks and orchestration actions. ``process`` starts a new python interpreter per action. ``forkserver`` forks the actions from a server process with the agent modules already imported, saving the interpreter startup and modules import cost of each action."
+    },
     {
         "section": "node",
         "keyword": "allowed_networks",
@@ -673,6 +680,20 @@ If not set, or set to ``true``, the reboot flag is removed before reboot, and a
         "default": 1214,
         "text": """The port the daemon listener must listen on. In pull action mode, the collector sends a tcp packet to the server to notify there are actions to unqueue. The opensvc daemon executes the :c-action:`dequeue actions` node action upon receive. The :kw:`listener.port` parameter is sent to the collector upon :c-action:`pushasset`. The collector uses this port to notify the node."""
     },
+    {
+        "section": "listener",
+        "keyword": "max_long_polls",
+        "convert": "integer",
+        "default": 32,
+        "text": "The maximum number of long-poll requests (wait, sync) the listener serves without counting them in :kw:`listener.max_workers`. The long-poll requests over this limit are served by the regular workers."
+    },
+    {
+        "section": "listener",
+        "keyword": "max_workers",
+        "convert": "integer",
+        "default": 64,
+        "text": "The maximum number of threads the listener can use to serve the client requests. The client connections are multiplexed by a single thread, and their requests are queued when all workers are busy."
+    },
     {
         "section": "listener",
         "keyword": "openid_well_known",
@@ -0,0 +1,413 @@
+"""
+Indexed object selector engine.
+
+Evaluate the object selector expressions against the daemon aggregated
+objects data, using:
+
+* a compiled selectors cache, so an expression is parsed once
+* an index of the object paths by namespace, kind and name, rebuilt when
+  the set of objects changes
+* a cache of the keyword and jsonpath fragments evaluation results,
+  invalidated when the object configuration (keywords) or the aggregated
+  status (jsonpath) changes
+
+The ',' (or), '+' (and) and '!' (not) operators are evaluated using set
+algebra. The results are ordered like the candidate paths.
+"""
+import fnmatch
+import re
+import threading
+
+import rcExceptions as ex
+from jsonpath_ng.ext import parse
+from rcUtilities import split_path, normalize_path
+
+OPS = r"(<=|>=|<|>|=|~|:)"
+MAX_COMPILED = 1024
+EMPTY = frozenset()
+
+
+def matching(current, op, value):
+    if op in ("<", ">", ">=", "<="):
+        try:
+            current = float(current)
+        except (ValueError, TypeError):
+            return False
+    if op == "=":
+        if current.lower() in ("true", "false"):
+            match = current.lower() == value.lower()
+        else:
+            match = current == value
+    elif op == "~":
+        match = re.search(value, current)
+    elif op == ">":
+        match = current > value
+    elif op == ">=":
+        match = current >= value
+    elif op == "<":
+        match = current < value
+    elif op == "<=":
+        match = current <= value
+    elif op == ":":
+        match = True
+    else:
+        # unknown op value
+        match = False
+    return match
+
+
+def has_magic(s):
+    return "*" in s or "?" in s or "[" in s
+
+
+class Fragment(object):
+    """
+    A compiled selector fragment, ie an expression without ',' and '+'.
+    """
+    def __init__(self, s, namespace=None):
+        self.s = s
+        self.negate = s[:1] == "!"
+        s = s.lstrip("!")
+        self.key = s
+        self.kind = None
+        elts = re.split(OPS, s)
+        if not s:
+            self.kind = "empty"
+        elif len(elts) == 1:
+            self.kind = "glob"
+            self.compile_glob(s, namespace)
+        elif len(elts) == 3:
+            self.kind = "keyword"
+            self.compile_keyword(*elts)
+        else:
+            self.kind = "empty"
+
+    def compile_glob(self, s, namespace):
+        norm_elts = s.split("/")
+        norm_elts_count = len(norm_elts)
+        if norm_elts_count == 3:
+            _namespace, _kind, _name = norm_elts
+            if not _name:
+                # test/svc/
+                _name = "*"
+        elif norm_elts_count == 2:
+            if not norm_elts[1]:
+                # svc/
+                _name = "*"
+                _kind = norm_elts[0]
+                _namespace = "*"
+            elif norm_elts[1] == "**":
+                # prod/**
+                _name = "*"
+                _kind = "*"
+                _namespace = norm_elts[0]
+            elif norm_elts[0] == "**":
+                # **/s*
+                _name = norm_elts[1]
+                _kind = "*"
+                _namespace = "*"
+            else:
+                # svc/s*
+                _name = norm_elts[1]
+                _kind = norm_elts[0]
+                _namespace = "*"
+        elif norm_elts_count == 1:
+            if norm_elts[0] == "**":
+                _name = "*"
+                _kind = "*"
+                _namespace = "*"
+            else:
+                _name = norm_elts[0]
+                _kind = "svc"
+                _namespace = namespace if namespace else "root"
+        else:
+            self.kind = "empty"
+            return
+        self.namespace = _namespace
+        self.objkind = _kind
+        self.name = _name
+        self.pattern = "/".join((_namespace, _kind, _name))
+        self.literal = not has_magic(self.pattern)
+
+    def compile_keyword(self, param, op, value):
+        if op in ("<", ">", ">=", "<="):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                self.kind = "empty"
+                return
+        if param.startswith("."):
+            param = "$"+param
+        if param.startswith("$."):
+            self.jsonpath_expr = parse(param)
+        else:
+            self.jsonpath_expr = None
+        self.param = param
+        self.op = op
+        self.value = value
+
+
+class SelectorIndex(object):
+    """
+    The object selector engine, holding the caches.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.compiled = {}
+        self.agg = None
+        self.agg_paths = None
+        self.order = []
+        self.pos = {}
+        self.norm = {}
+        self.by_namespace = {}
+        self.by_kind = {}
+        self.by_name = {}
+        self.keyword_cache = {}
+        self.jsonpath_cache = {}
+
+    def compile(self, selector, namespace=None):
+        key = (selector, namespace)
+        try:
+            return self.compiled[key]
+        except KeyError:
+            pass
+        compiled = []
+        for term in selector.split(","):
+            compiled.append([Fragment(s, namespace) for s in term.split("+")])
+        with self.lock:
+            if len(self.compiled) >= MAX_COMPILED:
+                self.compiled = {}
+            self.compiled[key] = compiled
+        return compiled
+
+    def refresh(self, agg):
+        """
+        Update the index if the aggregated data changed.
+        """
+        if agg is self.agg:
+            return
+        with self.lock:
+            if agg is self.agg:
+                return
+            self.jsonpath_cache = {}
+            paths = set(agg)
+            if paths != self.agg_paths:
+                self.rebuild(agg, paths)
+            self.agg = agg
+
+    def rebuild(self, agg, paths):
+        by_namespace = {}
+        by_kind = {}
+        by_name = {}
+        norm = {}
+        order = list(agg)
+        for path in order:
+            name, namespace, kind = split_path(path)
+            norm[path] = normalize_path(path)
+            by_namespace.setdefault(namespace, set()).add(path)
+            by_kind.setdefault(kind, set()).add(path)
+            by_name.setdefault(name, set()).add(path)
+        self.order = order
+        self.pos = dict((path, idx) for idx, path in enumerate(order))
+        self.norm = norm
+        self.by_namespace = by_namespace
+        self.by_kind = by_kind
+        self.by_name = by_name
+        self.agg_paths = paths
+        self.keyword_cache = {}
+
+    def normalize(self, path):
+        try:
+            return self.norm[path]
+        except KeyError:
+            return normalize_path(path)
+
+    def select(self, agg, services, object_data, selector=None, namespace=None,
+               namespaces=None, paths=None):
+        """
+        Return the list of object paths matching <selector>.
+
+        <agg> is the aggregated objects data, <services> the local objects
+        and <object_data> a function returning the data a jsonpath
+        fragment is evaluated against.
+        """
+        if not selector:
+            return []
+        if namespace:
+            if namespaces is not None and namespace not in namespaces:
+                return []
+            namespaces = set([namespace])
+        else:
+            namespaces = set(namespaces)
+        if "root" in namespaces:
+            namespaces.add(None)
+
+        self.refresh(agg)
+        index = self.snapshot()
+
+        if paths is None:
+            # all objects
+            if namespaces.issuperset(index.by_namespace):
+                paths = list(index.order)
+            else:
+                paths = [p for p in index.order if split_path(p)[1] in namespaces]
+            pos = index.pos
+        else:
+            paths = list(paths)
+            pos = None
+        if selector == "**":
+            return paths
+
+        # all services
+        if selector == "*":
+            return [p for p in paths if split_path(p)[2] == "svc"]
+
+        universe = set(paths)
+
+        expanded = set()
+        results = []
+        for term in self.compile(selector, namespace):
+            selected = None
+            for fragment in term:
+                _selected = self.select_fragment(index, fragment, universe if selected is None else selected,
+                                                 agg, services, object_data)
+                selected = _selected if selected is None else selected & _selected
+                if not selected:
+                    break
+            if not selected:
+                continue
+            selected -= expanded
+            if not selected:
+                continue
+            expanded |= selected
+            results.append(selected)
+        if not results:
+            return []
+        if pos is None:
+            pos = dict((path, idx) for idx, path in enumerate(paths))
+        return [p for selected in results for p in sorted(selected, key=lambda x: pos.get(x, -1))]
+
+    def snapshot(self):
+        """
+        Return a consistent view of the index attributes, safe to use
+        while another thread rebuilds the index.
+        """
+        with self.lock:
+            return _Index(self)
+
+    def select_fragment(self, index, fragment, candidates, agg, services, object_data):
+        if fragment.kind == "empty":
+            return set()
+
+        # explicit object path
+        if fragment.s in agg:
+            if fragment.s in candidates:
+                return set([fragment.s])
+            return set()
+
+        if fragment.kind == "glob":
+            selected = self.select_glob(index, fragment, candidates)
+        else:
+            selected = set()
+            for path in candidates:
+                if self.keyword_match(fragment, path, services, object_data):
+                    selected.add(path)
+        if fragment.negate:
+            return candidates - selected
+        return selected
+
+    def select_glob(self, index, fragment, candidates):
+        selected = candidates
+        if not has_magic(fragment.namespace):
+            namespace = None if fragment.namespace == "root" else fragment.namespace
+            selected = self.narrow(selected, index.by_namespace.get(namespace, EMPTY), candidates)
+        if not has_magic(fragment.objkind):
+            selected = self.narrow(selected, index.by_kind.get(fragment.objkind, EMPTY), candidates)
+        if not has_magic(fragment.name):
+            selected = self.narrow(selected, index.by_name.get(fragment.name, EMPTY), candidates)
+        unindexed = candidates - index.paths
+        if fragment.literal:
+            selected = set(selected)
+            selected.update(p for p in unindexed if self.normalize(p) == fragment.pattern)
+            return selected
+        return set(p for p in selected if fnmatch.fnmatch(self.normalize(p), fragment.pattern)) | \
+               set(p for p in unindexed if fnmatch.fnmatch(self.normalize(p), fragment.pattern))
+
+    @staticmethod
+    def narrow(selected, indexed, candidates):
+        if selected is candidates:
+            return candidates & indexed
+        return selected & indexed
+
+    def keyword_match(self, fragment, path, services, object_data):
+        if fragment.jsonpath_expr is not None:
+            key = (path, fragment.key)
+            try:
+                return self.jsonpath_cache[key]
+            except KeyError:
+                pass
+            result = self.jsonpath_match(fragment, object_data(path))
+            self.jsonpath_cache[key] = result
+            return result
+        svc = services.get(path)
+        if svc is None:
+            return False
+        key = (path, fragment.key)
+        try:
+            _svc, result = self.keyword_cache[key]
+            if _svc is svc:
+                return result
+        except KeyError:
+            pass
+        result = self.svc_match(fragment, svc)
+        self.keyword_cache[key] = (svc, result)
+        return result
+
+    @staticmethod
+    def jsonpath_match(fragment, data):
+        try:
+            for match in fragment.jsonpath_expr.find(data):
+                if matching(match.value, fragment.op, fragment.value):
+                    return True
+        except Exception:
+            pass
+        return False
+
+    @staticmethod
+    def svc_match(fragment, svc):
+        param, op, value = fragment.param, fragment.op, fragment.value
+        try:
+            current = svc._get(param, evaluate=True)
+        except (ex.excError, ex.OptNotFound, ex.RequiredOptNotFound):
+            current = None
+        if current is None:
+            if "." in param:
+                group, _param = param.split(".", 1)
+            else:
+                group = param
+                _param = None
+            rids = [section for section in svc.conf_sections() if group == "" or section.split('#')[0] == group]
+            if op == ":" and len(rids) > 0 and _param is None:
+                return True
+            elif _param:
+                for rid in rids:
+                    try:
+                        _current = svc._get(rid+"."+_param, evaluate=True)
+                    except (ex.excError, ex.OptNotFound, ex.RequiredOptNotFound):
+                        continue
+                    if matching(_current, op, value):
+                        return True
+            return False
+        if matching(current, op, value):
+            return True
+        return False
+
+
+class _Index(object):
+    def __init__(self, index):
+        self.order = index.order
+        self.paths = index.agg_paths or EMPTY
+        self.pos = index.pos
+        self.by_namespace = index.by_namespace
+        self.by_kind = index.by_kind
+        self.by_name = index.by_name
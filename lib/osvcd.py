@@ -121,7 +121,7 @@ class Daemon(object):
         self.threads = {}
         self.last_config_mtime = None
         log_file = os.path.join(rcEnv.paths.pathlog, "node.log")
-        rcLogger.initLogger(rcEnv.nodename, log_file, handlers=self.handlers, sid=False)
+        rcLogger.initLogger(rcEnv.nodename, log_file, handlers=self.handlers, sid=False, queued=True)
         self.log = logging.LoggerAdapter(logging.getLogger(rcEnv.nodename+".osvcd"), {"node": rcEnv.nodename, "component": "main"})
         self.pid = os.getpid()
         self.stats_data = None
@@ -260,6 +260,7 @@ class Daemon(object):
             self.threads["dns"].stop()
             self.log.info("waiting for dns to stop")
             self.threads["dns"].join()
+        shared.EXECUTOR.stop()
 
     def need_start(self, thr_id):
         """
@@ -401,6 +402,8 @@ class Daemon(object):
                 shared.NODE.set_rlimit()
                 shared.NODE.network_setup()
             unset_lazy(self, "config_hbs")
+            if shared.NODE.oget("node", "action_executor") != "forkserver":
+                shared.EXECUTOR.stop()
             if self.last_config_mtime:
                 self.log.info("node config reloaded (changed)")
             else:
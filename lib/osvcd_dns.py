@@ -7,11 +7,11 @@ import socket
 import logging
 import threading
 import time
+import select
 import shutil
 import json
 import re
 
-import six
 import osvcd_shared as shared
 from rcGlobalEnv import rcEnv
 from storage import Storage
@@ -22,10 +22,241 @@ PTR_SUFFIX_LEN = 14
 PTR6_SUFFIX = ".ip6.arpa."
 PTR6_SUFFIX_LEN = 10
 
-if six.PY2:
-    MAKEFILE_KWARGS = {"bufsize": 0}
-else:
-    MAKEFILE_KWARGS = {"buffering": None}
+class RecordIndex(object):
+    """
+    The cluster services dns records, indexed by qname and by address.
+
+    Each instance contributes its A, SRV and PTR records to the index, with
+    a reference count, so the index is updated by only withdrawing and
+    adding the records of the instances changed since the last update.
+    """
+    def __init__(self, cluster_name, log=None):
+        self.cluster_name = cluster_name
+        self.log = log
+        self.lock = threading.RLock()
+        # {nodename: gen} of the indexed nodes data
+        self.gens = {}
+        # {nodename: {path: (updated, records)}}
+        self.instances = {}
+        # {qname: {addr: refcount}}
+        self.a = {}
+        # {qname: {(port, target): {nodename: refcount}}}
+        self.srv = {}
+        # {addr: {name: refcount}}
+        self.ptr = {}
+        # {reverse zone: refcount}
+        self.rev = {}
+
+    def update(self, nodenames, gens):
+        """
+        Index the instances of the <nodenames> nodes whose gen changed, and
+        drop the records of the nodes no longer in <nodenames>.
+        """
+        with self.lock:
+            for nodename in [nodename for nodename in self.instances if nodename not in nodenames]:
+                self.drop_node(nodename)
+            with shared.CLUSTER_DATA_LOCK:
+                for nodename in nodenames:
+                    gen = gens.get(nodename)
+                    if gen is not None and self.gens.get(nodename) == gen:
+                        continue
+                    try:
+                        status = shared.CLUSTER_DATA[nodename].get("services", {}).get("status", {})
+                    except KeyError:
+                        self.drop_node(nodename)
+                        continue
+                    self.update_node(nodename, status)
+                    self.gens[nodename] = gen
+
+    def update_node(self, nodename, status):
+        instances = self.instances.setdefault(nodename, {})
+        for path in [path for path in instances if path not in status]:
+            self.withdraw(nodename, instances[path][1])
+            del instances[path]
+        for path, svc in status.items():
+            name, namespace, kind = split_path(path)
+            if kind != "svc":
+                continue
+            updated = svc.get("updated")
+            try:
+                if updated is not None and instances[path][0] == updated:
+                    continue
+                self.withdraw(nodename, instances[path][1])
+            except KeyError:
+                pass
+            records = self.instance_records(path, svc)
+            self.add(nodename, records)
+            instances[path] = (updated, records)
+
+    def drop_node(self, nodename):
+        for updated, records in self.instances.get(nodename, {}).values():
+            self.withdraw(nodename, records)
+        self.instances.pop(nodename, None)
+        self.gens.pop(nodename, None)
+
+    @staticmethod
+    def incr(data, key1, key2):
+        if key1 not in data:
+            data[key1] = {}
+        data[key1][key2] = data[key1].get(key2, 0) + 1
+
+    @staticmethod
+    def decr(data, key1, key2):
+        count = data[key1][key2] - 1
+        if count:
+            data[key1][key2] = count
+            return
+        del data[key1][key2]
+        if not data[key1]:
+            del data[key1]
+
+    def add(self, nodename, records):
+        a_records, srv_records, ptr_records = records
+        for qname, addr in a_records:
+            self.incr(self.a, qname, addr)
+        for qname, port, target in srv_records:
+            if qname not in self.srv:
+                self.srv[qname] = {}
+            self.incr(self.srv[qname], (port, target), nodename)
+        for addr, name in ptr_records:
+            self.incr(self.ptr, addr, name)
+            rev = ".".join(reversed(addr.split(".")[:-1])) + PTR_SUFFIX
+            self.rev[rev] = self.rev.get(rev, 0) + 1
+
+    def withdraw(self, nodename, records):
+        a_records, srv_records, ptr_records = records
+        for qname, addr in a_records:
+            self.decr(self.a, qname, addr)
+        for qname, port, target in srv_records:
+            self.decr(self.srv[qname], (port, target), nodename)
+            if not self.srv[qname]:
+                del self.srv[qname]
+        for addr, name in ptr_records:
+            self.decr(self.ptr, addr, name)
+            rev = ".".join(reversed(addr.split(".")[:-1])) + PTR_SUFFIX
+            if self.rev[rev] > 1:
+                self.rev[rev] -= 1
+            else:
+                del self.rev[rev]
+
+    def instance_records(self, path, svc):
+        """
+        Return the ([(qname, addr)], [(qname, port, target)], [(addr, name)])
+        records of an instance.
+        """
+        a_records = []
+        srv_records = []
+        ptr_records = []
+        name, namespace, kind = split_path(path)
+        if namespace:
+            namespace = namespace.lower()
+        else:
+            namespace = "root"
+        scaler_slave = svc.get("scaler_slave")
+        if scaler_slave:
+            _name = name[name.index(".")+1:]
+        else:
+            _name = name
+        zone = "%s.%s.%s." % (namespace, kind, self.cluster_name)
+        qname = "%s.%s" % (_name, zone)
+        ptr_name = ("%s.%s" % (name, zone)).lower()
+        resources = svc.get("resources", {})
+        for rid, resource in resources.items():
+            info = resource.get("info", {})
+            addr = info.get("ipaddr")
+            if addr is None:
+                continue
+            hostname = info.get("hostname")
+            a_records.append((qname, addr))
+            a_records.append((unique_name(addr) + "." + qname, addr))
+            if hostname:
+                a_records.append((hostname.split(".")[0] + "." + qname, addr))
+            try:
+                ptr_hostname = hostname.split(".")[0].lower()
+            except Exception:
+                ptr_hostname = None
+            if ptr_hostname and ptr_hostname != name:
+                ptr_records.append((addr, "%s.%s" % (ptr_hostname, ptr_name)))
+            else:
+                ptr_records.append((addr, ptr_name))
+            target = "%s.%s.%s.%s.%s." % (unique_name(addr), _name, namespace, kind, self.cluster_name)
+            for expose in info.get("expose", []):
+                if "#" in expose:
+                    # expose data by reference
+                    expose_data = resources.get(expose, {}).get("info")
+                    try:
+                        port = expose_data["port"]
+                        proto = expose_data["protocol"]
+                    except (KeyError, TypeError):
+                        continue
+                else:
+                    # expose data inline
+                    try:
+                        port, proto = re.split("[/-]", expose.split(":")[0])
+                        port = int(port)
+                    except Exception as exc:
+                        continue
+                srv_records.append(("_%s._%s.%s.%s.%s.%s." % (str(port), proto, _name, namespace, kind, self.cluster_name), port, target))
+                try:
+                    serv = socket.getservbyport(port)
+                    srv_records.append(("_%s._%s.%s.%s.%s.%s." % (serv, proto, _name, namespace, kind, self.cluster_name), port, target))
+                except (socket.error, OSError) as exc:
+                    # port/proto not found
+                    pass
+                except Exception as exc:
+                    if self.log:
+                        self.log.warning("port %s resolution failed: %s", port, exc)
+        return a_records, srv_records, ptr_records
+
+    def a_addrs(self, qname):
+        with self.lock:
+            return list(self.a.get(qname, {}))
+
+    def a_records(self):
+        with self.lock:
+            return dict((qname, set(addrs)) for qname, addrs in self.a.items())
+
+    def srv_contents(self, qname, nodenames):
+        """
+        Return the SRV records contents of <qname>. An ip:port exposed by
+        many instances is served once, weighted by the score of the first
+        node in <nodenames> order.
+        """
+        with self.lock:
+            targets = list(self.srv.get(qname, {}).items())
+        contents = []
+        for (port, target), nodes in targets:
+            for nodename in nodenames:
+                if nodename in nodes:
+                    break
+            else:
+                continue
+            weight = shared.CLUSTER_DATA.get(nodename, {}).get("stats", {}).get("score", 10)
+            contents.append("%(prio)d %(weight)d %(port)d %(target)s" % {
+                "prio": 0,
+                "weight": weight,
+                "port": port,
+                "target": target,
+            })
+        return contents
+
+    def srv_records(self, nodenames):
+        with self.lock:
+            qnames = list(self.srv)
+        return dict((qname, set(self.srv_contents(qname, nodenames))) for qname in qnames)
+
+    def ptr_names(self, addr):
+        with self.lock:
+            return list(self.ptr.get(addr, {}))
+
+    def rev_zones(self):
+        with self.lock:
+            return list(self.rev)
+
+
+def unique_name(addr):
+    return addr.replace(".", "-").replace(":", "-")
+
 
 class Dns(shared.OsvcThread):
     name = "dns"
@@ -34,7 +265,7 @@ class Dns(shared.OsvcThread):
     def run(self):
         self.set_tid()
         self.log = logging.LoggerAdapter(logging.getLogger(rcEnv.nodename+".osvcd.dns"), {"node": rcEnv.nodename, "component": self.name})
-        self.cache = {}
+        self.clients = {}
         if not os.path.exists(rcEnv.paths.dnsuxsockd):
             os.makedirs(rcEnv.paths.dnsuxsockd)
         try:
@@ -47,7 +278,7 @@ class Dns(shared.OsvcThread):
         try:
             self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             self.sock.bind(rcEnv.paths.dnsuxsock)
-            self.sock.listen(1)
+            self.sock.listen(socket.SOMAXCONN)
             self.sock.settimeout(self.sock_tmo)
         except socket.error as exc:
             self.alert("error", "bind %s error: %s", rcEnv.paths.dnsuxsock, exc)
@@ -58,6 +289,7 @@ class Dns(shared.OsvcThread):
         self.zone = "%s." % self.cluster_name.strip(".")
         self.suffix = ".%s" % self.zone
         self.suffix_len = len(self.suffix)
+        self.index = RecordIndex(self.cluster_name, log=self.log)
         self.soa_data = {
             "origin": self.origin,
             "contact": self.contact,
@@ -84,14 +316,12 @@ class Dns(shared.OsvcThread):
             except Exception as exc:
                 self.log.exception(exc)
             if self.stopped():
-                self.log.debug("stop event received (%d handler threads to join)", len(self.threads))
-                self.join_threads()
+                self.log.debug("stop event received (%d clients to close)", len(self.clients))
+                for conn in list(self.clients):
+                    self.close_client(conn)
                 self.sock.close()
                 sys.exit(0)
 
-    def cache_key(self):
-        return tuple(sorted(self.get_gen(inc=False).values()))
-
     def status(self, **kwargs):
         data = shared.OsvcThread.status(self, **kwargs)
         if hasattr(self, "stats"):
@@ -99,86 +329,105 @@ class Dns(shared.OsvcThread):
         return data
 
     def do(self):
+        """
+        Serve the backend connections.
+
+        The dns server keeps its remote backend connections open, so the
+        connections are not closed when idle, and are all served by this
+        thread as their requests come in.
+        """
         self.reload_config()
         self.janitor_procs()
-        self.janitor_threads()
+        fds = [self.sock] + list(self.clients)
+        try:
+            readable = select.select(fds, [], [], self.sock_tmo)[0]
+        except (select.error, socket.error, ValueError) as exc:
+            # a client connection closed under our feet
+            self.log.debug("select: %s", exc)
+            for conn in list(self.clients):
+                if conn.fileno() < 0:
+                    self.close_client(conn)
+            return
+        for sock in readable:
+            if sock is self.sock:
+                self.accept()
+            else:
+                self.receive(sock)
 
+    def accept(self):
         try:
             conn, addr = self.sock.accept()
             #self.log.info("accept connection")
             self.stats.sessions.accepted += 1
         except socket.timeout:
             return
+        conn.settimeout(self.sock_tmo)
+        self.clients[conn] = b""
+
+    def close_client(self, conn):
+        self.clients.pop(conn, None)
         try:
-            thr = threading.Thread(target=self.handle_client, args=(conn,))
-            thr.start()
-            self.threads.append(thr)
-        except RuntimeError as exc:
-            self.log.warning(exc)
             conn.close()
+        except socket.error:
+            pass
 
-    def handle_client(self, conn):
-        conn.settimeout(self.sock_tmo)
-        cr = conn.makefile("r", **MAKEFILE_KWARGS)
-        cw = conn.makefile("w", **MAKEFILE_KWARGS)
+    def receive(self, conn):
         try:
-            self._handle_client(conn, cr, cw)
-        except Exception as exc:
-            self.log.exception(exc)
-        finally:
-            try:
-                cr.close()
-            except socket.error:
-                pass
-            try:
-                cw.close()
-            except socket.error:
-                pass
-            try:
-                conn.close()
-            except socket.error:
-                pass
-            sys.exit(0)
-
-    def _handle_client(self, conn, cr, cw):
-        chunks = []
-        buff_size = 4096
+            data = conn.recv(65536)
+        except socket.timeout:
+            return
+        except socket.error as exc:
+            self.log.info("%s", exc)
+            self.close_client(conn)
+            return
+        if len(data) == 0:
+            #self.log.info("no more data")
+            self.close_client(conn)
+            return
+        self.stats.sessions.rx += len(data)
+        buff = self.clients[conn] + data
         while True:
-            try:
-                data = cr.readline()
-            except socket.timeout as exc:
+            idx = buff.find(b"\n")
+            if idx < 0:
                 break
+            line = buff[:idx+1]
+            buff = buff[idx+1:]
+            message = self.handle_line(line)
+            if message is None:
+                continue
+            try:
+                conn.sendall(message.encode())
             except socket.error as exc:
                 self.log.info("%s", exc)
-                break
-            if len(data) == 0:
-                #self.log.info("no more data")
-                break
-
-            self.log.debug("received %s", data)
-    
-            try:
-                data = bdecode(data)
-                data = json.loads(data)
-            except Exception as exc:
-                self.log.error(exc)
-                data = None
-    
-            if self.stopped():
-                self.log.info("stop event received (handler thread)")
-                break
-
-            if data is None or not isinstance(data, dict):
-                continue
+                self.close_client(conn)
+                return
+            self.stats.sessions.tx += len(message)
+        self.clients[conn] = buff
 
+    def handle_line(self, data):
+        """
+        Return the reply message to a request line, or None if the request
+        is not valid.
+        """
+        self.log.debug("received %s", data)
+        try:
+            data = bdecode(data)
+            data = json.loads(data)
+        except Exception as exc:
+            self.log.error(exc)
+            return
+        if not isinstance(data, dict):
+            return
+        try:
             result = self.router(data)
-            if result is not None:
-                message = json.dumps(result) + "\n"
-                cw.write(message)
-                cw.flush()
-                self.log.debug("replied %s", message)
-                message_len = len(message)
-                self.stats.sessions.tx += message_len
+        except Exception as exc:
+            self.log.exception(exc)
+            result = {"error": str(exc), "result": False}
+        if result is None:
+            return
+        message = json.dumps(result) + "\n"
+        self.log.debug("replied %s", message)
+        return message
 
     #########################################################################
     #
@@ -331,10 +580,8 @@ class Dns(shared.OsvcThread):
         return [self.zone]
 
     def soa_records_rev(self):
-        addrs = []
-        for addr in set(self.svc_ips()):
-            addrs.append(".".join(reversed(addr.split(".")[:-1]))+PTR_SUFFIX)
-        return addrs
+        self.update_index()
+        return self.index.rev_zones()
 
     def soa_record(self, parameters):
         qname = parameters.get("qname").lower()
@@ -365,12 +612,13 @@ class Dns(shared.OsvcThread):
         qname = parameters.get("qname").lower()
         if not qname.endswith(self.suffix):
             return []
+        self.update_index()
         return [{
             "qtype": "SRV",
             "qname": qname,
             "content": content,
             "ttl": 60
-        } for content in self.srv_records().get(qname, [])]
+        } for content in self.index.srv_contents(qname, self.cluster_nodes)]
 
     def ptr_record(self, parameters):
         qname = parameters.get("qname").lower()
@@ -385,107 +633,32 @@ class Dns(shared.OsvcThread):
         qname = parameters.get("qname").lower()
         if not qname.endswith(self.suffix):
             return []
+        addrs = self.dns_a_records().get(qname)
+        if addrs is None:
+            self.update_index()
+            addrs = self.index.a_addrs(qname)
         return [{
             "qtype": "A",
             "qname": qname,
             "content": addr,
             "ttl": 60
-        } for addr in self.a_records().get(qname, [])]
+        } for addr in addrs]
 
     def svc_ptr_record(self, qname):
         if not qname.endswith(PTR_SUFFIX):
             return []
-        names = []
         ref = ".".join(reversed(qname[:-PTR_SUFFIX_LEN].split(".")))
-        with shared.CLUSTER_DATA_LOCK:
-            for nodename, node in shared.CLUSTER_DATA.items():
-                status = node.get("services", {}).get("status", {})
-                for path, svc in status.items():
-                    name, namespace, kind = split_path(path)
-                    if kind != "svc":
-                        continue
-                    if not namespace:
-                        namespace = "root"
-                    for rid, resource in status[path].get("resources", {}).items():
-                        addr = resource.get("info", {}).get("ipaddr")
-                        if addr is None:
-                            continue
-                        if addr != ref:
-                            continue
-                        try:
-                            hostname = resource.get("info", {}).get("hostname").split(".")[0].lower()
-                        except Exception:
-                            hostname = None
-                        gen_name = "%s.%s.%s.%s." % (name, namespace, kind, self.cluster_name)
-                        gen_name = gen_name.lower()
-                        if hostname and hostname != name:
-                            names.append("%s.%s" % (hostname, gen_name))
-                        else:
-                            names.append(gen_name)
-        return names
-
-    def set_cache(self, kind, data):
-        key = self.cache_key()
-        if key not in self.cache:
-            self.cache = {}
-        self.cache[key] = {kind: data}
-
-    def get_cache(self, kind):
-        key = self.cache_key()
-        if key not in self.cache:
-            self.cache = {}
-            return
-        if kind not in self.cache[key]:
-            return
-        return self.cache[key].get(kind)
+        self.update_index()
+        return self.index.ptr_names(ref)
 
-    @staticmethod
-    def unique_name(addr):
-        return addr.replace(".", "-").replace(":", "-")
+    def update_index(self):
+        self.index.update(self.cluster_nodes, self.get_gen(inc=False))
 
-    def a_records(self):
-        data = self.get_cache("a")
-        if data is not None:
-            return data
+    def dns_a_records(self):
+        """
+        The A records of the cluster dns servers.
+        """
         names = {}
-        for nodename in self.cluster_nodes:
-            try:
-                node = shared.CLUSTER_DATA[nodename]
-            except KeyError:
-                continue
-            status = node.get("services", {}).get("status", {})
-            for path, svc in status.items():
-                name, namespace, kind = split_path(path)
-                if kind != "svc":
-                    continue
-                if namespace:
-                    namespace = namespace.lower()
-                else:
-                    namespace = "root"
-                scaler_slave = svc.get("scaler_slave")
-                if scaler_slave:
-                    _name = name[name.index(".")+1:]
-                else:
-                    _name = name
-                zone = "%s.%s.%s." % (namespace, kind, self.cluster_name)
-                qname = "%s.%s" % (_name, zone)
-                if qname not in names:
-                    names[qname] = set()
-                for rid, resource in status.get(path, {}).get("resources", {}).items():
-                    addr = resource.get("info", {}).get("ipaddr")
-                    if addr is None:
-                        continue
-                    hostname = resource.get("info", {}).get("hostname")
-                    names[qname].add(addr)
-                    rname = self.unique_name(addr) + "." + qname
-                    if rname not in names:
-                        names[rname] = set()
-                    names[rname].add(addr)
-                    if hostname:
-                        name = hostname.split(".")[0] + "." + qname
-                        if name not in names:
-                            names[name] = set()
-                        names[name].add(addr)
         for i, ip in enumerate(shared.NODE.dns):
             try:
                 dns = "%s.%s." % (shared.NODE.dnsnodes[i].split(".")[0], self.cluster_name)
@@ -494,96 +667,14 @@ class Dns(shared.OsvcThread):
                 self.log.warning("dns (%s) and dnsnodes (%s) are not aligned"
                                  "" % (shared.NODE.dns, shared.NODE.dnsnodes))
                 break
-        self.set_cache("a", names)
         return names
 
-    def srv_records(self):
-        data = self.get_cache("srv")
-        if data is not None:
-            return data
-        names = {}
-        for nodename in self.cluster_nodes:
-            try:
-                node = shared.CLUSTER_DATA[nodename]
-            except KeyError:
-                continue
-            status = node.get("services", {}).get("status", {})
-            weight = node.get("stats", {}).get("score", 10)
-            for path, svc in status.items():
-                name, namespace, kind = split_path(path)
-                if kind != "svc":
-                    continue
-                if namespace:
-                    namespace = namespace.lower()
-                else:
-                    namespace = "root"
-                scaler_slave = svc.get("scaler_slave")
-                if scaler_slave:
-                    _name = name[name.index(".")+1:]
-                else:
-                    _name = name
-                for rid, resource in status[path].get("resources", {}).items():
-                    addr = resource.get("info", {}).get("ipaddr")
-                    if addr is None:
-                        continue
-                    for expose in resource.get("info", {}).get("expose", []):
-                        if "#" in expose:
-                            # expose data by reference
-                            expose_data = status[path].get("resources", {}).get(expose, {}).get("info")
-                            try:
-                                port = expose_data["port"]
-                                proto = expose_data["protocol"]
-                            except KeyError:
-                                continue
-                        else:
-                            # expose data inline
-                            try:
-                                port, proto = re.split("[/-]", expose.split(":")[0])
-                                port = int(port)
-                            except Exception as exc:
-                                continue
-                        qnames = set()
-                        qnames.add("_%s._%s.%s.%s.%s.%s." % (str(port), proto, _name, namespace, kind, self.cluster_name))
-                        try:
-                            serv = socket.getservbyport(port)
-                            qnames.add("_%s._%s.%s.%s.%s.%s." % (serv, proto, _name, namespace, kind, self.cluster_name))
-                        except (socket.error, OSError) as exc:
-                            # port/proto not found
-                            pass
-                        except Exception as exc:
-                            self.log.warning("port %d resolution failed: %s", port, exc)
-                        target = "%s.%s.%s.%s.%s." % (self.unique_name(addr), _name, namespace, kind, self.cluster_name)
-                        content = "%(prio)d %(weight)d %(port)d %(target)s" % {
-                            "prio": 0,
-                            "weight": weight,
-                            "port": port,
-                            "target": target,
-                        }
-                        for qname in qnames:
-                            if qname not in names:
-                                names[qname] = set()
-                            uend = " %d %s" % (port, target)
-                            if any([True for c in names[qname] if c.endswith(uend)]):
-                                # avoid multiple SRV entries pointing to the same ip:port
-                                continue
-                            names[qname].add(content)
-        self.set_cache("srv", names)
+    def a_records(self):
+        self.update_index()
+        names = self.index.a_records()
+        names.update(self.dns_a_records())
         return names
 
-    def svc_ips(self):
-        addrs = []
-        for nodename in self.cluster_nodes:
-            try:
-                node = shared.CLUSTER_DATA[nodename]
-            except KeyError:
-                continue
-            status = node.get("services", {}).get("status", {})
-            for path, svc in status.items():
-                for rid, resource in status[path].get("resources", {}).items():
-                    addr = resource.get("info", {}).get("ipaddr")
-                    if addr is None:
-                        continue
-                    addrs.append(addr)
-        return addrs
-
-
+    def srv_records(self):
+        self.update_index()
+        return self.index.srv_records(self.cluster_nodes)
@@ -2,6 +2,7 @@
 Listener Thread
 """
 import base64
+import contextlib
 import json
 import os
 import sys
@@ -15,7 +16,10 @@ import traceback
 import uuid
 import fnmatch
 import re
-import datetime
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from six.moves.urllib.parse import urlparse, parse_qs # pylint: disable=import-error
 from subprocess import Popen, PIPE
 from errno import EADDRINUSE, ECONNRESET, EPIPE
@@ -43,7 +47,11 @@ from rcExceptions import HTTP
 from six.moves import queue
 from rcGlobalEnv import rcEnv
 from storage import Storage
+import logreader
 from comm import Headers
+from fswatch import FsWatcher, IN_MODIFY, IN_MOVED_FROM, IN_MOVED_TO, \
+                    IN_CREATE, IN_DELETE, IN_ONLYDIR
+from peerpool import PeerPool
 from rcUtilities import bdecode, drop_option, chunker, svc_pathcf, \
                         split_path, fmt_path, is_service, factory, \
                         makedirs, mimport, set_lazy, lazy, split_fullname, \
@@ -60,8 +68,17 @@ if six.PY2:
     ConnectionResetError = _ConnectionResetError
     ConnectionAbortedError = _ConnectionAbortedError
 
-RE_LOG_LINE = re.compile("^[0-9]{4}-[0-9]{2}-[0-9]{2} [0-2][0-9]:[0-6][0-9]:[0-6][0-9],[0-9]{3} .* \| ")
 JANITORS_INTERVAL = 0.5
+RAW_CLIENT_TIMEOUT = 6
+CLIENT_SOCK_TIMEOUT = 10
+PUSH_INTERVAL = 0.2
+WORKER_IDLE_TIMEOUT = 60
+PEER_CONNECT_TIMEOUT = 5
+MULTIPLEX_TIMEOUT = 60
+
+# the followed log files writes and rotations
+LOGS_WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+                  IN_DELETE | IN_ONLYDIR
 ICON = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAABHNCSVQICAgIfAhkiAAAAAlwSFlzAAABigAAAYoBM5cwWAAAABl0RVh0U29mdHdhcmUAd3d3Lmlua3NjYXBlLm9yZ5vuPBoAAAJKSURBVDiNbZJLSNRRFMZ/5/5HbUidRSVSuGhMzUKiB9SihYaJQlRSm3ZBuxY9JDRb1NSi7KGGELRtIfTcJBjlItsohT0hjcpQSsM0CMfXzP9xWszM35mpA/dy7+Wc7/vOd67wn9gcuZ8bisa3xG271LXthTdNL/rZ0B0VQbNzA+mX2ra+kL04d86NxY86QpEI8catv0+SIyOMNnr6aa4ba/aylL2cTdVI6tBwrbfUXvKeOXY87Ng2jm3H91dNnWrd++U89kIx7jw48+DMf0bcOtk0MA5gABq6egs91+pRCKc01lXOnG2tn4yAKUYkmWpATDlqevRjdb4PYMWDrSiVqIKCosMX932vAYoQQ8bCgGoVajcDmIau3jxP9bj6/igoFqiTuCeLkDQQQOSEDm3PMQEnfxeqhYlSH6Si6WF4EJjIZE+1AqiGCAZ3GoT1yYcEuSqqMDBacOXMo5JORDJBRJa9V0qMqkiGfHwt1vORlW3ND9ZdB/mZNDANJNmgUXcsnTmx+WCBvuH8G6/GC276BpLmA95XMxvVQdC5NOYkkC8ocG9odRCRzEkI0yzF3pn+SM2SKrfJiCRQYp9uqf9l/p2E3pIdr20DkCvBS6o64tMvtzLTfmTiQlGh05w1iSFyQ23+R3rcsjsqrlPr4X3Q5f6nOw7/iOwpX+wEsyLNwLcIB6TsSQzASon+1n83unbboTtiaczz3FVXD451VG+cawfyEAHPGcdzruPOHpOKp39SdcvzyAqdOh3GsyoBsLxJ1hS+F4l42Xl/Abn0Ctwc5dldAAAAAElFTkSuQmCC")
 
 ROUTED_ACTIONS = {
@@ -83,6 +100,7 @@ HANDLERS = [
     "handlerGetDaemonStats",
     "handlerGetDaemonStatus",
     "handlerGetEvents",
+    "handlerGetInstancesStatus",
     "handlerGetKey",
     "handlerGetKeywords",
     "handlerGetNetworks",
@@ -100,6 +118,7 @@ HANDLERS = [
     "handlerGetObjectSelector",
     "handlerGetPools",
     "handlerGetRelayRx",
+    "handlerGetRelaySlots",
     "handlerGetRelayStatus",
     "handlerGetSync",
     "handlerGetTemplates",
@@ -135,6 +154,135 @@ class DontClose(Exception):
     pass
 
 
+class EventMessage(object):
+    """
+    A filtered event, serialized once and shared by all the subscribers
+    with the same filter, whatever their transport.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.json = json.dumps(data)
+        self._raw = None
+        self._encrypted = None
+
+    def raw(self):
+        if self._raw is None:
+            self._raw = (self.json+"\0").encode()
+        return self._raw
+
+    def encrypted(self, crypt):
+        if self._encrypted is None:
+            # encrypt() serializes the data itself
+            self._encrypted = crypt.encrypt(self.data)
+        return self._encrypted
+
+
+class Workers(object):
+    """
+    A bounded pool of threads executing the client connections tasks
+    (tls negotiation, request routing, streams feeding).
+
+    Worker threads are started on demand, up to <maxsize>, and exit after
+    WORKER_IDLE_TIMEOUT seconds without task.
+
+    The workers executing a long-poll handler are not counted in <maxsize>,
+    up to <maxblocking>, so the waiting requests don't starve the pool.
+    """
+    def __init__(self, maxsize, log, maxblocking=0):
+        self.maxsize = maxsize
+        self.maxblocking = maxblocking
+        self.log = log
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.busy = 0
+        self.blocking = 0
+        self.done = 0
+        self.max_queued = 0
+
+    def submit(self, fn, *args):
+        with self.lock:
+            self.grow(1)
+        self.queue.put((fn, args))
+        queued = self.queue.qsize()
+        if queued > self.max_queued:
+            self.max_queued = queued
+
+    def grow(self, incoming=0):
+        """
+        Start a worker thread if the idle threads can't take the queued
+        tasks plus <incoming>. Called with the lock held.
+        """
+        if self.busy + self.queue.qsize() + incoming <= len(self.threads):
+            return
+        if len(self.threads) - self.blocking >= self.maxsize:
+            return
+        thr = threading.Thread(target=self.worker)
+        thr.daemon = True
+        self.threads.append(thr)
+        thr.start()
+
+    @contextlib.contextmanager
+    def long_poll(self):
+        """
+        Release the current worker slot while a long-poll handler waits,
+        and start a worker to take the queued tasks if needed.
+        """
+        with self.lock:
+            released = self.blocking < self.maxblocking
+            if released:
+                self.blocking += 1
+                self.grow()
+        try:
+            yield
+        finally:
+            if released:
+                with self.lock:
+                    self.blocking -= 1
+
+    def worker(self):
+        while True:
+            try:
+                task = self.queue.get(True, WORKER_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self.lock:
+                    if self.queue.empty():
+                        self.threads.remove(threading.current_thread())
+                        return
+                continue
+            if task is None:
+                with self.lock:
+                    self.threads.remove(threading.current_thread())
+                return
+            fn, args = task
+            with self.lock:
+                self.busy += 1
+            try:
+                fn(*args)
+            except Exception as exc:
+                self.log.exception(exc)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.done += 1
+
+    def stop(self):
+        for _ in range(len(self.threads)):
+            self.queue.put(None)
+
+    def status(self):
+        return {
+            "max": self.maxsize,
+            "running": len(self.threads),
+            "busy": self.busy,
+            "blocking": self.blocking,
+            "max_blocking": self.maxblocking,
+            "queued": self.queue.qsize(),
+            "max_queued": self.max_queued,
+            "done": self.done,
+        }
+
+
 class Listener(shared.OsvcThread):
     name = "listener"
     events_grace_period = True
@@ -153,6 +301,7 @@ class Listener(shared.OsvcThread):
     port = -1
     addr = ""
     handlers = {}
+    logs_watch = None
 
     @lazy
     def certfs(self):
@@ -294,6 +443,12 @@ class Listener(shared.OsvcThread):
         self.last_relay_janitor = 0
         self.log = logging.LoggerAdapter(logging.getLogger(rcEnv.nodename+".osvcd.listener"), {"node": rcEnv.nodename, "component": self.name})
         self.events_clients = []
+        self.clients = set()
+        self.peer_pool = PeerPool(self.peer_conn)
+        self.workers = Workers(shared.NODE.oget("listener", "max_workers"), self.log,
+                               maxblocking=shared.NODE.oget("listener", "max_long_polls"))
+        self.setup_wake()
+        self.init_logs_watch()
         self.stats = Storage({
             "sessions": Storage({
                 "accepted": 0,
@@ -319,6 +474,14 @@ class Listener(shared.OsvcThread):
             if self.stopped():
                 for sock in self.sockmap.values():
                     sock.close()
+                for client in list(self.clients):
+                    client.stop()
+                    if not client.busy:
+                        client.close()
+                self.workers.stop()
+                self.peer_pool.close()
+                if self.logs_watch:
+                    self.logs_watch.stop()
                 self.join_threads()
                 if rcEnv.sysname == "Linux":
                     self.certfs.stop()
@@ -331,10 +494,18 @@ class Listener(shared.OsvcThread):
             "port": self.port,
             "addr": self.addr,
         }
+        try:
+            data["workers"] = self.workers.status()
+            data["connections"] = len(self.clients)
+        except AttributeError:
+            # thread not started yet
+            pass
         return data
 
     def reconfigure(self):
         shared.NODE.listener = self
+        self.workers.maxsize = shared.NODE.oget("listener", "max_workers")
+        self.workers.maxblocking = shared.NODE.oget("listener", "max_long_polls")
         unset_lazy(self, "ca")
         unset_lazy(self, "cert")
         unset_lazy(self, "certfs")
@@ -355,6 +526,79 @@ class Listener(shared.OsvcThread):
                 self.alert("error", "error registering handler %s: %s" % (module, exc))
                 continue
 
+    def setup_wake(self):
+        """
+        Setup the pipe the workers use to wake the listener loop up when
+        they are done with a client connection, so the connection is
+        selected again without waiting for the select timeout.
+        """
+        if os.name == "nt":
+            self.wake_r, self.wake_w = None, None
+            return
+        self.wake_r, self.wake_w = os.pipe()
+        for fd in (self.wake_r, self.wake_w):
+            # a full pipe already wakes the loop, don't block the writers
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def wake(self):
+        if self.wake_w is None:
+            return
+        try:
+            os.write(self.wake_w, b"x")
+        except OSError:
+            pass
+
+    def init_logs_watch(self):
+        """
+        Watch the followed log files, so their followers are pushed the new
+        records when the files change, instead of at every loop. Fallback
+        to polling the followed log files if the watcher can not be setup.
+        """
+        self.logs_gen = {}
+        try:
+            watcher = FsWatcher(callback=self.on_logs_change,
+                                match=self.logs_gen.__contains__,
+                                mask=LOGS_WATCH_MASK)
+        except ex.excInitError as exc:
+            self.log.info("poll the followed log files: %s", exc)
+            return
+        watcher.start()
+        self.logs_watch = watcher
+
+    def on_logs_change(self):
+        """
+        The log files watcher callback. Bump the changed log files
+        generation, and wake the loop up to push the new records.
+        """
+        changed, rescan = self.logs_watch.changes()
+        if rescan:
+            changed = list(self.logs_gen)
+        for path in changed:
+            if path in self.logs_gen:
+                self.logs_gen[path] += 1
+        self.wake()
+
+    def watch_log(self, logfile):
+        """
+        Watch the <logfile> directory. Return False if the log file changes
+        are not watched, so its followers must poll.
+        """
+        if self.logs_watch is None:
+            return False
+        logfile = os.path.normpath(logfile)
+        self.logs_gen.setdefault(logfile, 0)
+        try:
+            with self.logs_watch.lock:
+                self.logs_watch.add_tree(os.path.dirname(logfile))
+        except ex.excError as exc:
+            self.log.warning("poll the %s log file: %s", logfile, exc)
+            return False
+        return True
+
+    def log_gen(self, logfile):
+        return self.logs_gen.get(os.path.normpath(logfile))
+
     def do(self):
         self.reload_config()
         ts = time.time()
@@ -362,67 +606,132 @@ class Listener(shared.OsvcThread):
             self.janitor_crl()
             self.janitor_procs()
             self.janitor_threads()
-            self.janitor_events()
             self.janitor_relay()
-        self.last_janitors = ts
-
-        fds = select.select([fno for fno in self.sockmap], [], [], self.sock_tmo)
-        if self.sock_tmo and fds == ([], [], []):
-            return
-        for fd in fds[0]:
-            sock = self.sockmap[fd]
-            try:
-                conn = None
-                conn, addr = sock.accept()
-                self.stats.sessions.accepted += 1
-                if fd == self.sockux.fileno():
-                    tls = False
-                    addr = ["local"]
-                    scheme = "raw"
-                    encrypted = False
-                elif fd == self.sockuxh2.fileno():
-                    tls = False
-                    addr = ["local"]
-                    scheme = "h2"
-                    encrypted = False
-                elif fd == self.sock.fileno():
-                    scheme = "raw"
-                    tls = False
-                    encrypted = True
-                elif fd == self.tls_sock.fileno():
-                    scheme = "h2"
-                    tls = True
-                    encrypted = False
-                else:
-                    print("bug")
-                    continue
-                if addr[0] not in self.stats.sessions.clients:
-                    self.stats.sessions.clients[addr[0]] = Storage({
-                        "accepted": 0,
-                        "auth_validated": 0,
-                        "tx": 0,
-                        "rx": 0,
-                    })
-                self.stats.sessions.clients[addr[0]].accepted += 1
-                #self.log.info("accept %s", str(addr))
-            except socket.timeout:
+            self.janitor_clients()
+            self.peer_pool.janitor()
+            self.last_janitors = ts
+        # the events producers wake the loop up, so the events are
+        # dispatched without waiting for the janitors interval
+        self.janitor_events()
+
+        fds = [fno for fno in self.sockmap]
+        clients = {}
+        pushers = []
+        polled = False
+        events = False
+        for client in list(self.clients):
+            if client.busy:
                 continue
-            except ConnectionAbortedError:
-                if conn:
-                    conn.close()
-                continue
-            except Exception as exc:
-                self.log.exception(exc)
-                if conn:
-                    conn.close()
+            try:
+                clients[client.conn.fileno()] = client
+            except socket.error:
                 continue
+            if client.has_queued_events():
+                events = True
+                pushers.append(client)
+            elif client.has_polled_pushers():
+                polled = True
+                pushers.append(client)
+        fds += [fno for fno in clients]
+        if self.wake_r is not None:
+            fds.append(self.wake_r)
+            timeout = self.sock_tmo
+        else:
+            timeout = PUSH_INTERVAL
+        if events:
+            timeout = 0
+        elif polled:
+            timeout = PUSH_INTERVAL
+
+        fds = select.select(fds, [], [], timeout)
+        readable = set(fds[0])
+        if self.wake_r in readable:
             try:
-                thr = ClientHandler(self, conn, addr, encrypted, scheme, tls, self.tls_context)
-                thr.start()
-                self.threads.append(thr)
-            except RuntimeError as exc:
-                self.log.warning(exc)
+                os.read(self.wake_r, 4096)
+            except OSError:
+                pass
+        for fd in readable:
+            if fd in self.sockmap:
+                self.accept(fd)
+            elif fd in clients:
+                self.serve(clients[fd], True)
+        for client in pushers:
+            if not client.busy:
+                self.serve(client, False)
+
+    def serve(self, client, readable):
+        client.busy = True
+        self.workers.submit(client.serve, readable)
+
+    def accept(self, fd):
+        sock = self.sockmap[fd]
+        try:
+            conn = None
+            conn, addr = sock.accept()
+            self.stats.sessions.accepted += 1
+            if fd == self.sockux.fileno():
+                tls = False
+                addr = ["local"]
+                scheme = "raw"
+                encrypted = False
+            elif fd == self.sockuxh2.fileno():
+                tls = False
+                addr = ["local"]
+                scheme = "h2"
+                encrypted = False
+            elif fd == self.sock.fileno():
+                scheme = "raw"
+                tls = False
+                encrypted = True
+            elif fd == self.tls_sock.fileno():
+                scheme = "h2"
+                tls = True
+                encrypted = False
+            else:
+                print("bug")
+                return
+            if addr[0] not in self.stats.sessions.clients:
+                self.stats.sessions.clients[addr[0]] = Storage({
+                    "accepted": 0,
+                    "auth_validated": 0,
+                    "tx": 0,
+                    "rx": 0,
+                })
+            self.stats.sessions.clients[addr[0]].accepted += 1
+            #self.log.info("accept %s", str(addr))
+        except socket.timeout:
+            return
+        except ConnectionAbortedError:
+            if conn:
                 conn.close()
+            return
+        except Exception as exc:
+            self.log.exception(exc)
+            if conn:
+                conn.close()
+            return
+        conn.settimeout(CLIENT_SOCK_TIMEOUT)
+        client = ClientHandler(self, conn, addr, encrypted, scheme, tls, self.tls_context)
+        self.clients.add(client)
+
+    def peer_conn(self, nodename):
+        """
+        The peer pool connections factory.
+        """
+        sp = self.socket_parms("https://"+nodename)
+        return self.h2c(sp=sp, timeout=(PEER_CONNECT_TIMEOUT, MULTIPLEX_TIMEOUT))
+
+    def janitor_clients(self):
+        """
+        Close the raw connections not sending a complete request in time.
+        """
+        now = time.time()
+        for client in list(self.clients):
+            if client.busy or client.scheme != "raw" or client.raw_events:
+                continue
+            if now - client.last_rx > RAW_CLIENT_TIMEOUT:
+                client.log.warning("timeout waiting for data")
+                client.close()
 
     def janitor_crl(self):
         if not self.tls_sock:
@@ -487,62 +796,89 @@ class Listener(shared.OsvcThread):
                 self.events_grace_period = False
             else:
                 return
-        done = []
+        # selector evaluations cache, per filter key
+        matches = {}
         while True:
             try:
                 event = shared.EVENT_Q.get(False, 0)
             except queue.Empty:
                 break
+            messages = {}
             to_remove = []
             for idx, thr in enumerate(self.events_clients):
-                if thr not in self.threads:
+                if thr not in self.clients:
                     to_remove.append(idx)
                     continue
-                fevent = self.filter_event(event, thr)
-                if fevent is None:
-                    continue
-                # make a copy to avoid being replaced while queued
-                fevent = json.loads(json.dumps(fevent))
                 if thr.h2conn:
                     if not thr.events_stream_ids:
                         to_remove.append(idx)
                         continue
-                thr.event_queue.put(fevent)
-            for idx in to_remove:
+                key = self.event_filter_key(thr)
+                if key not in messages:
+                    fevent = self.filter_event(event, thr, matches=matches.setdefault(key, {}))
+                    messages[key] = None if fevent is None else EventMessage(fevent)
+                if messages[key] is None:
+                    continue
+                thr.event_queue.put(messages[key])
+            for idx in sorted(to_remove, reverse=True):
                 try:
                     del self.events_clients[idx]
                 except IndexError:
                     pass
 
-    def filter_event(self, event, thr):
+    @staticmethod
+    def event_filter_key(thr):
+        """
+        Return a key identifying the events filter applied for a client.
+        The clients with the same key receive the same events.
+        """
+        if thr.usr is False or "root" in thr.usr_grants:
+            return (thr.selector, None)
+        return (thr.selector, frozenset(thr.usr_grants.get("guest", [])))
+
+    def filter_event(self, event, thr, matches=None):
+        """
+        Return <event> limited to the objects the client selected and is
+        granted to see. <event> is not modified.
+
+        <matches> caches the selector evaluations per object path, and can
+        be shared by the clients with the same event_filter_key().
+        """
         if event is None:
             return
         if thr.selector in (None, "**") and (thr.usr is False or "root" in thr.usr_grants):
             # root and no selector => fast path
             return event
         namespaces = thr.get_namespaces()
+        if matches is None:
+            matches = {}
+
+        def match(path):
+            try:
+                return matches[path]
+            except KeyError:
+                pass
+            matches[path] = self.match_object_selector(thr.selector, namespaces=namespaces, path=path)
+            return matches[path]
+
         kind = event.get("kind")
         if kind == "full":
             return event
         elif kind == "patch":
-            return self.filter_patch_event(event, thr, namespaces)
+            return self.filter_patch_event(event, thr, namespaces, match)
         elif kind == "event":
-            return self.filter_event_event(event, thr, namespaces)
+            return self.filter_event_event(event, thr, match)
 
-    def filter_event_event(self, event, thr, namespaces):
-        def valid(change):
-            try:
-                path = event["data"]["path"]
-            except KeyError:
-                return True
-            if thr.selector and not self.match_object_selector(thr.selector, namespaces=namespaces, path=path):
-                return False
-            return False
-        if valid(event):
+    def filter_event_event(self, event, thr, match):
+        try:
+            path = event["data"]["path"]
+        except KeyError:
             return event
-        return None
+        if thr.selector and not match(path):
+            return
+        return event
 
-    def filter_patch_event(self, event, thr, namespaces):
+    def filter_patch_event(self, event, thr, namespaces, match):
         def filter_change(change):
             try:
                 key, value = change
@@ -568,9 +904,9 @@ class Listener(shared.OsvcThread):
                     if key_len == 2:
                         if value is None:
                             return change
-                        value = dict((k, v) for k, v in value.items() if self.match_object_selector(thr.selector, namespaces=namespaces, path=k))
+                        value = dict((k, v) for k, v in value.items() if match(k))
                         return [key, value]
-                    if self.match_object_selector(thr.selector, namespaces=namespaces, path=key[2]):
+                    if match(key[2]):
                         return change
                     else:
                         return
@@ -591,23 +927,13 @@ class Listener(shared.OsvcThread):
                                 return change
                             value = self.filter_daemon_status({"monitor": {"nodes": {key[2]: {"services": value}}}}, namespaces=namespaces, selector=thr.selector)["monitor"]["nodes"][key[2]]["services"]
                             return [key, value]
-                        if key[4] == "status":
-                            if key_len == 5:
-                                if value is None:
-                                    return change
-                                value = dict((k, v) for k, v in value.items() if self.match_object_selector(thr.selector, namespaces=namespaces, path=k))
-                                return [key, value]
-                            if self.match_object_selector(thr.selector, namespaces=namespaces, path=key[5]):
-                                return change
-                            else:
-                                return
-                        if key[4] == "config":
+                        if key[4] in ("status", "config"):
                             if key_len == 5:
                                 if value is None:
                                     return change
-                                value = dict((k, v) for k, v in value.items() if self.match_object_selector(thr.selector, namespaces=namespaces, path=k))
+                                value = dict((k, v) for k, v in value.items() if match(k))
                                 return [key, value]
-                            if self.match_object_selector(thr.selector, namespaces=namespaces, path=key[5]):
+                            if match(key[5]):
                                 return change
                             else:
                                 return
@@ -618,11 +944,9 @@ class Listener(shared.OsvcThread):
             filtered_change = filter_change(change)
             if filtered_change:
                 changes.append(filtered_change)
-            #    print("ACCEPT", thr.usr.name if thr.usr else "", filtered_change)
-            #else:
-            #    print("DROP  ", thr.usr.name if thr.usr else "", change)
-        event["data"] = changes
-        return event
+        fevent = dict(event)
+        fevent["data"] = changes
+        return fevent
 
     def bind_inet(self, sock, addr, port):
         """
@@ -781,9 +1105,25 @@ class Listener(shared.OsvcThread):
 
 
 class ClientHandler(shared.OsvcThread):
+    """
+    A client connection context, passed to the request handlers as <thr>.
+
+    The object is not started as a thread. The listener loop selects the
+    connection and submits the serve() task to its workers pool when data
+    is ready to read or when streams need to be fed. The busy flag
+    guarantees a single worker serves the connection at a time.
+    """
     def __init__(self, parent, conn, addr, encrypted, scheme, tls, tls_context):
         shared.OsvcThread.__init__(self)
         self.parent = parent
+        self.busy = False
+        self.ready = False
+        self.closed = False
+        self.chunks = []
+        self.raw_events = False
+        self.last_rx = time.time()
+        self.sid = str(uuid.uuid4())
+        self.tls_conn = None
         self.event_queue = None
         self.conn = conn
         self.addr = addr
@@ -820,30 +1160,32 @@ class ClientHandler(shared.OsvcThread):
             progress,
         )
 
-    def run(self):
+    def serve(self, readable=True):
+        """
+        The worker task: read and process the available data if <readable>,
+        then feed the streams.
+        """
         try:
-            close = True
-            self.sid = str(uuid.uuid4())
-            self.parent.stats.sessions.alive[self.sid] = Storage({
-                "created": time.time(),
-                "addr": self.addr[0],
-                "encrypted": self.encrypted,
-                "progress": "init",
-            })
-            if self.scheme == "h2":
-                self.handle_h2_client()
-            else:
-                self.handle_raw_client()
+            if not self.ready:
+                self.setup()
+            elif readable:
+                self.receive()
+            while self.has_pending() and not self.stopped():
+                self.receive()
+            self.push()
         except Close:
-            pass
+            self.stop()
         except DontClose:
-            close = False
+            pass
         except (OSError, socket.error) as exc:
-            if exc.errno in (0, ECONNRESET):
-                pass
+            self.stop()
+            if exc.errno not in (0, ECONNRESET, EPIPE):
+                self.log.error("%s", exc)
         except RuntimeError as exc:
+            self.stop()
             self.log.error("%s", exc)
         except Exception as exc:
+            self.stop()
             try:
                 ignore = exc.errno == 0
             except AttributeError:
@@ -852,11 +1194,97 @@ class ClientHandler(shared.OsvcThread):
                 self.log.error("unexpected: %s", exc)
                 traceback.print_exc()
         finally:
-            if close:
-                del self.parent.stats.sessions.alive[self.sid]
-                if self.h2conn:
-                    self.h2conn.close_connection()
-                self.conn.close()
+            if self.stopped():
+                self.close()
+            self.busy = False
+            self.parent.wake()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stop()
+        self.parent.clients.discard(self)
+        try:
+            del self.parent.stats.sessions.alive[self.sid]
+        except KeyError:
+            pass
+        try:
+            if self.h2conn:
+                self.h2conn.close_connection()
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except socket.error:
+            pass
+
+    def setup(self):
+        self.ready = True
+        self.parent.stats.sessions.alive[self.sid] = Storage({
+            "created": time.time(),
+            "addr": self.addr[0],
+            "encrypted": self.encrypted,
+            "progress": "init",
+        })
+        if self.scheme == "h2":
+            self.setup_h2_client()
+        else:
+            self.receive()
+
+    def has_pending(self):
+        """
+        Return True if the tls layer holds decrypted data not yet read,
+        which the listener select can not detect.
+        """
+        if self.tls_conn is None or not self.tls:
+            return False
+        try:
+            return self.tls_conn.pending() > 0
+        except Exception:
+            return False
+
+    def has_polled_pushers(self):
+        """
+        Return True if the connection has pushers to execute at every
+        listener loop, like logs follow or peer streams relay. The events
+        pushers are executed only when events are queued.
+        """
+        if not self.h2conn:
+            return False
+        for stream in self.streams.values():
+            for pusher in stream.get("pushers", []):
+                if pusher.get("fn") == "h2_push_action_events":
+                    continue
+                if pusher.get("watched") and \
+                   pusher.get("gen") == self.parent.log_gen(pusher["args"][0].name):
+                    # the followed log file is unchanged since the last push
+                    continue
+                return True
+        return False
+
+    def has_queued_events(self):
+        """
+        Return True if the connection is an events stream with events
+        queued by the listener janitor_events().
+        """
+        if not self.raw_events and not self.events_stream_ids:
+            return False
+        return self.event_queue is not None and not self.event_queue.empty()
+
+    def receive(self):
+        if self.scheme == "h2":
+            self.receive_h2()
+        else:
+            self.receive_raw()
+
+    def push(self):
+        if self.stopped():
+            return
+        if self.raw_events:
+            self.raw_push_action_events()
+        elif self.h2conn:
+            self.h2_push()
 
     def negotiate_tls(self):
         """
@@ -1052,7 +1480,9 @@ class ClientHandler(shared.OsvcThread):
                 ('Connection', 'keep-alive'),
                 ('Transfer-Encoding', 'chunked'),
             ]
-        if "json" in content_type:
+        if isinstance(data, EventMessage):
+            data = data.json.encode()
+        elif "json" in content_type:
             if data is None:
                 data = {}
             data = json.dumps(data).encode()
@@ -1276,7 +1706,7 @@ class ClientHandler(shared.OsvcThread):
             elif isinstance(event, h2.events.ConnectionTerminated):
                 self.stop()
 
-    def handle_h2_client(self):
+    def setup_h2_client(self):
         self.negotiate_tls()
 
         # init h2 connection
@@ -1288,83 +1718,80 @@ class ClientHandler(shared.OsvcThread):
         except socket.error as exc:
             if exc.errno == EPIPE:
                 # daemon restart with connected clients
-                return
+                raise Close
             raise
 
-        while True:
-            if self.stopped():
-                break
-            try:
-                data = self.tls_conn.recv(65535)
-                if not data:
-                    break
-                self.parent.stats.sessions.rx += len(data)
-                self.parent.stats.sessions.clients[self.addr[0]].rx += len(data)
-                self.h2_received(data)
-            except ssl.SSLError:
-                pass
-            except socket.timeout:
-                pass
-            except socket.error as exc:
-                if exc.errno in (0, ECONNRESET):
+    def receive_h2(self):
+        try:
+            data = self.tls_conn.recv(65535)
+        except ssl.SSLError:
+            return
+        except socket.timeout:
+            return
+        except socket.error as exc:
+            if exc.errno in (0, ECONNRESET):
+                raise Close
+            raise
+        except h2.exceptions.StreamClosedError:
+            raise Close
+        except ConnectionResetError:
+            raise Close
+        if not data:
+            raise Close
+        self.last_rx = time.time()
+        self.parent.stats.sessions.rx += len(data)
+        self.parent.stats.sessions.clients[self.addr[0]].rx += len(data)
+        self.h2_received(data)
+        self.h2_flush()
+
+    def h2_push(self):
+        """
+        Execute all registered pushers.
+        """
+        pushers_per_stream = [(stream_id, stream.get("pushers", [])) for stream_id, stream in self.streams.items() if stream.get("pushers")]
+        for stream_id, pushers in pushers_per_stream:
+            for pusher in pushers:
+                fn = pusher.get("fn")
+                args = pusher.get("args", [])
+                kwargs = pusher.get("kwargs", {})
+                if not fn:
                     continue
-                self.log.error("%s", exc)
-                return
-            except h2.exceptions.StreamClosedError:
-                return
-            except ConnectionResetError:
-                return
-            except Exception as exc:
-                self.log.error("exit on %s %s", type(exc), exc)
-                traceback.print_exc()
-                return
-
-            # execute all registered pushers
-            pushers_per_stream = [(stream_id, stream.get("pushers", [])) for stream_id, stream in self.streams.items() if stream.get("pushers")]
-            for stream_id, pushers in pushers_per_stream:
-                for pusher in pushers:
-                    fn = pusher.get("fn")
-                    args = pusher.get("args", [])
-                    kwargs = pusher.get("kwargs", {})
-                    if not fn:
-                        continue
-                    try:
-                        getattr(self, fn)(stream_id, *args, **kwargs)
-                    except Exception as exc:
-                        print(exc)
+                if pusher.get("watched"):
+                    # the changes after this point trigger the next push
+                    pusher["gen"] = self.parent.log_gen(args[0].name)
+                try:
+                    getattr(self, fn)(stream_id, *args, **kwargs)
+                except Exception as exc:
+                    print(exc)
+        self.h2_flush()
 
-            data_to_send = self.h2conn.data_to_send()
-            if data_to_send:
-                self.tls_conn.sendall(data_to_send)
+    def h2_flush(self):
+        data_to_send = self.h2conn.data_to_send()
+        if data_to_send:
+            self.tls_conn.sendall(data_to_send)
 
-    def handle_raw_client(self):
-        chunks = []
-        buff_size = 4096
-        self.conn.setblocking(0)
-        while True:
-            if self.stopped():
-                break
-            ready = select.select([self.conn], [], [self.conn], 6)
-            if ready[0]:
-                chunk = self.sock_recv(self.conn, buff_size)
-            else:
-                self.log.warning("timeout waiting for data")
-                return
-            if ready[2]:
-                self.log.debug("exceptional condition on socket")
-                return
-            self.parent.stats.sessions.rx += len(chunk)
-            self.parent.stats.sessions.clients[self.addr[0]].rx += len(chunk)
-            if chunk:
-                chunks.append(chunk)
-            if not chunk or chunk.endswith(b"\x00"):
-                break
+    def receive_raw(self):
+        chunk = self.sock_recv(self.conn, 4096)
+        self.last_rx = time.time()
+        self.parent.stats.sessions.rx += len(chunk)
+        self.parent.stats.sessions.clients[self.addr[0]].rx += len(chunk)
+        if self.raw_events:
+            # the client is not expected to talk on an events stream
+            if not chunk:
+                raise Close
+            return
+        if chunk:
+            self.chunks.append(chunk)
+        if chunk and not chunk.endswith(b"\x00"):
+            return
         if six.PY3:
-            data = b"".join(chunks)
+            data = b"".join(self.chunks)
         else:
-            data = "".join(chunks)
-        del chunks
+            data = "".join(self.chunks)
+        self.chunks = []
         self.handle_raw_client_data(data)
+        if not self.raw_events:
+            raise Close
 
     def handle_raw_client_data(self, data):
         if six.PY3:
@@ -1625,50 +2052,112 @@ class ClientHandler(shared.OsvcThread):
         def do_node(nodename):
             if nodename == rcEnv.nodename:
                 try:
-                    _result = handler.action(nodename, action=action, options=options, stream_id=stream_id, thr=self)
+                    return handler.action(nodename, action=action, options=options, stream_id=stream_id, thr=self)
                 except HTTP as exc:
-                    status = exc.status
-                    _result = {"status": exc.status, "error": exc.msg}
+                    return {"status": exc.status, "error": exc.msg}
                 except ex.excError as exc:
-                    status = 400
-                    _result = {"status": status, "error": str(exc)}
+                    return {"status": 400, "error": str(exc)}
                 except Exception as exc:
-                    status = 500
-                    _result = {"status": status, "error": str(exc), "traceback": traceback.format_exc()}
                     self.log.exception(exc)
-                result["nodes"][nodename] = _result
+                    return {"status": 500, "error": str(exc), "traceback": traceback.format_exc()}
+            elif handler.stream:
+                sp = self.socket_parms("https://"+nodename)
+                client_stream_id, conn, resp = self.h2_daemon_stream_conn(data, sp=sp)
+                self.streams[stream_id]["pushers"].append({
+                    "fn": "push_peer_stream",
+                    "args": [nodename, client_stream_id, conn, resp],
+                })
+                return {}
+            else:
+                return self.peer_request(dict(data), nodename, method=method)
+
+        if handler.stream:
+            for nodename in nodenames:
                 try:
+                    do_node(nodename)
+                except Exception:
+                    continue
+            return
+
+        for nodename, _result in self.fanout(nodenames, do_node).items():
+            result["nodes"][nodename] = _result
+            try:
+                if nodename == rcEnv.nodename:
                     result["status"] += 1 if _result.get("status") else 0
-                except AttributeError:
-                    # result is not a dict
-                    pass
-            else:
-                if handler.stream:
-                    sp = self.socket_parms("https://"+nodename)
-                    client_stream_id, conn, resp = self.h2_daemon_stream_conn(data, sp=sp)
-                    self.streams[stream_id]["pushers"].append({
-                        "fn": "push_peer_stream",
-                        "args": [nodename, client_stream_id, conn, resp],
-                    })
-                    _result = {}
                 else:
-                    _result = self.daemon_request(data, server=nodename, silent=True, method=method)
-                result["nodes"][nodename] = _result
-                try:
                     result["status"] += _result.get("status", 0)
-                except AttributeError:
-                    # result is not a dict
-                    pass
+            except AttributeError:
+                # result is not a dict
+                pass
+        return result
 
-        for nodename in nodenames:
+    def fanout(self, nodenames, fn, timeout=MULTIPLEX_TIMEOUT):
+        """
+        Call <fn>(nodename) for all <nodenames> concurrently, and return the
+        {nodename: result} dict.
+
+        The peers are served by dedicated threads, while the local node is
+        served by the calling thread, so its errors are raised like in a
+        non-multiplexed request. The peers not done before the <timeout>
+        deadline have an error result, so a slow or unreachable peer does
+        not delay the results of the other nodes.
+        """
+        results = {}
+
+        def do_peer(nodename):
             try:
-                do_node(nodename)
-            except Exception:
+                results[nodename] = fn(nodename)
+            except Exception as exc:
+                results[nodename] = {"status": 1, "error": str(exc)}
+
+        deadline = time.time() + timeout
+        threads = []
+        for nodename in nodenames:
+            if nodename == rcEnv.nodename:
                 continue
+            thr = threading.Thread(target=do_peer, args=(nodename,))
+            thr.daemon = True
+            thr.start()
+            threads.append(thr)
+        if rcEnv.nodename in nodenames:
+            results[rcEnv.nodename] = fn(rcEnv.nodename)
+        for thr in threads:
+            thr.join(max(deadline - time.time(), 0))
+        return dict((nodename, results.get(nodename, {
+            "status": 1,
+            "error": "timeout waiting for the node result",
+        })) for nodename in nodenames)
+
+    def peer_request(self, data, nodename, method="GET"):
+        """
+        Relay the <data> request to the <nodename> peer, through a pooled h2
+        connection.
 
-        if handler.stream:
-            return
-        return result
+        A pooled connection closed by the peer while idle is discarded and
+        the request is sent on the next one. If a new connection can not be
+        established, for example if the peer has no tls listener, the
+        request is relayed by the raw protocol.
+        """
+        sp = self.socket_parms("https://"+nodename)
+        pool = self.parent.peer_pool
+        while True:
+            conn, reused = pool.acquire(nodename)
+            if not reused:
+                try:
+                    conn.connect()
+                except Exception as exc:
+                    pool.discard(conn)
+                    self.log.debug("h2 connect to %s failed, use the raw relay: %s", nodename, exc)
+                    return self.daemon_request(data, server=nodename, silent=True, method=method)
+            try:
+                result = self.h2_conn_request(conn, data, sp, method=method)
+            except Exception as exc:
+                pool.discard(conn)
+                if reused:
+                    continue
+                return {"status": 1, "error": "%s" % exc}
+            pool.release(nodename, conn)
+            return result
 
     def push_peer_stream(self, stream_id, nodename, client_stream_id, conn, resp):
         if conn._sock.can_read:
@@ -1706,24 +2195,24 @@ class ClientHandler(shared.OsvcThread):
             if node not in h:
                 h[node] = {}
             h[node][path] = svcdata
-        result = {"nodes": {}, "status": 0}
-        for nodename, optdata in h.items():
+        def do_node(nodename):
+            optdata = h[nodename]
             _options = {}
             _options.update(options)
             _options["data"] = optdata
             if nodename == rcEnv.nodename:
-                _result = handler.action(nodename, action=action, options=_options, stream_id=stream_id, thr=self)
-                result["nodes"][nodename] = _result
-                result["status"] += _result.get("status", 0)
-            else:
-                _data = {}
-                _data.update(data)
-                _data["options"] = _options
-                _data["multiplexed"] = True # prevent multiplex at the peer endpoint
-                self.log_request("relay create/update %s to %s" % (",".join([p for p in optdata]), nodename), original_nodename)
-                _result = self.daemon_post(_data, server=nodename, silent=True)
-                result["nodes"][nodename] = _result
-                result["status"] += _result.get("status", 0)
+                return handler.action(nodename, action=action, options=_options, stream_id=stream_id, thr=self)
+            _data = {}
+            _data.update(data)
+            _data["options"] = _options
+            _data["multiplexed"] = True # prevent multiplex at the peer endpoint
+            self.log_request("relay create/update %s to %s" % (",".join([p for p in optdata]), nodename), original_nodename)
+            return self.peer_request(_data, nodename, method="POST")
+
+        result = {"nodes": {}, "status": 0}
+        for nodename, _result in self.fanout(list(h), do_node).items():
+            result["nodes"][nodename] = _result
+            result["status"] += _result.get("status", 0)
         return result
 
     @staticmethod
@@ -1819,6 +2308,12 @@ class ClientHandler(shared.OsvcThread):
 
         if action == "create":
             return self.create_multiplex(handler, options, data, nodename, action, stream_id=stream_id)
+        if getattr(handler, "long_poll", False):
+            with self.parent.workers.long_poll():
+                return self.route(handler, options, data, nodename, action, stream_id=stream_id)
+        return self.route(handler, options, data, nodename, action, stream_id=stream_id)
+
+    def route(self, handler, options, data, nodename, action, stream_id=None):
         node = data.get("node")
         if data.get("multiplexed") or handler.multiplex == "never":
             return handler.action(nodename, action=action, options=options, stream_id=stream_id, thr=self)
@@ -1842,22 +2337,26 @@ class ClientHandler(shared.OsvcThread):
             self.h2_stream_send(stream_id, msg)
 
     def raw_push_action_events(self):
+        """
+        Switch the connection to events streaming, and send the queued
+        events. The listener loop calls this method again periodically.
+        """
+        if not self.raw_events:
+            self.raw_events = True
+            self.conn.setblocking(1)
+            self.conn.settimeout(CLIENT_SOCK_TIMEOUT)
         while True:
-            if self.stopped():
-                break
-            while True:
-                try:
-                    buff = self.conn.recv(4096)
-                except Exception as exc:
-                    break
-                if not buff:
-                    return
             try:
-                msg = self.event_queue.get(True, 1)
+                msg = self.event_queue.get(False, 0)
             except queue.Empty:
-                continue
+                break
 
-            if self.encrypted:
+            if isinstance(msg, EventMessage):
+                if self.encrypted:
+                    msg = msg.encrypted(self)
+                else:
+                    msg = msg.raw()
+            elif self.encrypted:
                 msg = self.encrypt(msg)
             else:
                 msg = self.msg_encode(msg)
@@ -1898,57 +2397,33 @@ class ClientHandler(shared.OsvcThread):
             line = ofile.readline()
         return ofile
 
-    def read_file_lines(self, ofile):
-        data = []
-        buff = ""
-        def parse(_buff):
-            head, message = _buff.split(" | ", 1)
-            date_s, time_s, lvl, meta = head.split(None, 3)
-            d = {
-                "t": datetime.datetime.strptime(date_s + " " + time_s, "%Y-%m-%d %H:%M:%S,%f").timestamp(),
-                "l": lvl,
-                "m": message.rstrip().split("\n"),
-                "x": {},
-            }
-            for m in meta.split():
-                k, v = m.split(":", 1)
-                d["x"][k] = v
-            return d
-
-        while True:
-            line = ofile.readline()
-            if not line:
-                break
-            if RE_LOG_LINE.match(line):
-                if buff:
-                    # new msg, push pending buff
-                    try:
-                        data.append(parse(buff))
-                    except ValueError:
-                        pass
-                buff = line
-            else:
-                buff += line
-        if buff:
-            # EOF, push pending buff
-            try:
-                data.append(parse(buff))
-            except ValueError:
-                pass
-        return data
+    @staticmethod
+    def read_file_lines(ofile):
+        return logreader.read_records(ofile)
 
     def h2_push_logs(self, stream_id, ofile, follow):
-        lines = self.read_file_lines(ofile)
         if not follow:
+            lines = logreader.read_records(ofile)
             ofile.close()
             del self.streams[stream_id]["pushers"]
+        else:
+            lines, _ofile = logreader.follow(ofile)
+            if _ofile is not ofile:
+                # the log file was rotated
+                for pusher in self.streams[stream_id]["pushers"]:
+                    if pusher.get("fn") == "h2_push_logs" and pusher["args"][0] is ofile:
+                        pusher["args"][0] = _ofile
         if lines:
             self.h2_stream_send(stream_id, lines)
 
     def h2_sse_stream_send(self, stream_id, data):
         self.events_counter += 1
+        if isinstance(data, EventMessage):
+            data = data.json
+        else:
+            data = json.dumps(data)
         msg = "id: %d\n" % self.events_counter
-        msg += "data: %s\n\n" % json.dumps(data)
+        msg += "data: %s\n\n" % data
         self.streams[stream_id]["outbound"] += msg.encode()
         self.send_outbound(stream_id)
 
@@ -19,7 +19,6 @@ from itertools import chain
 
 import osvcd_shared as shared
 import rcExceptions as ex
-import json_delta
 from rcGlobalEnv import rcEnv
 from storage import Storage
 from rcUtilities import bdecode, purge_cache, fsum, \
@@ -27,6 +26,7 @@ from rcUtilities import bdecode, purge_cache, fsum, \
                         list_services, svc_pathcf, fmt_path, \
                         resolve_path, factory
 from freezer import Freezer
+from fswatch import FsWatcher
 
 STARTED_STATES = [
     "n/a",
@@ -73,6 +73,7 @@ LEADER_ABORT_STATES = (
 )
 
 ETC_NS_SKIP = len(os.path.join(rcEnv.paths.pathetcns, ""))
+ROOT_KINDS = ("vol", "cfg", "sec", "usr")
 
 class Monitor(shared.OsvcThread):
     """
@@ -90,7 +91,11 @@ class Monitor(shared.OsvcThread):
         shared.OsvcThread.__init__(self)
         self._shutdown = False
         self.compat = True
-        self.last_node_data = None
+        self.fswatch = None
+        self.services_list = None
+        self.config_changed = set()
+        self.status_changed = set()
+        self.fswatch_rescan = False
 
     def init(self):
         self.set_tid()
@@ -101,9 +106,11 @@ class Monitor(shared.OsvcThread):
         self.shortloops = 0
         self.unfreeze_when_all_nodes_joined = False
         self.node_frozen = self.freezer.node_frozen()
+        self.init_fswatch()
 
         shared.CLUSTER_DATA[rcEnv.nodename] = {
             "compat": shared.COMPAT_VERSION,
+            "features": shared.FEATURES,
             "api": shared.API_VERSION,
             "agent": shared.NODE.agent_version,
             "monitor": dict(shared.NMON_DATA),
@@ -145,16 +152,19 @@ class Monitor(shared.OsvcThread):
             self.init()
         except Exception as exc:
             self.log.exception(exc)
+            self.stop_fswatch()
             raise
         try:
             while True:
                 self.do()
                 if self.stopped():
+                    self.stop_fswatch()
                     self.join_threads()
                     self.kill_procs()
                     sys.exit(0)
         except Exception as exc:
             self.log.exception(exc)
+            self.stop_fswatch()
 
     def transition_count(self):
         count = 0
@@ -2772,16 +2782,149 @@ class Monitor(shared.OsvcThread):
         self.log.info("service %s config consensus reached", path)
         return True
 
+    #########################################################################
+    #
+    # Objects config and status files change detection
+    #
+    #########################################################################
+    def init_fswatch(self):
+        """
+        Watch the objects configuration and status.json files, so the
+        monitor loop stats and reloads only the changed files. Fallback to
+        polling all files if the watcher can not be setup.
+        """
+        try:
+            watcher = FsWatcher(callback=self.on_fswatch_change, match=self.fswatch_match)
+        except ex.excInitError as exc:
+            self.log.info("poll objects config and status files: %s", exc)
+            return
+        try:
+            for path in (rcEnv.paths.pathetcns, os.path.join(rcEnv.paths.pathvar, "namespaces")):
+                makedirs(path)
+            # deepest trees first, so the nested directories get the right depth
+            watcher.add_tree(rcEnv.paths.pathetcns, 2)
+            watcher.add_tree(rcEnv.paths.pathetc, 1)
+            watcher.add_tree(os.path.join(rcEnv.paths.pathvar, "namespaces"), 3)
+            watcher.add_tree(rcEnv.paths.pathvar, 2)
+        except (OSError, ex.excError) as exc:
+            self.log.warning("poll objects config and status files: %s", exc)
+            watcher.close()
+            return
+        self.log.info("watch objects config and status files (%d directories)", len(watcher.dirs))
+        watcher.start()
+        self.fswatch = watcher
+
+    def stop_fswatch(self):
+        """
+        Stop the watcher and fallback to polling the objects config and
+        status files.
+        """
+        if self.fswatch is None:
+            return
+        self.fswatch.stop()
+        self.fswatch = None
+
+    @staticmethod
+    def fswatch_match(path):
+        return path.endswith(".conf") or path.endswith(os.sep + "status.json")
+
+    @staticmethod
+    def on_fswatch_change():
+        shared.wake_monitor(reason="objects config or status file change")
+
+    def get_fswatch_changes(self):
+        """
+        Consume the watcher changes, updating the sets of objects with a
+        changed config file and with a changed status.json file.
+
+        Return True if the objects list needs to be refreshed.
+        """
+        if self.fswatch is None:
+            return True
+        if self.fswatch.unwatched:
+            # the changes in these directories would be missed
+            self.log.warning("poll objects config and status files: can not watch %s",
+                             ", ".join(sorted(self.fswatch.unwatched)))
+            self.stop_fswatch()
+            return True
+        changed, rescan = self.fswatch.changes()
+        if rescan:
+            self.log.info("objects config and status files events lost, rescan")
+            self.fswatch_rescan = True
+        known = set(self.services_list or [])
+        list_changed = rescan
+        for fpath in changed:
+            kind, path = self.fswatch_object(fpath)
+            if kind == "status":
+                self.status_changed.add(path)
+            elif kind == "config":
+                self.config_changed.add(path)
+                if (path in known) != os.path.exists(fpath):
+                    list_changed = True
+            elif kind == "etc":
+                list_changed = True
+        return list_changed
+
+    @staticmethod
+    def fswatch_object(fpath):
+        """
+        Return a (<change kind>, <object path>) tuple for a watched file path.
+        The change kind is "config" or "status" for objects files, "etc" for
+        other changes in the config directories, or None.
+        """
+        def relpath(head):
+            head = os.path.join(head, "")
+            if fpath.startswith(head):
+                return fpath[len(head):].split(os.sep)
+
+        elements = relpath(rcEnv.paths.pathetcns)
+        if elements:
+            if len(elements) == 3 and elements[2].endswith(".conf"):
+                return "config", fmt_path(elements[2][:-5], elements[0], elements[1])
+            return "etc", None
+        elements = relpath(rcEnv.paths.pathetc)
+        if elements:
+            if len(elements) == 1 and elements[0].endswith(".conf"):
+                return "config", elements[0][:-5]
+            if len(elements) == 2 and elements[0] in ROOT_KINDS and elements[1].endswith(".conf"):
+                return "config", fmt_path(elements[1][:-5], None, elements[0])
+            return "etc", None
+        if not fpath.endswith(os.sep + "status.json"):
+            return None, None
+        elements = relpath(os.path.join(rcEnv.paths.pathvar, "namespaces"))
+        if elements:
+            if len(elements) == 4:
+                return "status", fmt_path(elements[2], elements[0], elements[1])
+            return None, None
+        elements = relpath(rcEnv.paths.pathvar)
+        if elements and len(elements) == 3:
+            return "status", fmt_path(elements[1], None, elements[0])
+        return None, None
+
+    def get_services_list(self):
+        """
+        Return the local objects list, from the cache if the watcher did not
+        see a change in the config directories.
+        """
+        if self.get_fswatch_changes() or self.services_list is None:
+            self.services_list = list_services()
+        return self.services_list
+
     def get_services_config(self):
         config = {}
-        for path in list_services():
+        for path in self.get_services_list():
             cfg = svc_pathcf(path)
-            try:
-                config_mtime = os.path.getmtime(cfg)
-            except Exception as exc:
-                self.log.warning("failed to get %s mtime: %s", cfg, str(exc))
-                config_mtime = 0
             last_config = self.get_last_svc_config(path)
+            if self.fswatch and not self.fswatch_rescan and last_config is not None and \
+               path not in self.config_changed:
+                # the watcher saw no change, save a stat
+                config_mtime = last_config["updated"]
+            else:
+                try:
+                    config_mtime = os.path.getmtime(cfg)
+                except Exception as exc:
+                    self.log.warning("failed to get %s mtime: %s", cfg, str(exc))
+                    config_mtime = 0
             if last_config is None or config_mtime > last_config["updated"]:
                 #self.log.debug("compute service %s config checksum", path)
                 try:
@@ -2815,6 +2958,9 @@ class Monitor(shared.OsvcThread):
                 "csum": csum,
                 "scope": scope,
             }
+            if config[path] != last_config:
+                with shared.CLUSTER_DATA_LOCK:
+                    shared.node_data_changed(rcEnv.nodename, "services", "config", path)
 
         # purge deleted services
         with shared.SERVICES_LOCK:
@@ -2826,6 +2972,7 @@ class Monitor(shared.OsvcThread):
                         del shared.CLUSTER_DATA[rcEnv.nodename]["services"]["status"][path]
                     except KeyError:
                         pass
+        self.config_changed = set()
         return config
 
     def get_last_svc_status_mtime(self, path):
@@ -2890,11 +3037,16 @@ class Monitor(shared.OsvcThread):
             idata = None
             last_mtime = self.get_last_svc_status_mtime(path)
             fpath = svc_pathvar(path, "status.json")
-            try:
-                mtime = os.path.getmtime(fpath)
-            except Exception as exc:
-                # preserve previous status data if any (an action may be running)
-                mtime = 0
+            if self.fswatch and not self.fswatch_rescan and last_mtime > 0 and \
+               path not in self.status_changed:
+                # the watcher saw no change, save a stat
+                mtime = last_mtime
+            else:
+                try:
+                    mtime = os.path.getmtime(fpath)
+                except Exception as exc:
+                    # preserve previous status data if any (an action may be running)
+                    mtime = 0
 
             try:
                need_load = mtime > last_mtime + 0.0001
@@ -2918,19 +3070,25 @@ class Monitor(shared.OsvcThread):
                 continue
 
             # update the frozen instance attribute
-            data[path]["frozen"] = shared.SERVICES[path].frozen()
+            frozen = shared.SERVICES[path].frozen()
 
             # embed the updated smon data
             self.set_smon_l_expect_from_status(data, path)
-            data[path]["monitor"] = dict(self.get_service_monitor(path))
+            monitor = dict(self.get_service_monitor(path))
 
             # forget the stonith target node if we run the service
             if data[path].get("avail", "n/a") == "up":
                 try:
-                    del data[path]["monitor"]["stonith"]
+                    del monitor["stonith"]
                 except KeyError:
                     pass
 
+            if need_load or data[path].get("frozen") != frozen or data[path].get("monitor") != monitor:
+                with shared.CLUSTER_DATA_LOCK:
+                    data[path]["frozen"] = frozen
+                    data[path]["monitor"] = monitor
+                    shared.node_data_changed(rcEnv.nodename, "services", "status", path)
+
         # deleting services (still in SMON_DATA, no longer has cf).
         # emulate a status
         for path in set(shared.SMON_DATA.keys()) - set(paths):
@@ -2938,7 +3096,11 @@ class Monitor(shared.OsvcThread):
                 "monitor": dict(self.get_service_monitor(path)),
                 "resources": {},
             }
+            with shared.CLUSTER_DATA_LOCK:
+                shared.node_data_changed(rcEnv.nodename, "services", "status", path)
 
+        self.status_changed = set()
+        self.fswatch_rescan = False
         return data
 
     #########################################################################
@@ -3219,6 +3381,8 @@ class Monitor(shared.OsvcThread):
              # needed.
              shared.HB_MSG = None
              shared.HB_MSG_LEN = 0
+             shared.HB_BIN_MSG = None
+             shared.HB_BIN_MSG_LEN = 0
         shared.wake_heartbeat_tx()
 
     def _update_hb_data_locked(self):
@@ -3236,24 +3400,19 @@ class Monitor(shared.OsvcThread):
         except KeyError:
             updated = now
 
-        if self.last_node_data is not None:
-            diff = json_delta.diff(
-                self.last_node_data, data,
-                verbose=False, array_align=False, compare_lengths=False
-            )
-        else:
+        if shared.NODE_DATA_TREE.updates == 0:
             # first run
-            self.last_node_data = json.loads(json.dumps(data))
+            shared.NODE_DATA_TREE.update(data)
             data["gen"] = self.get_gen(inc=True)
             data["updated"] = now
             return
 
+        diff = shared.NODE_DATA_TREE.update(data)
         if len(diff) == 0:
             data["gen"] = self.get_gen(inc=False)
             data["updated"] = updated
             return
 
-        self.last_node_data = json.loads(json.dumps(data))
         data["gen"] = self.get_gen(inc=True)
         data["updated"] = now
         diff.append([["updated"], data["updated"]])
@@ -3539,9 +3698,19 @@ class Monitor(shared.OsvcThread):
             print(exc)
             pass
 
-    def status(self):
-        data = shared.OsvcThread.status(self)
-        data["nodes"] = json.loads(json.dumps(shared.CLUSTER_DATA))
+    def status(self, live=False, **kwargs):
+        """
+        Return the thread status data, embedding a copy of the cluster data.
+
+        If <live> is True, embed the live cluster data instead. The caller
+        must then hold CLUSTER_DATA_LOCK while reading the embedded data,
+        and must not modify it.
+        """
+        data = shared.OsvcThread.status(self, **kwargs)
+        if live:
+            data["nodes"] = shared.CLUSTER_DATA
+        else:
+            data["nodes"] = json.loads(json.dumps(shared.CLUSTER_DATA))
         data["compat"] = self.compat
         data["transitions"] = self.transition_count()
         data["frozen"] = self.get_clu_agg_frozen()
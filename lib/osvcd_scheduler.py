@@ -5,6 +5,9 @@ import os
 import sys
 import logging
 import time
+import datetime
+import heapq
+import itertools
 from subprocess import Popen, PIPE
 
 import osvcd_shared as shared
@@ -19,6 +22,10 @@ ENQUEUE_INTERVAL = 30
 FUTURE = 60
 MIN_DEQUEUE_INTERVAL = 0.5
 JANITOR_CERTS_INTERVAL = 3600
+# re-evaluate the tasks without next run date in the schedule horizon
+RECHECK_INTERVAL = 3600
+# the number of next runs reported by status()
+STATUS_MAX_NEXT = 100
 ACTIONS_SKIP_ON_UNPROV = [
     "sync_all",
     "compliance_auto",
@@ -34,6 +41,19 @@ class Scheduler(shared.OsvcThread):
     certificates = {}
     last_janitor_certs = 0
 
+    def __init__(self):
+        shared.OsvcThread.__init__(self)
+        # the next run dates heap, of (date, seq, (path, action)) entries.
+        # Outdated entries are left in the heap, and skipped when popped if
+        # the date is not the one in self.next_fires.
+        self.heap = []
+        self.seq = itertools.count()
+        self.next_fires = {}
+        # the objects and their cluster last runs data, the next runs were
+        # computed from
+        self.sched_objs = {}
+        self.sched_lasts = {}
+
     def max_tasks(self):
         if self.node_overloaded():
             return MIN_OVERLOADED_PARALLEL
@@ -63,6 +83,17 @@ class Scheduler(shared.OsvcThread):
                 "queued": entry["queued"],
                 "expire": entry["expire"],
             })
+
+        # thread-safe next runs dump
+        next_fires = dict(self.next_fires)
+        data["scheduled"] = len(next_fires)
+        data["next"] = []
+        for date, path, action in sorted((date, path or "", action) for (path, action), date in next_fires.items())[:STATUS_MAX_NEXT]:
+            data["next"].append({
+                "action": action,
+                "path": path or None,
+                "next": date,
+            })
         return data
 
     def run(self):
@@ -85,14 +116,23 @@ class Scheduler(shared.OsvcThread):
                 self.kill_procs()
                 sys.exit(0)
 
+    def reconfigure(self):
+        """
+        The node config changed, recompute all the next runs.
+        """
+        self.sched_objs = {}
+        self.sched_lasts = {}
+        self.next_fires = {}
+        self.heap = []
+
     def do(self):
-        self.reload_config()
         last = 0
         done = 0
         init = True
         while True:
             if self.stopped():
                 break
+            self.reload_config()
             now = time.time()
             self.now = self.run_time(now)
             future = self.now + FUTURE
@@ -102,9 +142,12 @@ class Scheduler(shared.OsvcThread):
                 if init:
                     init = False
                     last = now
+                    self.janitor_next_fires(self.now)
                     self.run_scheduler(self.now)
-                elif now - last >= ENQUEUE_INTERVAL:
-                    last = now
+                else:
+                    if now - last >= ENQUEUE_INTERVAL:
+                        last = now
+                        self.janitor_next_fires(future)
                     self.run_scheduler(future)
                 self.dequeue_actions()
             done = self.janitor_procs()
@@ -190,17 +233,20 @@ class Scheduler(shared.OsvcThread):
         self.running -= not_dropped_yet
         self.dropped_via_notify -= sigs
 
-    def exec_action(self, sigs, cmd):
+    def exec_action(self, sigs, mgr, cmd):
         env = os.environ.copy()
         env["OSVC_ACTION_ORIGIN"] = "daemon"
         env["OSVC_SCHED_TIME"] = str(self.now)
-        kwargs = dict(stdout=self.devnull, stderr=self.devnull,
-                      stdin=self.devnull, close_fds=os.name!="nt",
-                      env=env)
-        try:
-            proc = Popen(cmd, **kwargs)
-        except KeyboardInterrupt:
-            return
+        proc = self.forkserver_command(mgr, cmd, env, devnull=True)
+        if proc is None:
+            kwargs = dict(stdout=self.devnull, stderr=self.devnull,
+                          stdin=self.devnull, close_fds=os.name!="nt",
+                          env=env)
+            _cmd = rcEnv.python_cmd + [os.path.join(rcEnv.paths.pathlib, mgr+".py")] + cmd
+            try:
+                proc = Popen(_cmd, **kwargs)
+            except KeyboardInterrupt:
+                return
         self.running |= set(sigs)
         self.push_proc(proc=proc,
                        cmd=cmd,
@@ -210,18 +256,24 @@ class Scheduler(shared.OsvcThread):
                        on_error_args=[sigs])
 
     def format_cmd(self, action, path=None, rids=None):
+        """
+        Return the mgr and the arguments of the task command.
+        """
         if path is None:
-            cmd = rcEnv.python_cmd + [os.path.join(rcEnv.paths.pathlib, "nodemgr.py"), action]
+            mgr = "nodemgr"
+            cmd = [action]
         elif isinstance(path, list):
-            cmd = rcEnv.python_cmd + [os.path.join(rcEnv.paths.pathlib, "svcmgr.py"), "-s", ",".join(path), action, "--waitlock=5"]
+            mgr = "svcmgr"
+            cmd = ["-s", ",".join(path), action, "--waitlock=5"]
             if len(path) > 1:
                 cmd.append("--parallel")
         else:
-            cmd = rcEnv.python_cmd + [os.path.join(rcEnv.paths.pathlib, "svcmgr.py"), "-s", path, action, "--waitlock=5"]
+            mgr = "svcmgr"
+            cmd = ["-s", path, action, "--waitlock=5"]
         if rids:
             cmd += ["--rid", ",".join(sorted(list(rids)))]
         cmd.append("--cron")
-        return cmd
+        return mgr, cmd
 
     def format_log_cmd(self, action, path=None, rids=None):
         if path is None:
@@ -345,10 +397,10 @@ class Scheduler(shared.OsvcThread):
         """
         dequeued = []
         for task in self.get_todo():
-            cmd = self.format_cmd(task["action"], task["path"], task["rids"])
+            mgr, cmd = self.format_cmd(task["action"], task["path"], task["rids"])
             log_cmd = self.format_log_cmd(task["action"], task["path"], task["rids"])
             self.log.info("run '%s' queued %s ago", " ".join(log_cmd), print_duration(self.now - task["queued"]))
-            self.exec_action(task["sigs"], cmd)
+            self.exec_action(task["sigs"], mgr, cmd)
             dequeued += task["sigs"]
         self.delete_queued(dequeued)
 
@@ -363,6 +415,10 @@ class Scheduler(shared.OsvcThread):
                 pass
 
     def get_lasts(self, svc):
+        """
+        Return the most recent run of each scheduled task of <svc> across
+        its peer instances. The cluster data is not modified.
+        """
         data = {}
         for nodename in svc.peers:
             instance = self.get_service_instance(svc.path, nodename)
@@ -376,7 +432,7 @@ class Scheduler(shared.OsvcThread):
                 if not sdata:
                     continue
                 if rid not in data:
-                    data[rid] = sdata
+                    data[rid] = dict(sdata)
                 else:
                     for action, adata in sdata.items():
                         if "last" not in adata:
@@ -394,50 +450,94 @@ class Scheduler(shared.OsvcThread):
     def run_time(self, now):
         return int(now // 60 * 60)
 
-    def run_scheduler(self, now):
-        #self.log.info("run scheduler")
-        nonprov = []
+    def push_next_fire(self, path, action, date):
+        key = (path, action)
+        self.next_fires[key] = date
+        heapq.heappush(self.heap, (date, next(self.seq), key))
+
+    def compute_next_fire(self, obj, path, action, now, lasts=None):
+        """
+        Push the next date the <action> task of the <obj> object is due for
+        validation, starting at <now>.
+        """
+        result = obj.sched.get_next_schedule(action, now=datetime.datetime.fromtimestamp(now), lasts=lasts)
+        if result["next_sched"] is None:
+            date = now + RECHECK_INTERVAL
+        else:
+            date = max(time.mktime(result["next_sched"].timetuple()), now)
+        self.push_next_fire(path, action, date)
+
+    def compute_next_fires(self, obj, path, now, lasts=None):
+        for key in [key for key in self.next_fires if key[0] == path]:
+            del self.next_fires[key]
+        for action in obj.sched.scheduler_actions:
+            try:
+                self.compute_next_fire(obj, path, action, now, lasts=lasts)
+            except Exception as exc:
+                self.log.error("compute %s next run on %s: %s", action, path or "node", exc)
+                self.push_next_fire(path, action, now + RECHECK_INTERVAL)
 
-        if shared.NODE:
+    def janitor_next_fires(self, now):
+        """
+        Recompute the next runs of the node and objects tasks if the object
+        configuration or the cluster last runs data changed, and drop the
+        next runs of deleted objects.
+        """
+        if shared.NODE and self.sched_objs.get(None) is not shared.NODE:
             shared.NODE.options.cron = True
-            for action in shared.NODE.sched.scheduler_actions:
-                try:
-                    delay = shared.NODE.sched.validate_action(action, now=now)
-                except ex.excAbortAction:
-                    continue
-                self.queue_action(action, delay, now=now)
+            self.sched_objs[None] = shared.NODE
+            self.compute_next_fires(shared.NODE, None, now)
         for path in list(shared.SERVICES):
             try:
                 svc = shared.SERVICES[path]
             except KeyError:
                 # deleted during previous iterations
                 continue
+            lasts = self.get_lasts(svc)
+            if self.sched_objs.get(path) is svc and self.sched_lasts.get(path) == lasts:
+                continue
             svc.configure_scheduler()
             svc.options.cron = True
-            try:
-                provisioned = shared.AGG[path].provisioned
-            except KeyError:
+            self.sched_objs[path] = svc
+            self.sched_lasts[path] = lasts
+            self.compute_next_fires(svc, path, now, lasts=lasts)
+        for path in [path for path in self.sched_objs if path is not None and path not in shared.SERVICES]:
+            del self.sched_objs[path]
+            self.sched_lasts.pop(path, None)
+            for key in [key for key in self.next_fires if key[0] == path]:
+                del self.next_fires[key]
+        if len(self.heap) > 2 * len(self.next_fires) + 100:
+            # too many outdated entries, rebuild the heap
+            self.heap = [entry for entry in self.heap if self.next_fires.get(entry[2]) == entry[0]]
+            heapq.heapify(self.heap)
+
+    def run_scheduler(self, now):
+        """
+        Validate and queue the tasks with a next run date before <now>, and
+        compute their next run date.
+        """
+        nonprov = []
+
+        while self.heap and self.heap[0][0] <= now:
+            date, _, key = heapq.heappop(self.heap)
+            if self.next_fires.get(key) != date:
+                # outdated entry
                 continue
-            lasts = self.get_lasts(svc)
-            for action, parms in svc.sched.scheduler_actions.items():
-                if provisioned in ("mixed", False) and action in ACTIONS_SKIP_ON_UNPROV:
-                    nonprov.append(action+"@"+path)
-                    continue
-                try:
-                    data = svc.sched.validate_action(action, lasts=lasts, now=now)
-                except ex.excAbortAction as exc:
-                    self.log.debug("skip %s on %s: validation", action, path)
-                    continue
+            del self.next_fires[key]
+            path, action = key
+            obj = self.sched_objs.get(path)
+            if obj is None:
+                continue
+            try:
+                self.validate_task(obj, path, action, now, nonprov)
+            finally:
+                # the task last run timestamp is not yet updated, start the
+                # search at the next scheduler run time.
                 try:
-                    rids, delay = data
-                except TypeError:
-                    delay = data
-                    rids = None
-                if rids is None:
-                    self.queue_action(action, delay, path, rids, now=now)
-                else:
-                    for rid in rids:
-                        self.queue_action(action, delay, path, rid, now=now)
+                    self.compute_next_fire(obj, path, action, now + 60, lasts=self.sched_lasts.get(path))
+                except Exception as exc:
+                    self.log.error("compute %s next run on %s: %s", action, path or "node", exc)
+                    self.push_next_fire(path, action, now + RECHECK_INTERVAL)
 
         # log a scheduler loop digest
         msg = []
@@ -446,3 +546,33 @@ class Scheduler(shared.OsvcThread):
         if len(msg) > 0:
             self.log.debug(" ".join(msg))
 
+    def validate_task(self, obj, path, action, now, nonprov):
+        if path is None:
+            try:
+                delay = obj.sched.validate_action(action, now=now)
+            except ex.excAbortAction:
+                return
+            self.queue_action(action, delay, now=now)
+            return
+        try:
+            provisioned = shared.AGG[path].provisioned
+        except KeyError:
+            return
+        if provisioned in ("mixed", False) and action in ACTIONS_SKIP_ON_UNPROV:
+            nonprov.append(action+"@"+path)
+            return
+        try:
+            data = obj.sched.validate_action(action, lasts=self.sched_lasts.get(path), now=now)
+        except ex.excAbortAction as exc:
+            self.log.debug("skip %s on %s: validation", action, path)
+            return
+        try:
+            rids, delay = data
+        except TypeError:
+            delay = data
+            rids = None
+        if rids is None:
+            self.queue_action(action, delay, path, rids, now=now)
+        else:
+            for rid in rids:
+                self.queue_action(action, delay, path, rid, now=now)
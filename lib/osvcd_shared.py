@@ -1,15 +1,15 @@
 """
 A module to share variables used by osvcd threads.
 """
+import collections
 import os
 import threading
 import time
-import fnmatch
 import hashlib
 import json
-import json_delta
 import re
 import tempfile
+import uuid
 import shutil
 from subprocess import Popen, PIPE
 
@@ -18,13 +18,16 @@ import six
 from six.moves import queue
 
 import rcExceptions as ex
-from jsonpath_ng.ext import parse
-from rcUtilities import lazy, unset_lazy, factory, split_path, normalize_paths
+import rcLogger
+from rcUtilities import lazy, unset_lazy, factory, split_path
 from rcGlobalEnv import rcEnv
 from storage import Storage
 from freezer import Freezer
 from comm import Crypt
 from osvcd_events import EVENTS
+from statustree import StatusTree
+from objselector import SelectorIndex
+from forkserver import ForkServerClient
 
 
 class DebugRLock(object):
@@ -69,10 +72,36 @@ DAEMON_STATUS_LOCK = RLock()
 DAEMON_STATUS = {}
 PATCH_ID = 0
 
+# the last daemon_status patches, to serve the instances status deltas.
+# The epoch identifies the patch ids sequence, which restarts with the
+# daemon.
+DAEMON_STATUS_PATCHES = collections.deque(maxlen=256)
+DAEMON_STATUS_EPOCH = uuid.uuid4().hex
+
+# the change-tracking tree producing the daemon_status snapshots and patch
+# events. instance status subtrees are only compared when marked changed.
+DAEMON_STATUS_TREE = StatusTree(tracked=[
+    ("monitor", "nodes", "*", "services", "status", "*"),
+])
+
+# the change-tracking tree producing the local node dataset gen diffs sent
+# to peers. instance status and config subtrees are only compared when
+# marked changed.
+NODE_DATA_TREE = StatusTree(tracked=[
+    ("services", "status", "*"),
+    ("services", "config", "*"),
+])
+
 # disable orchestration if a peer announces a different compat version than
 # ours
 COMPAT_VERSION = 10
 
+# the optional features supported by this agent, announced to the peers in
+# the node dataset and in the heartbeat ping messages. Unlike a compat
+# version change, a new feature does not disable the orchestration on
+# mixed-version clusters.
+FEATURES = ["hb_binary"]
+
 # expose api handlers version
 API_VERSION = 6
 
@@ -118,10 +147,15 @@ SERVICES_LOCK = RLock()
 AGG = {}
 AGG_LOCK = RLock()
 
+# object selector expressions evaluation engine, indexing the AGG paths
+SELECTOR_INDEX = SelectorIndex()
+
 # The encrypted message all the heartbeat tx threads send.
 # It is refreshed in the monitor thread loop.
 HB_MSG = None
 HB_MSG_LEN = 0
+HB_BIN_MSG = None
+HB_BIN_MSG_LEN = 0
 HB_MSG_LOCK = RLock()
 
 # the local service monitor data, where the listener can set expected states
@@ -184,9 +218,19 @@ JOIN_LOCK = RLock()
 # Agent as a relay heartbeart server
 RELAY_DATA = {}
 RELAY_LOCK = RLock()
+# the relay slots generation is bumped by each slot update, and notified to
+# the relay_slots long polls. The epoch identifies the generations sequence,
+# which restarts with the daemon.
+RELAY_CHANGED = threading.Condition(RELAY_LOCK)
+RELAY_GEN = 0
+RELAY_EPOCH = str(uuid.uuid4())
 RELAY_SLOT_MAX_AGE = 24 * 60 * 60
 RELAY_JANITOR_INTERVAL = 10 * 60
 
+# the actions fork server, used to execute the svcmgr and nodemgr commands
+# when node.action_executor is set to forkserver
+EXECUTOR = ForkServerClient()
+
 # try to give a name to the locks, for debugging when using
 # the pure python locks (native locks don't support setattr)
 try:
@@ -206,6 +250,21 @@ except AttributeError:
     pass
 
 
+def node_data_changed(nodename, *keys):
+    """
+    Record a change of the CLUSTER_DATA[<nodename>] subtree at <keys>, so the
+    next daemon status update compares it with its last snapshot.
+
+    The local node changes are also recorded for the next heartbeat gen
+    diff.
+
+    The caller must hold CLUSTER_DATA_LOCK.
+    """
+    DAEMON_STATUS_TREE.mark(("monitor", "nodes", nodename) + keys)
+    if nodename == rcEnv.nodename:
+        NODE_DATA_TREE.mark(keys)
+
+
 def wake_heartbeat_tx():
     """
     Notify the heartbeat tx thread to do they periodic job immediatly
@@ -241,6 +300,19 @@ def wake_scheduler():
         SCHED_TICKER.notify_all()
 
 
+def queue_event(evt):
+    """
+    Queue <evt> for the listener events dispatcher, and wake the listener
+    loop up so the subscribers receive it without delay.
+    """
+    EVENT_Q.put(evt)
+    try:
+        NODE.listener.wake()
+    except AttributeError:
+        # no listener running
+        pass
+
+
 #############################################################################
 #
 # Base Thread class
@@ -342,6 +414,9 @@ class OsvcThread(threading.Thread, Crypt):
             data["alerts"] = self.alerts
         if self.tid:
             data["tid"] = self.tid
+        logs = rcLogger.STATS.get(getattr(self, "id", self.name))
+        if logs:
+            data["logs"] = logs
         return data
 
     def thread_stats(self):
@@ -736,15 +811,41 @@ class OsvcThread(threading.Thread, Crypt):
             return
         return proc
 
+    @staticmethod
+    def use_forkserver():
+        try:
+            return NODE.oget("node", "action_executor") == "forkserver"
+        except Exception:
+            return False
+
+    def forkserver_command(self, mgr, cmd, env, devnull=False):
+        """
+        Execute the <mgr> command in a fork server child.
+        Return None if the fork server is not enabled or failed, in which
+        case the caller is expected to fallback to Popen.
+        """
+        if not self.use_forkserver():
+            return
+        if EXECUTOR.log is None:
+            EXECUTOR.log = self.log
+        try:
+            return EXECUTOR.spawn(mgr, cmd, env=env, devnull=devnull)
+        except Exception as exc:
+            self.log.warning("fork server failed to execute %s %s: %s. "
+                             "fallback to a new process.", mgr, " ".join(cmd), exc)
+
     def node_command(self, cmd):
         """
         A generic nodemgr command Popen wrapper.
         """
         env = os.environ.copy()
         env["OSVC_ACTION_ORIGIN"] = "daemon"
+        self.log.info("execute: nodemgr %s", " ".join(cmd))
+        proc = self.forkserver_command("nodemgr", cmd, env)
+        if proc:
+            return proc
         _cmd = [] + rcEnv.python_cmd
         _cmd += [os.path.join(rcEnv.paths.pathlib, "nodemgr.py")]
-        self.log.info("execute: nodemgr %s", " ".join(cmd))
         proc = Popen(_cmd+cmd, stdout=None, stderr=None, stdin=None,
                      close_fds=True, env=env)
         return proc
@@ -762,6 +863,10 @@ class OsvcThread(threading.Thread, Crypt):
         if local:
             cmd += ["--local"]
         self.log.info("execute: svcmgr %s", " ".join(cmd))
+        if stdin is None and stdout is None and stderr is None:
+            proc = self.forkserver_command("svcmgr", cmd, env)
+            if proc:
+                return proc
         if stdin is not None:
             _stdin = PIPE
         else:
@@ -1335,6 +1440,7 @@ class OsvcThread(threading.Thread, Crypt):
                 try:
                     # trigger status.json reload by the mon thread
                     CLUSTER_DATA[rcEnv.nodename]["services"]["status"][path]["updated"] = 0
+                    node_data_changed(rcEnv.nodename, "services", "status", path)
                 except KeyError:
                     pass
         wake_monitor(reason="nodes info change")
@@ -1403,7 +1509,7 @@ class OsvcThread(threading.Thread, Crypt):
                 pass
 
         evt["data"] = data
-        EVENT_Q.put(evt)
+        queue_event(evt)
         hooks = NODE.hooks.get(eid, set()) | NODE.hooks.get("all", set())
         for hook in hooks:
             proc = self.hook_command(hook, evt)
@@ -1532,7 +1638,7 @@ class OsvcThread(threading.Thread, Crypt):
         """
         return NODE
 
-    def _daemon_status(self):
+    def _daemon_status(self, **kwargs):
         """
         Return a hash indexed by thead id, containing the status data
         structure of each thread.
@@ -1547,256 +1653,161 @@ class OsvcThread(threading.Thread, Crypt):
         }
         for thr_id in list(THREADS):
             try:
-                data[thr_id] = THREADS[thr_id].status()
+                data[thr_id] = THREADS[thr_id].status(**kwargs)
             except KeyError:
                 continue
         return data
 
     def update_daemon_status(self):
+        """
+        Refresh the daemon status snapshot and queue a patch event
+        describing the changes since the last snapshot.
+
+        The live thread data is walked without copy, so only the changed
+        subtrees are copied into the new snapshot. The threads status is
+        built before taking CLUSTER_DATA_LOCK, which is only held during
+        the walk of the embedded live cluster data.
+        """
         global LAST_DAEMON_STATUS
         global DAEMON_STATUS
-        global EVENT_Q
         global PATCH_ID
-        LAST_DAEMON_STATUS = json.loads(json.dumps(DAEMON_STATUS))
-        DAEMON_STATUS = self._daemon_status()
-        diff = json_delta.diff(
-            LAST_DAEMON_STATUS, DAEMON_STATUS,
-            verbose=False, array_align=False, compare_lengths=False
-        )
-        if not diff:
-            return
-        PATCH_ID += 1
-        EVENT_Q.put({
-            "kind": "patch",
-            "id": PATCH_ID,
-            "ts": time.time(),
-            "data": diff,
-        })
+        with DAEMON_STATUS_LOCK:
+            data = self._daemon_status(live=True)
+            with CLUSTER_DATA_LOCK:
+                diff = DAEMON_STATUS_TREE.update(data)
+            DAEMON_STATUS = DAEMON_STATUS_TREE.data
+            LAST_DAEMON_STATUS = DAEMON_STATUS
+            if not diff:
+                return
+            PATCH_ID += 1
+            DAEMON_STATUS_PATCHES.append((PATCH_ID, diff))
+            queue_event({
+                "kind": "patch",
+                "id": PATCH_ID,
+                "ts": time.time(),
+                "data": diff,
+            })
 
     def daemon_status(self):
-        return json.loads(json.dumps(LAST_DAEMON_STATUS))
+        """
+        Return the last daemon status snapshot.
+
+        The snapshot is shared with the other readers and must not be
+        modified. Use filter_daemon_status() to get a filtered copy.
+        """
+        return LAST_DAEMON_STATUS
 
     def filter_daemon_status(self, data, namespace=None, namespaces=None, selector=None):
+        """
+        Return a copy of <data> limited to the objects matching <selector>.
+        <data> is not modified, and the unfiltered subtrees are shared with
+        the returned data.
+        """
         if selector is None:
             selector = "**"
-        keep = self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces)
-        for node in [n for n in data.get("monitor", {}).get("nodes", {})]:
-            for path in [p for p in data["monitor"]["nodes"][node].get("services", {}).get("status", {})]:
-                if path not in keep:
-                    del data["monitor"]["nodes"][node]["services"]["status"][path]
-            for path in [p for p in data["monitor"]["nodes"][node].get("services", {}).get("config", {})]:
-                if path not in keep:
-                    del data["monitor"]["nodes"][node]["services"]["config"][path]
-        for path in [p for p in data.get("monitor", {}).get("services", {})]:
-            if path not in keep:
-                del data["monitor"]["services"][path]
+        keep = set(self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces))
+
+        def filter_paths(paths_data):
+            return dict((path, val) for path, val in paths_data.items() if path in keep)
+
+        if "monitor" not in data:
+            return data
+        data = dict(data)
+        monitor = data["monitor"] = dict(data["monitor"])
+        if "nodes" in monitor:
+            nodes = monitor["nodes"] = dict(monitor["nodes"])
+            for node, ndata in list(nodes.items()):
+                try:
+                    services = dict(ndata["services"])
+                except (KeyError, TypeError):
+                    continue
+                for key in ("status", "config"):
+                    if key in services:
+                        services[key] = filter_paths(services[key])
+                nodes[node] = dict(ndata)
+                nodes[node]["services"] = services
+        if "services" in monitor:
+            monitor["services"] = filter_paths(monitor["services"])
         return data
 
+    def instances_status(self, etag=None, namespace=None, namespaces=None, selector=None):
+        """
+        Return the instances status of the objects matching <selector>,
+        indexed by path and node, with an etag identifying the daemon run,
+        the daemon status generation and the selected objects.
+
+        If <etag> is a previous response etag, and the patches since are
+        still known, return only the json_delta patch to apply to the
+        previous response data.
+        """
+        with DAEMON_STATUS_LOCK:
+            data = LAST_DAEMON_STATUS
+            gen = PATCH_ID
+            patches = list(DAEMON_STATUS_PATCHES)
+        if selector is None:
+            selector = "**"
+        keep = sorted(self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces))
+        digest = hashlib.md5(json.dumps(keep).encode()).hexdigest()[:16]
+        new_etag = "%s-%d-%s" % (DAEMON_STATUS_EPOCH, gen, digest)
+        patch = self.instances_status_patch(etag, gen, digest, patches, set(keep))
+        if patch is not None:
+            return {"etag": new_etag, "full": False, "patch": patch}
+        instances = dict((path, {}) for path in keep)
+        nodes = data.get("monitor", {}).get("nodes", {})
+        for node, ndata in nodes.items():
+            try:
+                status = ndata["services"]["status"]
+            except (KeyError, TypeError):
+                continue
+            for path in keep:
+                if path in status:
+                    instances[path][node] = status[path]
+        return {"etag": new_etag, "full": True, "data": instances}
+
+    @staticmethod
+    def instances_status_patch(etag, gen, digest, patches, keep):
+        """
+        Return the instances status patch since <etag>, or None if the full
+        dataset must be sent.
+        """
+        try:
+            epoch, last_gen, last_digest = etag.split("-", 2)
+            last_gen = int(last_gen)
+        except (AttributeError, ValueError):
+            return
+        if epoch != DAEMON_STATUS_EPOCH:
+            # the patch ids are from another daemon run
+            return
+        if last_digest != digest or last_gen > gen:
+            return
+        patches = [diff for patch_id, diff in patches if patch_id > last_gen]
+        if len(patches) != gen - last_gen:
+            # some patches are no longer known
+            return
+        prefix = ["monitor", "nodes", None, "services", "status"]
+        patch = []
+        for diff in patches:
+            for change in diff:
+                key = list(change[0])
+                if any(_prefix is not None and _key != _prefix for _key, _prefix in zip(key, prefix)):
+                    continue
+                if len(key) < 6:
+                    # a parent of the instances status changed
+                    return
+                node, path = key[2], key[5]
+                if path not in keep:
+                    continue
+                patch.append([[path, node] + key[6:]] + change[1:])
+        return patch
+
     def match_object_selector(self, selector=None, namespace=None, namespaces=None, path=None):
         if selector is None:
             selector = "**"
         return path in self.object_selector(selector=selector, namespace=namespace, namespaces=namespaces, paths=[path])
 
     def object_selector(self, selector=None, namespace=None, namespaces=None, paths=None):
-        if not selector:
-            return []
-        if namespace:
-            if namespaces is not None and namespace not in namespaces:
-                return []
-            # noinspection PySetFunctionToLiteral
-            namespaces = set([namespace])
-        if "root" in namespaces:
-            namespaces.add(None)
-
-        if paths is None:
-            # all objects
-            paths = [p for p in AGG if split_path(p)[1] in namespaces]
-        if selector == "**":
-            return paths
-
-        # all services
-        if selector == "*":
-            return [p for p in paths if split_path(p)[2] == "svc"]
-
-        def or_fragment_selector(s):
-            expanded = []
-            for _selector in s.split(","):
-                for p in and_fragment_selector(_selector):
-                    if p in expanded:
-                        continue
-                    expanded.append(p)
-            return expanded
-
-        def and_fragment_selector(s):
-            expanded = None
-            for _selector in s.split("+"):
-                _expanded = fragment_selector(_selector)
-                if expanded is None:
-                    expanded = _expanded
-                else:
-                    expanded = [p for p in expanded if p in _expanded]
-            return expanded
-
-        def fragment_selector(s):
-            # empty
-            if not s:
-                return []
-
-            # explicit object path
-            if s in AGG:
-                if s not in paths:
-                    return []
-                return [s]
-
-            # fnmatch expression
-            ops = r"(<=|>=|<|>|=|~|:)"
-            negate = s[0] == "!"
-            s = s.lstrip("!")
-            elts = re.split(ops, s)
-            if len(elts) == 1:
-                norm_paths = normalize_paths(paths)
-                norm_elts = s.split("/")
-                norm_elts_count = len(norm_elts)
-                if norm_elts_count == 3:
-                    _namespace, _kind, _name = norm_elts
-                    if not _name:
-                        # test/svc/
-                        _name = "*"
-                elif norm_elts_count == 2:
-                    if not norm_elts[1]:
-                        # svc/
-                        _name = "*"
-                        _kind = norm_elts[0]
-                        _namespace = "*"
-                    elif norm_elts[1] == "**":
-                        # prod/**
-                        _name = "*"
-                        _kind = "*"
-                        _namespace = norm_elts[0]
-                    elif norm_elts[0] == "**":
-                        # **/s*
-                        _name = norm_elts[1]
-                        _kind = "*"
-                        _namespace = "*"
-                    else:
-                        # svc/s*
-                        _name = norm_elts[1]
-                        _kind = norm_elts[0]
-                        _namespace = "*"
-                elif norm_elts_count == 1:
-                    if norm_elts[0] == "**":
-                        _name = "*"
-                        _kind = "*"
-                        _namespace = "*"
-                    else:
-                        _name = norm_elts[0]
-                        _kind = "svc"
-                        _namespace = namespace if namespace else "root"
-                else:
-                    return []
-                _selector = "/".join((_namespace, _kind, _name))
-                filtered_paths = [path for path in norm_paths if negate ^ fnmatch.fnmatch(path, _selector)]
-                return [re.sub("^(root/svc/|root/)", "", path) for path in filtered_paths]
-            elif len(elts) != 3:
-                return []
-
-            param, op, value = elts
-            if op in ("<", ">", ">=", "<="):
-                try:
-                    value = float(value)
-                except (TypeError, ValueError):
-                    return []
-
-            expanded = []
-
-            if param.startswith("."):
-                param = "$"+param
-            if param.startswith("$."):
-                jsonpath_expr = parse(param)
-            else:
-                jsonpath_expr = None
-
-            for path in paths:
-                ret = svc_matching(path, param, op, value, jsonpath_expr)
-                if ret ^ negate:
-                    expanded.append(path)
-
-            return expanded
-
-        def matching(current, op, value):
-            if op in ("<", ">", ">=", "<="):
-                try:
-                    current = float(current)
-                except (ValueError, TypeError):
-                    return False
-            if op == "=":
-                if current.lower() in ("true", "false"):
-                    match = current.lower() == value.lower()
-                else:
-                    match = current == value
-            elif op == "~":
-                match = re.search(value, current)
-            elif op == ">":
-                match = current > value
-            elif op == ">=":
-                match = current >= value
-            elif op == "<":
-                match = current < value
-            elif op == "<=":
-                match = current <= value
-            elif op == ":":
-                match = True
-            else:
-                # unknown op value
-                match = False
-            return match
-
-        def svc_matching(path, param, op, value, jsonpath_expr):
-            if param.startswith("$."):
-                try:
-                    data = self.object_data(path)
-                    matches = jsonpath_expr.find(data)
-                    for match in matches:
-                        current = match.value
-                        if matching(current, op, value):
-                            return True
-                except Exception:
-                    pass
-            else:
-                try:
-                    svc = SERVICES[path]
-                except KeyError:
-                    return False
-                try:
-                    current = svc._get(param, evaluate=True)
-                except (ex.excError, ex.OptNotFound, ex.RequiredOptNotFound):
-                    current = None
-                if current is None:
-                    if "." in param:
-                        group, _param = param.split(".", 1)
-                    else:
-                        group = param
-                        _param = None
-                    rids = [section for section in svc.conf_sections() if group == "" or section.split('#')[0] == group]
-                    if op == ":" and len(rids) > 0 and _param is None:
-                        return True
-                    elif _param:
-                        for rid in rids:
-                            try:
-                                _current = svc._get(rid+"."+_param, evaluate=True)
-                            except (ex.excError, ex.OptNotFound, ex.RequiredOptNotFound):
-                                continue
-                            if matching(_current, op, value):
-                                return True
-                    return False
-                if current is None:
-                    return op == ":"
-                if matching(current, op, value):
-                    return True
-            return False
-
-        expanded = or_fragment_selector(selector)
-        return expanded
+        return SELECTOR_INDEX.select(AGG, SERVICES, self.object_data, selector=selector,
+                                     namespace=namespace, namespaces=namespaces, paths=paths)
 
     def object_data(self, path):
         """
@@ -0,0 +1,98 @@
+"""
+The daemon peer connections pool.
+
+The listener relays the multiplexed requests to the cluster peers. Opening
+a new connection for each relayed request costs a tls handshake and an
+authentication per peer, so the h2 connections to the peers are kept open
+and reused by the next relayed requests.
+"""
+import threading
+import time
+
+IDLE_TIMEOUT = 60
+MAX_IDLE = 4
+
+
+class PeerPool(object):
+    """
+    A pool of connections to the cluster peers, opened by <factory> called
+    with the peer nodename.
+
+    A connection serves a single request at a time: acquire() it, then
+    release() it when the response is read, or discard() it on error.
+    """
+    def __init__(self, factory, max_idle=MAX_IDLE, idle_timeout=IDLE_TIMEOUT):
+        self.factory = factory
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, nodename):
+        """
+        Return a (conn, reused) tuple, <reused> being True if the connection
+        was taken from the idle connections.
+        """
+        now = time.time()
+        conn = None
+        expired = []
+        with self.lock:
+            conns = self.idle.get(nodename, [])
+            while conns:
+                _conn, released = conns.pop()
+                if now - released < self.idle_timeout:
+                    conn = _conn
+                    break
+                expired.append(_conn)
+        for _conn in expired:
+            self.discard(_conn)
+        if conn is not None:
+            return conn, True
+        return self.factory(nodename), False
+
+    def release(self, nodename, conn):
+        """
+        Return the connection to the idle connections, or close it if the
+        peer already has enough idle connections.
+        """
+        with self.lock:
+            conns = self.idle.setdefault(nodename, [])
+            if len(conns) < self.max_idle:
+                conns.append((conn, time.time()))
+                return
+        self.discard(conn)
+
+    @staticmethod
+    def discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def janitor(self):
+        """
+        Close the connections idle for longer than the idle timeout.
+        """
+        now = time.time()
+        expired = []
+        with self.lock:
+            for nodename, conns in list(self.idle.items()):
+                expired += [conn for conn, released in conns if now - released >= self.idle_timeout]
+                conns = [(conn, released) for conn, released in conns if now - released < self.idle_timeout]
+                if conns:
+                    self.idle[nodename] = conns
+                else:
+                    del self.idle[nodename]
+        for conn in expired:
+            self.discard(conn)
+
+    def close(self):
+        with self.lock:
+            conns = [conn for _conns in self.idle.values() for conn, _ in _conns]
+            self.idle = {}
+        for conn in conns:
+            self.discard(conn)
+
+    def count(self):
+        with self.lock:
+            return dict((nodename, len(conns)) for nodename, conns in self.idle.items())
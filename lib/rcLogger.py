@@ -4,7 +4,10 @@ import gzip
 import errno
 import logging
 import logging.handlers
+import threading
+import time
 import six
+from six.moves import queue
 from rcGlobalEnv import rcEnv
 from rcUtilities import makedirs
 from subprocess import *
@@ -26,6 +29,11 @@ from rcColor import colorize, color
 
 DEFAULT_HANDLERS = ["file", "stream", "syslog"]
 
+# the queued handlers settings
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+STATS_WINDOW = 10
+
 def namer(name):
     """
     Adds a .gz suffix to the rotated file.
@@ -124,6 +132,202 @@ class OsvcFileHandler(logging.handlers.RotatingFileHandler):
         makedirs(logdir)
         logging.handlers.RotatingFileHandler.__init__(self, logfile, maxBytes=1*5242880, backupCount=1)
 
+    def emit_batch(self, records):
+        """
+        Write the records, rotating the file as needed, and flush the
+        stream once for the whole batch.
+        """
+        self.acquire()
+        try:
+            for record in records:
+                if record.levelno < self.level or not self.filter(record):
+                    continue
+                try:
+                    if self.shouldRollover(record):
+                        self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                    self.stream.write(self.format(record) + "\n")
+                except Exception:
+                    self.handleError(record)
+            try:
+                if self.stream:
+                    self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+        finally:
+            self.release()
+
+class LogStats(object):
+    """
+    The per-component count of records logged and dropped, and log rate
+    over the last complete STATS_WINDOW seconds.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    @staticmethod
+    def component(record):
+        component = getattr(record, "component", None) or record.name
+        # drop the client address of the listener client handlers
+        return component.split("/")[0]
+
+    def add(self, record, dropped=False):
+        component = self.component(record)
+        now = time.time()
+        with self.lock:
+            try:
+                data = self.data[component]
+            except KeyError:
+                data = self.data[component] = {
+                    "records": 0,
+                    "dropped": 0,
+                    "rate": 0.0,
+                    "window": now,
+                    "window_records": 0,
+                }
+            self.roll(data, now)
+            data["records"] += 1
+            data["window_records"] += 1
+            if dropped:
+                data["dropped"] += 1
+
+    @staticmethod
+    def roll(data, now):
+        elapsed = now - data["window"]
+        if elapsed < STATS_WINDOW:
+            return
+        if elapsed < 2 * STATS_WINDOW:
+            data["rate"] = data["window_records"] / float(STATS_WINDOW)
+        else:
+            # idle during the last complete window
+            data["rate"] = 0.0
+        data["window"] = now - elapsed % STATS_WINDOW
+        data["window_records"] = 0
+
+    def get(self, component=None):
+        """
+        Return the stats of <component>, or of all components if not set.
+        """
+        now = time.time()
+        with self.lock:
+            for data in self.data.values():
+                self.roll(data, now)
+            stats = dict((_component, {
+                "records": data["records"],
+                "dropped": data["dropped"],
+                "rate": data["rate"],
+            }) for _component, data in self.data.items())
+        if component is None:
+            return stats
+        return stats.get(component)
+
+STATS = LogStats()
+
+class QueueHandler(logging.Handler):
+    """
+    Enqueue the records for a writer thread emitting them through the
+    <handlers>, so the logging threads never wait for a file write, a
+    rotation or a syslog send.
+
+    The enqueue does not block: the records are dropped and counted when
+    the queue is full.
+    """
+    def __init__(self, handlers, maxsize=QUEUE_SIZE, stats=None):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.stats = STATS if stats is None else stats
+        self.setLevel(min([handler.level for handler in handlers]))
+        self.queue = None
+        self.writer = None
+        self.pid = None
+
+    def start(self):
+        """
+        Start the writer thread. Also called by the first emit of a forked
+        process, which does not inherit the parent writer thread.
+        """
+        self.pid = os.getpid()
+        self.queue = queue.Queue(self.maxsize)
+        self.writer = threading.Thread(target=self.write, name="log writer")
+        self.writer.daemon = True
+        self.writer.start()
+
+    @staticmethod
+    def prepare(record):
+        """
+        Merge the message args and the exception traceback in the record
+        message, so the record does not reference objects the emitting
+        thread may change before the writer formats it.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.acquire()
+            try:
+                if self.pid != os.getpid():
+                    self.start()
+            finally:
+                self.release()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+            self.stats.add(record)
+        except queue.Full:
+            self.stats.add(record, dropped=True)
+        except Exception:
+            self.handleError(record)
+
+    def write(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [record for record in batch if record is not None]
+            if batch:
+                self.write_batch(batch)
+            if stop:
+                return
+
+    def write_batch(self, batch):
+        for handler in self.handlers:
+            try:
+                if hasattr(handler, "emit_batch"):
+                    handler.emit_batch(batch)
+                    continue
+                for record in batch:
+                    handler.handle(record)
+            except Exception:
+                # keep the writer alive for the next records
+                self.handleError(batch[-1])
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        """
+        Write the queued records, and close the handlers.
+        """
+        if self.writer and self.pid == os.getpid() and self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+
 class LoggerHandler(logging.handlers.SysLogHandler):
     def __init__(self, facility=logging.handlers.SysLogHandler.LOG_USER):
         logging.Handler.__init__(self)
@@ -157,7 +361,14 @@ class LoggerHandler(logging.handlers.SysLogHandler):
         finally:
             syslog.closelog()
 
-def initLogger(root, logfile, handlers=None, sid=True):
+def initLogger(root, logfile, handlers=None, sid=True, queued=False):
+    """
+    Setup the <root> logger <handlers>.
+
+    If <queued> is set, the file and syslog handlers are fed through a
+    QueueHandler, so the long-running processes, like the daemon, never
+    block on a log write.
+    """
     if handlers is None:
         handlers = DEFAULT_HANDLERS
     log = logging.getLogger(root)
@@ -166,6 +377,7 @@ def initLogger(root, logfile, handlers=None, sid=True):
         return log
     log.propagate = False
     log.handlers = []
+    queued_handlers = []
 
     if "file" in handlers:
         try:
@@ -175,7 +387,7 @@ def initLogger(root, logfile, handlers=None, sid=True):
             filehandler.setFormatter(fileformatter)
             filehandler.rotator = rotator
             filehandler.namer = namer
-            log.addHandler(filehandler)
+            queued_handlers.append(filehandler)
 
             if '--debug' in sys.argv:
                 filehandler.setLevel(logging.DEBUG)
@@ -249,7 +461,13 @@ def initLogger(root, logfile, handlers=None, sid=True):
         if sysloghandler:
             sysloghandler.setLevel(lvl)
             sysloghandler.setFormatter(syslogformatter)
-            log.addHandler(sysloghandler)
+            queued_handlers.append(sysloghandler)
+
+    if queued and queued_handlers:
+        log.addHandler(QueueHandler(queued_handlers))
+    else:
+        for handler in queued_handlers:
+            log.addHandler(handler)
 
     log.setLevel(logging.DEBUG)
 
@@ -1,14 +1,46 @@
+import glob
 import os
 import re
 import json
 
 from rcGlobalEnv import *
 from rcUtilities import justcall, which, cache
+import hoststate
 import rcStatus
 import rcExceptions as ex
 
-@cache("losetup.json")
 def losetup_data():
+    return hoststate.get("loops", load_losetup_data)
+
+def load_losetup_data():
+    try:
+        return sysfs_losetup_data()
+    except (IOError, OSError):
+        return losetup_json_data()
+
+def sysfs_losetup_data(pattern="/sys/block/loop*/loop/backing_file"):
+    """
+    Return the bound loop devices and backing files in the losetup -J
+    format, without forking losetup.
+    """
+    if not os.path.exists("/sys/block"):
+        raise OSError("sysfs not mounted")
+    data = []
+    for fpath in glob.glob(pattern):
+        try:
+            with open(fpath, "r") as filep:
+                backfile = filep.read().rstrip("\n")
+        except (IOError, OSError):
+            # unbound meanwhile
+            continue
+        if backfile.endswith(" (deleted)"):
+            backfile = backfile[:-10]
+        name = "/dev/" + fpath.split(os.sep)[-3]
+        data.append({"name": name, "back-file": backfile})
+    return data
+
+@cache("losetup.json")
+def losetup_json_data():
     cmd = ["losetup", "-J"]
     out, err, ret = justcall(cmd)
     try:
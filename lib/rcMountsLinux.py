@@ -1,6 +1,8 @@
 import os
+import re
 
 from rcGlobalEnv import rcEnv
+import hoststate
 import rcMounts
 from rcLoopLinux import file_to_loop
 from rcUtilities import justcall
@@ -28,6 +30,44 @@ class Mounts(rcMounts.Mounts):
         return False
 
     def parse_mounts(self):
+        return list(hoststate.get("mounts", self.load_mounts))
+
+    def load_mounts(self):
+        try:
+            return self.parse_mountinfo()
+        except (IOError, OSError, ValueError):
+            return self.parse_mount_cmd()
+
+    @staticmethod
+    def parse_mountinfo(fpath="/proc/self/mountinfo"):
+        """
+        Parse the mounts table from the kernel, without forking mount.
+
+        <id> <parent> <maj:min> <root> <mnt> <mnt opts> [<tags>...] - <type> <dev> <super opts>
+        """
+        def unescape(s):
+            return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), s)
+
+        with open(fpath, "r") as filep:
+            buff = filep.read()
+        mounts = []
+        for line in buff.splitlines():
+            head, sep, tail = line.partition(" - ")
+            head = head.split()
+            tail = tail.split()
+            if not sep or len(head) < 6 or len(tail) < 3:
+                raise ValueError("unexpected mountinfo line: %s" % line)
+            mnt = unescape(head[4])
+            dev = unescape(tail[1])
+            if mnt.endswith(" (deleted)"):
+                mnt = mnt[:-10]
+            opts = head[5].split(",")
+            opts += [opt for opt in tail[2].split(",") if opt not in opts]
+            mounts.append(rcMounts.Mount(dev, mnt, tail[0], ",".join(opts)))
+        return mounts
+
+    @staticmethod
+    def parse_mount_cmd():
         out, err, ret = justcall([rcEnv.syspaths.mount])
         out = out.replace(" (deleted)", "")
         mounts = []
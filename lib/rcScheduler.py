@@ -58,6 +58,40 @@ CALENDAR_NAMES = {
     "sunday": 6,
 }
 
+DAY = datetime.timedelta(days=1)
+
+def _spans_union(spans1, spans2):
+    """
+    Return the union of two sorted lists of (begin, end) spans.
+    """
+    merged = []
+    for begin, end in sorted(spans1 + spans2):
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+def _spans_subtract(spans1, spans2):
+    """
+    Return the parts of the <spans1> sorted spans not in the <spans2> sorted
+    spans.
+    """
+    result = []
+    for begin, end in spans1:
+        for _begin, _end in spans2:
+            if _end <= begin or _begin >= end:
+                continue
+            if _begin > begin:
+                result.append((begin, _begin))
+            begin = _end
+            if begin >= end:
+                break
+        if begin < end:
+            result.append((begin, end))
+    return result
+
 class SchedNotAllowed(Exception):
     """
     The exception signaling the task can not run due to scheduling
@@ -154,25 +188,156 @@ class Scheduler(object):
             if node is None:
                 self.node = node
 
-    def get_next_schedule(self, action, _max=14400):
-        """
-        Iterate future dates in search for the next date validating
-        <action> scheduling constraints.
-        """
-        now = datetime.datetime.now()
-        cron = self.options.cron
-        self.options.cron = True
-        for idx in range(_max):
-            future_dt = now + datetime.timedelta(minutes=idx*10)
-            data = self.skip_action(action, now=future_dt)
-            if isinstance(data, dict):
-                if len(data["keep"]) > 0:
-                    return {"next_sched": future_dt, "minutes": _max}
-            elif not data:
-                self.options.cron = cron
-                return {"next_sched": future_dt, "minutes": _max}
-        self.options.cron = cron
-        return {"next_sched": None, "minutes": None}
+    def get_next_schedule(self, action, _max=14400, now=None, lasts=None):
+        """
+        Return the next date validating <action> scheduling constraints,
+        in the next <_max> 10 minutes periods.
+
+        For multi-resources actions, return the next date validating the
+        constraints of any of the resources.
+
+        <lasts> is the cluster-wide last runs data, as passed to
+        validate_action().
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        horizon = now + datetime.timedelta(minutes=_max*10)
+        sched_options = self.scheduler_actions.get(action)
+        if sched_options is None:
+            return {"next_sched": None, "minutes": None}
+        if not isinstance(sched_options, list):
+            sched_options = [sched_options]
+        next_sched = None
+        for sopt in sched_options:
+            _next_sched = self._get_next_schedule(action, sopt, now, horizon, lasts=lasts)
+            if _next_sched is None:
+                continue
+            if next_sched is None or _next_sched < next_sched:
+                next_sched = _next_sched
+        if next_sched is None:
+            return {"next_sched": None, "minutes": None}
+        return {"next_sched": next_sched, "minutes": _max}
+
+    def _get_next_schedule(self, action, sopt, now, horizon, lasts=None):
+        """
+        Return the next date validating the <sopt> task scheduling
+        constraints, or None if there is none before <horizon>.
+        """
+        if sopt.req_collector and not self.node.collector_env.dbopensvc:
+            return
+        if sopt.schedule_option is None:
+            return now
+        last = self.get_last(sopt.fname)
+        if lasts:
+            try:
+                cluster_last = lasts[sopt.section][action]["last"]
+            except (KeyError, ValueError, TypeError):
+                cluster_last = 0
+            if cluster_last:
+                cluster_last = datetime.datetime.fromtimestamp(cluster_last)
+                if not last or cluster_last > last:
+                    last = cluster_last
+        try:
+            schedules = self.sched_get_schedule(sopt.section, sopt.schedule_option)
+            return self.next_in_schedule(schedules, now=now, last=last, horizon=horizon)
+        except Exception:
+            return
+
+    def next_in_schedule(self, schedules, now=None, last=None, horizon=None):
+        """
+        Return the first date after <now> passing the constraints of the
+        <schedules> structures, or None if there is none before <horizon>.
+
+        The allowed spans of each day are computed from the timeranges,
+        the schedules being evaluated in order like in_schedule() does: the
+        first schedule allowing a date decides, so exclusions only apply
+        to the spans not allowed by the previous schedules.
+
+        The probabilistic delays are ignored: the returned date is the
+        beginning of the allowed span.
+        """
+        if len(schedules) == 0:
+            return
+        if now is None:
+            now = datetime.datetime.now()
+        if horizon is None:
+            horizon = now + datetime.timedelta(days=100)
+        compiled = [(schedule, self._sched_compile_timeranges(schedule, last=last))
+                    for schedule in schedules]
+        day = datetime.datetime(now.year, now.month, now.day)
+        while day < horizon:
+            allowed = []
+            decided = []
+            for schedule, timeranges in compiled:
+                try:
+                    spans = self._sched_day_spans(schedule, timeranges, day)
+                    exclude = schedule["exclude"]
+                except SchedSyntaxError:
+                    # in_schedule() fails on this day whatever the time
+                    spans = [(datetime.timedelta(0), DAY)]
+                    exclude = True
+                if not spans:
+                    continue
+                if not exclude:
+                    allowed = _spans_union(allowed, _spans_subtract(spans, decided))
+                decided = _spans_union(decided, spans)
+            for begin, end in allowed:
+                begin = max(day + begin, now)
+                if begin >= horizon:
+                    return
+                if begin < day + end:
+                    return begin
+            day += DAY
+
+    def _sched_compile_timeranges(self, schedule, last=None):
+        """
+        Return the list of (begin, end, limit) tuples of the <schedule>
+        timeranges. <begin> and <end> are the allowed time of day spans,
+        <limit> the date before which the timerange interval since the
+        <last> run is not expired.
+        """
+        timeranges = []
+        for timerange in schedule["timeranges"]:
+            if timerange["interval"] == 0:
+                continue
+            try:
+                begin = self._time_to_minutes(timerange["begin"])
+                end = self._time_to_minutes(timerange["end"])
+            except Exception:
+                continue
+            if last is None:
+                limit = None
+            else:
+                limit = last + datetime.timedelta(seconds=timerange["interval"] * 60)
+            if begin <= end:
+                spans = [(begin, end + 1)]
+            else:
+                spans = [(0, end + 1), (begin, 1440)]
+            for _begin, _end in spans:
+                timeranges.append((
+                    datetime.timedelta(minutes=_begin),
+                    datetime.timedelta(minutes=_end),
+                    limit,
+                ))
+        return timeranges
+
+    def _sched_day_spans(self, schedule, timeranges, day):
+        """
+        Return the sorted list of (begin, end) spans of <day> where the
+        <schedule> constraints pass.
+        """
+        try:
+            self._in_days(schedule, now=day)
+        except SchedNotAllowed:
+            return []
+        spans = []
+        for begin, end, limit in timeranges:
+            if limit is not None:
+                begin = max(begin, limit - day)
+                if begin >= end:
+                    continue
+            spans.append((begin, end))
+        return _spans_union(spans, [])
 
     @staticmethod
     def _need_action_interval(last, delay=10, now=None):
@@ -1008,15 +1173,19 @@ class Scheduler(object):
         containing schedule information.
         """
         data = []
+        if self.options.verbose:
+            next_sched = self.get_next_schedule(action)["next_sched"]
+        else:
+            next_sched = None
         if isinstance(self.scheduler_actions[action], list):
             for sopt in self.scheduler_actions[action]:
-                data += [self.___print_schedule_data(action, sopt)]
+                data += [self.___print_schedule_data(action, sopt, next_sched)]
         else:
             sopt = self.scheduler_actions[action]
-            data += [self.___print_schedule_data(action, sopt)]
+            data += [self.___print_schedule_data(action, sopt, next_sched)]
         return data
 
-    def ___print_schedule_data(self, action, sopt):
+    def ___print_schedule_data(self, action, sopt, next_sched=None):
         """
         Return a dict of a scheduled task information.
         """
@@ -1047,9 +1216,8 @@ class Scheduler(object):
             param = schedule_option
         param = '.'.join((section, param))
         if self.options.verbose:
-            result = self.get_next_schedule(action)
-            if result["next_sched"]:
-                next_s = result["next_sched"].strftime("%Y-%m-%d %H:%M")
+            if next_sched:
+                next_s = next_sched.strftime("%Y-%m-%d %H:%M")
             else:
                 next_s = "-"
             return dict(
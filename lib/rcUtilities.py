@@ -66,6 +66,10 @@ operators = {
 }
 
 
+# expression => parsed expression tree
+EXPR_CACHE = {}
+EXPR_CACHE_SIZE = 1024
+
 def eval_expr(expr):
     """ arithmetic expressions evaluator
     """
@@ -118,7 +122,14 @@ def eval_expr(expr):
         else:
             raise TypeError("unsupported node type %s" % type(node))
 
-    return eval_(ast.parse(expr, mode='eval').body)
+    try:
+        body = EXPR_CACHE[expr]
+    except KeyError:
+        body = ast.parse(expr, mode='eval').body
+        if len(EXPR_CACHE) >= EXPR_CACHE_SIZE:
+            EXPR_CACHE.clear()
+        EXPR_CACHE[expr] = body
+    return eval_(body)
 
 
 PROTECTED_DIRS = [
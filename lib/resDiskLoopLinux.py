@@ -3,6 +3,7 @@ import re
 import time
 
 from rcGlobalEnv import *
+import hoststate
 from rcUtilities import call, which, clear_cache
 import rcStatus
 import resDiskLoop as Res
@@ -29,6 +30,7 @@ class Disk(Res.Disk):
                 cmd = [rcEnv.syspaths.losetup, '-f', self.loopFile]
                 ret, out, err = self.vcall(cmd)
                 clear_cache("losetup.json")
+                hoststate.invalidate()
         except Exception as exc:
             raise ex.excError(str(exc))
         if ret != 0:
@@ -48,6 +50,7 @@ class Disk(Res.Disk):
             cmd = [rcEnv.syspaths.losetup, '-d', loop]
             ret, out, err = self.vcall(cmd)
             clear_cache("losetup.json")
+            hoststate.invalidate()
             if ret != 0:
                 raise ex.excError
 
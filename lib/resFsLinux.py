@@ -5,6 +5,7 @@ import os
 from stat import ST_MODE, ST_INO, S_ISREG, S_ISBLK, S_ISDIR
 
 from rcGlobalEnv import rcEnv
+import hoststate
 import rcMountsLinux as rcMounts
 import resFs as Res
 from rcUtilities import qcall, protected_mount, getmount, justcall, lazy, cache
@@ -469,6 +470,7 @@ class Mount(Res.Mount):
             self.mount_generic()
 
         self.mounts = None
+        hoststate.invalidate()
         self.can_rollback = True
 
     def _can_check_zfs_writable(self):
@@ -603,6 +605,7 @@ class Mount(Res.Mount):
         if ret != 0:
             raise ex.excError('failed to umount %s'%self.mount_point)
         self.mounts = None
+        hoststate.invalidate()
 
     def remove_dev_holders(self, devpath, tree):
         dev = tree.get_dev_by_devpath(devpath)
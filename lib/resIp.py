@@ -8,6 +8,7 @@ import re
 import time
 
 import resources as Res
+import hoststate
 import ipaddress
 import lock
 import rcStatus
@@ -202,7 +203,7 @@ class Ip(Res.Resource):
                 return rcStatus.DOWN
             else:
                 return rcStatus.WARN
-        ifconfig = IFCONFIG_MOD.ifconfig()
+        ifconfig = self.get_ifconfig()
         intf = ifconfig.interface(self.ipdev)
         mode = getattr(self, "mode") if hasattr(self, "mode") else None
         if intf is None and "dedicated" not in self.tags and mode != "dedicated":
@@ -399,9 +400,11 @@ class Ip(Res.Resource):
     def get_ifconfig():
         """
         Wrapper around the os specific rcIfconfig module's ifconfig function.
-        Return a parsed ifconfig dataset.
+        Return a parsed ifconfig dataset, shared by the ip resources until
+        the host state snapshots are invalidated. Only for the status
+        evaluations: the actions load their own dataset.
         """
-        return IFCONFIG_MOD.ifconfig()
+        return hoststate.get("ifconfig", IFCONFIG_MOD.ifconfig)
 
     def start(self):
         """
@@ -458,8 +461,12 @@ class Ip(Res.Resource):
     def start_locked(self):
         """
         The start codepath fragment protected by the startip lock.
+
+        The stacked device allocation needs the interfaces addresses as
+        seen under the lock, not the shared status snapshot, which may
+        predate the start of another ip resource.
         """
-        ifconfig = self.get_ifconfig()
+        ifconfig = IFCONFIG_MOD.ifconfig()
         self.get_mask(ifconfig)
         if 'noalias' in self.tags:
             self.stacked_dev = self.ipdev
@@ -479,6 +486,8 @@ class Ip(Res.Resource):
             self.log.info("start ip not supported")
             ret = 0
             arp_announce = False
+        finally:
+            hoststate.invalidate()
 
         if ret != 0:
             raise ex.excError("failed")
@@ -549,7 +558,7 @@ class Ip(Res.Resource):
         if self.is_up() is False:
             self.log.info("%s is already down on %s", self.addr, self.ipdev)
             return
-        ifconfig = self.get_ifconfig()
+        ifconfig = IFCONFIG_MOD.ifconfig()
         if 'noalias' in self.tags:
             self.stacked_dev = self.ipdev
         else:
@@ -564,6 +573,8 @@ class Ip(Res.Resource):
         except ex.excNotSupported:
             self.log.info("stop ip not supported")
             return
+        finally:
+            hoststate.invalidate()
 
         if ret != 0:
             self.log.error("failed")
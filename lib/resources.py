@@ -10,6 +10,7 @@ import sys
 import time
 import json
 
+import hoststate
 import lock
 import rcExceptions as ex
 import rcStatus
@@ -68,6 +69,10 @@ class Resource(object):
         self.monitor = monitor
         self.nb_restart = restart
         self.rstatus = None
+        # the last status evaluation duration, and the parallel status
+        # evaluator timeout flag
+        self.status_duration = None
+        self.status_expired = False
         self.skip_provision = skip_provision
         self.skip_unprovision = skip_unprovision
         self.shared = shared
@@ -419,6 +424,9 @@ class Resource(object):
 
         try:
             self.progress()
+            # the action may change, and needs an accurate view of, the
+            # host state
+            hoststate.invalidate()
             self.do_action(action)
         except ex.excUndefined as exc:
             print(exc)
@@ -436,6 +444,8 @@ class Resource(object):
                 self.log.info("ignore %s error on optional resource", action)
             else:
                 raise
+        finally:
+            hoststate.invalidate()
 
     def status_stdby(self, status):
         """
@@ -509,8 +519,14 @@ class Resource(object):
         # now the rstatus can no longer be None
         if self.rstatus == rcStatus.UNDEF or refresh:
             self.status_logs = []
-            self.rstatus = self.try_status(verbose)
-            self.rstatus = self.status_stdby(self.rstatus)
+            begin = time.time()
+            rstatus = self.status_stdby(self.try_status(verbose))
+            self.status_duration = time.time() - begin
+            if self.status_expired:
+                # the parallel evaluator already reported the resource warn
+                self.status_expired = False
+                return self.rstatus
+            self.rstatus = rstatus
             self.log.debug("refresh status: %s => %s",
                            rcStatus.Status(last_status),
                            rcStatus.Status(self.rstatus))
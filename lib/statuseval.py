@@ -0,0 +1,126 @@
+"""
+The parallel resources status evaluator.
+
+Most resources status evaluations wait for external commands, so an object
+with many resources evaluates faster with the resources status evaluated
+concurrently by a pool of threads.
+"""
+import threading
+import time
+
+from six.moves import queue
+
+import rcStatus
+from converters import print_duration
+
+MAX_WAIT = 1
+
+
+class StatusEvaluator(object):
+    """
+    Evaluate the status of <resources> with at most <max_parallel>
+    threads.
+
+    The container resources are evaluated before the other resources,
+    because the status of the resources hosted in a container depends on
+    the container status.
+
+    A resource status evaluation not done after <timeout> seconds is set
+    to warn. Its thread is abandoned, and a new thread is started to
+    evaluate the remaining resources.
+    """
+    def __init__(self, resources, max_parallel, timeout=None, log=None):
+        self.resources = resources
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self.log = log
+        self.cond = threading.Condition()
+        self.todo = queue.Queue()
+        self.running = {}
+        self.pending = 0
+
+    def waves(self):
+        containers = [res for res in self.resources if res.type.startswith("container")]
+        others = [res for res in self.resources if not res.type.startswith("container")]
+        return [wave for wave in (containers, others) if wave]
+
+    def run(self, refresh=False):
+        for wave in self.waves():
+            self.run_wave(wave, refresh)
+
+    def run_wave(self, resources, refresh):
+        with self.cond:
+            for res in resources:
+                res.status_expired = False
+                self.todo.put(res)
+            self.pending = len(resources)
+            for _ in range(min(self.max_parallel, len(resources))):
+                self.start_worker(refresh)
+            while self.pending:
+                for res in self.expired():
+                    self.expire(res)
+                    self.start_worker(refresh)
+                if self.pending:
+                    self.cond.wait(self.wait_delay())
+
+    def wait_delay(self):
+        """
+        Return the delay before the next status evaluation expires.
+        Called with the lock held.
+        """
+        if not self.timeout or not self.running:
+            return MAX_WAIT
+        now = time.time()
+        delay = min(begin + self.timeout - now for _, begin in self.running.values())
+        return min(max(delay, 0.01), MAX_WAIT)
+
+    def expired(self):
+        """
+        Return the resources with a status evaluation running for more than
+        <timeout>, and remove them from the running and pending resources.
+        Called with the lock held.
+        """
+        if not self.timeout:
+            return []
+        now = time.time()
+        expired = []
+        for rid, (res, begin) in list(self.running.items()):
+            if now - begin < self.timeout:
+                continue
+            del self.running[rid]
+            self.pending -= 1
+            expired.append(res)
+        return expired
+
+    def expire(self, res):
+        res.status_expired = True
+        res.rstatus = rcStatus.WARN
+        res.status_log("status evaluation timeout (%s)" % print_duration(self.timeout))
+        if self.log:
+            self.log.warning("%s status evaluation timeout (%s)", res.rid, print_duration(self.timeout))
+
+    def start_worker(self, refresh):
+        thr = threading.Thread(target=self.worker, args=(refresh,))
+        thr.daemon = True
+        thr.start()
+
+    def worker(self, refresh):
+        while True:
+            try:
+                res = self.todo.get_nowait()
+            except queue.Empty:
+                return
+            with self.cond:
+                self.running[res.rid] = (res, time.time())
+                # let the evaluator schedule the expiration check
+                self.cond.notify()
+            try:
+                res.status(refresh=refresh, verbose=True)
+            except Exception as exc:
+                res.status_log(str(exc), "error")
+            with self.cond:
+                if self.running.pop(res.rid, None) is None:
+                    # expired: the evaluator started another worker
+                    return
+                self.pending -= 1
+                self.cond.notify()
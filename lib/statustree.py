@@ -0,0 +1,184 @@
+"""
+Change-tracking status tree.
+
+Maintain a published snapshot of a live, mutable, json-serializable data
+structure, and produce json_delta-compatible patches when the snapshot is
+refreshed.
+
+The snapshot subtrees are never modified once published, so readers can
+use them without copying, and unchanged subtrees are shared between
+successive snapshots.
+
+Subtrees matching a "tracked" path pattern are only compared with their
+live counterpart when a mutation was recorded on their path with mark(),
+which keeps the refresh cost proportional to the changes instead of the
+dataset size.
+"""
+import threading
+
+import six
+
+
+def copy(data):
+    """
+    Return a deep copy of a json-like structure, normalized like a json
+    round-trip would: tuples become lists, dict subclasses become dicts and
+    non-string keys become strings.
+    """
+    if isinstance(data, dict):
+        return dict((_key(key), copy(val)) for key, val in data.items())
+    if isinstance(data, (list, tuple)):
+        return [copy(val) for val in data]
+    return data
+
+
+def _key(key):
+    if isinstance(key, six.string_types):
+        return key
+    if key is None:
+        return "null"
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    return str(key)
+
+
+def _same(snap, live):
+    """
+    Return True if <live> is equal to the normalized <snap>, so a live tuple
+    is the same as its snapshot list.
+    """
+    if isinstance(live, (list, tuple)):
+        return isinstance(snap, list) and len(snap) == len(live) and \
+               all(_same(_snap, _live) for _snap, _live in zip(snap, live))
+    if isinstance(live, dict):
+        if not isinstance(snap, dict) or len(snap) != len(live):
+            return False
+        for key, val in live.items():
+            key = _key(key)
+            if key not in snap or not _same(snap[key], val):
+                return False
+        return True
+    return type(snap) is type(live) and snap == live
+
+
+class StatusTree(object):
+    """
+    The snapshot holder.
+
+    <tracked> is a list of path patterns, each a tuple of keys where "*"
+    matches any key. For example ("nodes", "*", "services", "status", "*")
+    makes each instance status subtree tracked.
+    """
+    def __init__(self, tracked=None):
+        self.tracked = [tuple(pattern) for pattern in tracked or []]
+        self.data = {}
+        self.lock = threading.RLock()
+        self.dirty = set()
+        self.dirty_prefixes = set()
+        self.updates = 0
+
+    def mark(self, path):
+        """
+        Record a mutation of the live data at <path>, a tuple of keys.
+        """
+        path = tuple(_key(key) for key in path)
+        with self.lock:
+            self.dirty.add(path)
+            for idx in range(1, len(path) + 1):
+                self.dirty_prefixes.add(path[:idx])
+
+    def reset(self):
+        """
+        Forget the snapshot, so the next update() is a full one.
+        """
+        with self.lock:
+            self.data = {}
+            self.dirty = set()
+            self.dirty_prefixes = set()
+
+    def update(self, live, full=False):
+        """
+        Refresh the snapshot from <live>, and return the patch from the
+        previous snapshot to the new one.
+
+        The caller must hold the lock protecting <live> from concurrent
+        mutations, and must mark() mutations under that same lock.
+
+        If <full> is True, the tracked subtrees are compared even if no
+        mutation was recorded on their path.
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            dirty_prefixes, self.dirty_prefixes = self.dirty_prefixes, set()
+            patch = []
+            walker = _Walker(self.tracked, dirty, dirty_prefixes, full, patch)
+            self.data = walker.walk(self.data, live, ())
+            self.updates += 1
+            return patch
+
+
+class _Walker(object):
+    def __init__(self, tracked, dirty, dirty_prefixes, full, patch):
+        self.tracked = tracked
+        self.dirty = dirty
+        self.dirty_prefixes = dirty_prefixes
+        self.full = full
+        self.patch = patch
+
+    def is_tracked(self, path):
+        plen = len(path)
+        for pattern in self.tracked:
+            if len(pattern) != plen:
+                continue
+            if all(p == "*" or p == k for p, k in zip(pattern, path)):
+                return True
+        return False
+
+    def has_tracked_below(self, path):
+        plen = len(path)
+        for pattern in self.tracked:
+            if len(pattern) <= plen:
+                continue
+            if all(p == "*" or p == k for p, k in zip(pattern, path)):
+                return True
+        return False
+
+    def is_dirty(self, path):
+        if path in self.dirty_prefixes:
+            return True
+        for idx in range(1, len(path)):
+            if path[:idx] in self.dirty:
+                return True
+        return False
+
+    def walk(self, snap, live, path):
+        if not isinstance(live, dict) or not isinstance(snap, dict):
+            if _same(snap, live):
+                return snap
+            new = copy(live)
+            self.patch.append([list(path), new])
+            return new
+        if not self.full and self.is_tracked(path) and not self.is_dirty(path):
+            return snap
+        if not self.has_tracked_below(path) and snap == live:
+            return snap
+        new = {}
+        changed = False
+        for key, val in live.items():
+            key = _key(key)
+            _path = path + (key,)
+            if key in snap:
+                new[key] = self.walk(snap[key], val, _path)
+                if new[key] is not snap[key]:
+                    changed = True
+            else:
+                new[key] = copy(val)
+                self.patch.append([list(_path), new[key]])
+                changed = True
+        for key in snap:
+            if key not in new:
+                self.patch.append([list(path + (key,))])
+                changed = True
+        if not changed:
+            return snap
+        return new
@@ -22,7 +22,9 @@ import locale
 import six
 from resources import Resource
 from resourceset import ResourceSet
+from statuseval import StatusEvaluator
 from freezer import Freezer
+import hoststate
 import rcStatus
 from rcGlobalEnv import rcEnv, Paths
 from storage import Storage
@@ -727,10 +729,23 @@ class BaseSvc(Crypt, ExtConfigMixin):
     def lock_timeout(self):
         return self.oget("DEFAULT", "lock_timeout")
 
+    @lazy
+    def status_max_parallel(self):
+        return self.oget("DEFAULT", "status_max_parallel")
+
+    @lazy
+    def status_timeout(self):
+        return self.oget("DEFAULT", "status_timeout")
+
     @lazy
     def cd(self):
         return self.parse_config_file(self.paths.cf)
 
+    def config_cache_fpath(self, cf):
+        if self.volatile or cf != self.paths.cf:
+            return
+        return os.path.join(self.var_d, "config.cache")
+
     @lazy
     def disabled(self):
         return self.oget("DEFAULT", "disable")
@@ -2213,13 +2228,27 @@ class BaseSvc(Crypt, ExtConfigMixin):
     def skip_config_section(self, rid):
         if rid == "DEFAULT":
             return False
-        self.init_resources()
+        if not self.resources_initialized:
+            return self.skip_config_section_from_config(rid)
         if self.encap and rid not in self.resources_by_id:
             return True
         if not self.encap and rid in self.encap_resources:
             return True
         return False
 
+    def skip_config_section_from_config(self, rid):
+        """
+        The skip_config_section() logic applied to the section keywords,
+        so the resources don't need to be built.
+        """
+        if "#" not in rid:
+            return self.encap
+        from svcBuilder import get_encap, get_tags
+        encap = get_encap(self, rid) or "encap" in get_tags(self, rid)
+        if self.encap:
+            return not encap
+        return encap and len(self.encapnodes) > 0
+
     def exists(self):
         """
         Return True if the service exists, ie has a configuration file on the
@@ -2399,7 +2428,7 @@ class BaseSvc(Crypt, ExtConfigMixin):
             if type(val) == dict:
                 for key in sorted(val.keys()):
                     _val = val[key]
-                    if key in ("status_updated", "updated", "mtime", "csum"):
+                    if key in ("status_updated", "updated", "mtime", "csum", "eval_duration"):
                         continue
                     h = fn(h, _val)
             elif type(val) == list:
@@ -3589,7 +3618,14 @@ class Svc(BaseSvc):
             for res in self.get_resources():
                 res.rstatus = None
 
-        group_status = self.group_status(refresh=refresh)
+        if refresh:
+            hoststate.invalidate()
+
+        if self.status_max_parallel > 1:
+            self.resources_status_eval(refresh=refresh)
+            group_status = self.group_status()
+        else:
+            group_status = self.group_status(refresh=refresh)
 
         data = {
             "updated": now,
@@ -3700,6 +3736,8 @@ class Svc(BaseSvc):
                     provisioned = True
                 if resource.subset:
                     _data["subset"] = resource.subset
+                if resource.status_duration is not None:
+                    _data["eval_duration"] = round(resource.status_duration, 3)
                 data["resources"][resource.rid] = _data
         for group in TOP_STATUS_GROUPS:
             group_status[group] = str(group_status[group])
@@ -3714,6 +3752,17 @@ class Svc(BaseSvc):
             self.write_status_data(data)
         return data
 
+    def resources_status_eval(self, refresh=False):
+        """
+        Evaluate the resources status in parallel, with at most
+        <status_max_parallel> threads and a <status_timeout> per resource.
+        """
+        self.setup_environ()
+        resources = self.get_resources(DEFAULT_STATUS_GROUPS)
+        evaluator = StatusEvaluator(resources, self.status_max_parallel,
+                                    timeout=self.status_timeout, log=self.log)
+        evaluator.run(refresh=refresh)
+
     def get_rset_status(self, groups, refresh=False):
         """
         Return the aggregated status of all resources of the specified resource
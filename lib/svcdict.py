@@ -103,6 +103,21 @@ KEYWORDS = [
         "convert": "duration",
         "text": "A duration expression, like ``1m30s``. The maximum wait time for the action lock acquire. The :cmd:`svcmgr --waitlock` option overrides this parameter."
     },
+    {
+        "section": "DEFAULT",
+        "keyword": "status_max_parallel",
+        "default": 1,
+        "convert": "integer",
+        "text": "The maximum number of resources evaluated in parallel by the status action. The default ``1`` evaluates the resources sequentially. With a greater value, the container resources are evaluated first, then the other resources, and each evaluation is limited to :kw:`status_timeout`.",
+        "example": "8"
+    },
+    {
+        "section": "DEFAULT",
+        "keyword": "status_timeout",
+        "default": "1m",
+        "convert": "duration",
+        "text": "A duration expression, like ``30s``. The maximum wait time for a resource status evaluation, when :kw:`status_max_parallel` is greater than 1. A resource status evaluation not done in time is reported ``warn``."
+    },
     {
         "section": "DEFAULT",
         "keyword": "mode",
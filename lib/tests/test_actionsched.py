@@ -0,0 +1,87 @@
+import logging
+import multiprocessing
+import time
+
+import pytest
+
+from actionsched import ActionScheduler
+
+
+class FakeSvc(object):
+    def __init__(self, name, parents=None, children=None, delay=0.0, ret=0):
+        self.name = name
+        self.path = name
+        self.namespace = None
+        self.parents = parents or []
+        self.children = children or []
+        self.delay = delay
+        self.ret = ret
+
+
+def worker(delay, ret):
+    time.sleep(delay)
+    raise SystemExit(ret)
+
+
+class Spawner(object):
+    def __init__(self):
+        self.started = []
+
+    def __call__(self, svc):
+        self.started.append((svc.path, time.time()))
+        proc = multiprocessing.Process(target=worker, args=(svc.delay, svc.ret))
+        proc.start()
+        return proc
+
+    def start_time(self, path):
+        return dict(self.started)[path]
+
+
+@pytest.mark.ci
+class TestActionScheduler:
+    @staticmethod
+    def test_order_follows_the_parents_on_start():
+        svcs = [
+            FakeSvc("c", parents=["b"]),
+            FakeSvc("b", parents=["a@node1"]),
+            FakeSvc("a"),
+            FakeSvc("d", parents=["unselected"]),
+        ]
+        ordered = ActionScheduler(svcs, "start").order()
+        assert [svc.path for svc in ordered] == ["a", "d", "b", "c"]
+
+    @staticmethod
+    def test_order_follows_the_children_on_stop():
+        svcs = [FakeSvc("a", children=["b"]), FakeSvc("b", parents=["a"])]
+        assert [svc.path for svc in ActionScheduler(svcs, "stop").order()] == ["b", "a"]
+        assert [svc.path for svc in ActionScheduler(svcs, "status").order()] == ["a", "b"]
+
+    @staticmethod
+    def test_order_with_a_dependency_loop():
+        svcs = [FakeSvc("a", parents=["b"]), FakeSvc("b", parents=["a"]), FakeSvc("c")]
+        ordered = ActionScheduler(svcs, "start", log=logging.getLogger("test")).order()
+        assert [svc.path for svc in ordered] == ["c", "a", "b"]
+
+    @staticmethod
+    def test_run_refills_the_slots_and_respects_the_dependencies():
+        svcs = [
+            FakeSvc("a", delay=0.3),
+            FakeSvc("b", delay=0.05),
+            FakeSvc("c", delay=0.05, ret=2),
+            FakeSvc("d", parents=["a"], delay=0.05),
+        ]
+        spawn = Spawner()
+        begin = time.time()
+        results = ActionScheduler(svcs, "start", max_parallel=2).run(spawn)
+        assert time.time() - begin < 0.9
+        assert dict((path, ret) for path, (ret, _) in results.items()) == {"a": 0, "b": 0, "c": 2, "d": 0}
+        # c is started when b is done, without waiting for a
+        assert spawn.start_time("c") - spawn.start_time("b") < 0.25
+        # d waits for its parent
+        assert spawn.start_time("d") >= spawn.start_time("a") + results["a"][1]
+
+    @staticmethod
+    def test_run_with_a_dependency_loop():
+        svcs = [FakeSvc("a", parents=["b"]), FakeSvc("b", parents=["a"])]
+        results = ActionScheduler(svcs, "start", max_parallel=2).run(Spawner())
+        assert sorted(results) == ["a", "b"]
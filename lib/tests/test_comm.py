@@ -0,0 +1,64 @@
+import logging
+import os
+
+import pytest
+
+from comm import Crypt, FRAME_HEADER_LEN, FRAME_MAGIC, FRAME_PREFIX, FRAME_VERSION
+from rcUtilities import set_lazy
+
+
+@pytest.fixture(scope='function')
+def crypt():
+    obj = Crypt()
+    obj.log = logging.getLogger("test_comm")
+    set_lazy(obj, "cluster_name", "test")
+    set_lazy(obj, "cluster_names", set(["test"]))
+    set_lazy(obj, "cluster_drpnodes", [])
+    set_lazy(obj, "cluster_key", Crypt.prepare_key("0123456789abcdef0123456789abcdef"))
+    return obj
+
+
+@pytest.mark.ci
+class TestCryptFrame:
+    @staticmethod
+    def test_frame_round_trip(crypt):
+        data = {"kind": "patch", "deltas": {"2": [[["updated"], 1.0]]}}
+        frame = crypt.encrypt_frame(data)
+        assert crypt.is_frame(frame)
+        assert crypt.frame_len(frame) == len(frame)
+        clustername, _, decrypted = crypt.decrypt(frame)
+        assert clustername == "test"
+        assert decrypted == data
+
+    @staticmethod
+    def test_frame_is_smaller_than_legacy_message(crypt):
+        data = {"services": dict(("svc%d" % idx, {"avail": "up", "overall": "up"}) for idx in range(500))}
+        assert len(crypt.encrypt_frame(data)) < len(crypt.encrypt(data))
+
+    @staticmethod
+    def test_legacy_message_still_decrypts(crypt):
+        message = crypt.encrypt({"kind": "ping"})
+        assert not crypt.is_frame(message)
+        assert crypt.frame_len(message) is None
+        assert crypt.decrypt(message)[2] == {"kind": "ping"}
+
+    @staticmethod
+    def test_truncated_frame_is_rejected(crypt):
+        frame = crypt.encrypt_frame({"kind": "ping"})
+        assert crypt.decrypt(frame[:-1]) == (None, None, None)
+
+    @staticmethod
+    @pytest.mark.parametrize("header,length", [
+        (b"", 1),
+        (b"{}", FRAME_HEADER_LEN.size + 2),
+        (b"[]", FRAME_HEADER_LEN.size + 2 + 16),
+        (b"1", FRAME_HEADER_LEN.size + 1 + 16),
+        (b"[" * 60000, FRAME_HEADER_LEN.size + 60000 + 16),
+        (b'{"a"', FRAME_HEADER_LEN.size + 4 + 16),
+    ])
+    def test_malformed_frame_is_rejected(crypt, header, length):
+        body = FRAME_HEADER_LEN.pack(len(header)) + header + os.urandom(16)
+        frame = FRAME_PREFIX.pack(FRAME_MAGIC, FRAME_VERSION, length) + body[:length]
+        with pytest.raises(ValueError):
+            crypt.parse_frame(frame)
+        assert crypt.decrypt(frame) == (None, None, None)
@@ -0,0 +1,122 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+
+import forkserver
+from forkserver import ForkServer, ForkServerClient
+
+
+class FakeServerProc(object):
+    pid = 0
+
+    @staticmethod
+    def poll():
+        return None
+
+
+@pytest.fixture(scope="function")
+def client():
+    obj = ForkServerClient()
+    obj.sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    obj.sock.setblocking(False)
+    obj.proc = FakeServerProc()
+    yield obj, peer
+    peer.close()
+    if obj.sock:
+        obj.sock.close()
+
+
+def recv_messages(sock, count, timeout=5):
+    buff = b""
+    limit = time.time() + timeout
+    while buff.count(b"\n") < count and time.time() < limit:
+        buff += sock.recv(65536)
+    return [json.loads(line.decode()) for line in buff.splitlines()]
+
+
+@pytest.mark.ci
+class TestForkServerClient:
+    @staticmethod
+    def test_exit_received_with_the_spawn_reply(client):
+        obj, peer = client
+        # the child exits before the client processes the spawn reply
+        peer.sendall(b'{"id": 1, "pid": 12345}\n{"pid": 12345, "ret": 3}\n')
+        proc = obj.spawn("nodemgr", ["ls"], env={})
+        assert proc.pid == 12345
+        assert proc.poll() == 3
+        assert obj.procs == {}
+        request = recv_messages(peer, 1)[0]
+        assert request["mgr"] == "nodemgr"
+        assert request["argv"] == ["ls"]
+
+    @staticmethod
+    def test_exit_received_after_the_spawn_reply(client):
+        obj, peer = client
+        peer.sendall(b'{"id": 1, "pid": 12345}\n')
+        proc = obj.spawn("svcmgr", ["-s", "svc1", "status"], env={})
+        assert proc.poll() is None
+        peer.sendall(b'{"pid": 12345, "ret": 0}\n')
+        assert proc.wait() == 0
+
+    @staticmethod
+    def test_spawn_error_reply(client):
+        obj, peer = client
+        peer.sendall(b'{"id": 1, "error": "fork failed"}\n')
+        with pytest.raises(forkserver.ex.excError):
+            obj.spawn("nodemgr", ["ls"], env={})
+
+    @staticmethod
+    def test_lost_server_orphans_are_polled(client):
+        obj, peer = client
+        peer.sendall(b'{"id": 1, "pid": 12345}\n')
+        proc = obj.spawn("nodemgr", ["ls"], env={})
+        # use a live pid, so the orphan is still running
+        del obj.procs[proc.pid]
+        proc.pid = os.getpid()
+        obj.procs[proc.pid] = proc
+        peer.close()
+        assert proc.poll() is None
+        assert obj.sock is None
+        assert proc.pid in obj.orphans
+
+
+@pytest.mark.ci
+class TestForkServer:
+    @staticmethod
+    def test_fork_and_reap(monkeypatch):
+        monkeypatch.setattr(ForkServer, "run", staticmethod(lambda mgr, argv: int(argv[0])))
+        sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server = ForkServer(sock)
+            server.handle(json.dumps({"id": 7, "mgr": "nodemgr", "argv": ["4"], "env": {}, "devnull": True}).encode())
+            reply = recv_messages(peer, 1)[0]
+            assert reply["id"] == 7
+            limit = time.time() + 5
+            while time.time() < limit:
+                server.reap()
+                peer.setblocking(False)
+                try:
+                    data = peer.recv(65536)
+                except socket.error:
+                    time.sleep(0.05)
+                    continue
+                assert json.loads(data.decode()) == {"pid": reply["pid"], "ret": 4}
+                break
+            else:
+                assert False, "child exit not reported"
+        finally:
+            sock.close()
+            peer.close()
+
+    @staticmethod
+    def test_unsupported_mgr_is_rejected():
+        sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            ForkServer(sock).handle(b'{"id": 1, "mgr": "rm", "argv": []}')
+            assert "error" in recv_messages(peer, 1)[0]
+        finally:
+            sock.close()
+            peer.close()
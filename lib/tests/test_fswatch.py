@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+import rcExceptions as ex
+from fswatch import FsWatcher
+from rcGlobalEnv import rcEnv
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is linux only")
+
+
+def write(path, data="foo"):
+    with open(path, "w") as filep:
+        filep.write(data)
+
+
+def drain(watcher):
+    while watcher.read():
+        pass
+    return watcher.changes()
+
+
+@pytest.mark.ci
+class TestFsWatcher:
+    @staticmethod
+    def test_changes_are_reported_once(tmpdir):
+        root = str(tmpdir)
+        watcher = FsWatcher(match=lambda path: path.endswith(".conf"))
+        try:
+            watcher.add_tree(root, 1)
+            write(os.path.join(root, "a.conf"))
+            write(os.path.join(root, "a.txt"))
+            assert drain(watcher) == (set([os.path.join(root, "a.conf")]), False)
+            assert drain(watcher) == (set(), False)
+        finally:
+            watcher.close()
+
+    @staticmethod
+    def test_new_directories_are_watched(tmpdir):
+        root = str(tmpdir)
+        watcher = FsWatcher()
+        try:
+            watcher.add_tree(root, 2)
+            subdir = os.path.join(root, "ns", "svc")
+            os.makedirs(subdir)
+            drain(watcher)
+            write(os.path.join(subdir, "s1.conf"))
+            changed, _ = drain(watcher)
+            assert os.path.join(subdir, "s1.conf") in changed
+            os.makedirs(os.path.join(subdir, "too", "deep"))
+            drain(watcher)
+            write(os.path.join(subdir, "too", "deep", "s2.conf"))
+            changed, _ = drain(watcher)
+            assert changed == set()
+        finally:
+            watcher.close()
+
+
+@pytest.mark.ci
+def test_monitor_maps_files_to_objects():
+    from osvcd_mon import Monitor
+    etc = rcEnv.paths.pathetc
+    var = rcEnv.paths.pathvar
+    assert Monitor.fswatch_object(os.path.join(etc, "s1.conf")) == ("config", "s1")
+    assert Monitor.fswatch_object(os.path.join(etc, "sec", "s1.conf")) == ("config", "sec/s1")
+    assert Monitor.fswatch_object(os.path.join(rcEnv.paths.pathetcns, "ns1", "cfg", "c1.conf")) == ("config", "ns1/cfg/c1")
+    assert Monitor.fswatch_object(os.path.join(rcEnv.paths.pathetcns, "ns1")) == ("etc", None)
+    assert Monitor.fswatch_object(os.path.join(var, "svc", "s1", "status.json")) == ("status", "s1")
+    assert Monitor.fswatch_object(os.path.join(var, "vol", "v1", "status.json")) == ("status", "vol/v1")
+    assert Monitor.fswatch_object(os.path.join(var, "namespaces", "ns1", "svc", "s1", "status.json")) == ("status", "ns1/svc/s1")
+    assert Monitor.fswatch_object(os.path.join(var, "svc", "s1", "frozen")) == (None, None)
+
+
+@pytest.mark.ci
+def test_unwatched_directory_falls_back_to_polling(tmpdir):
+    import logging
+    from osvcd_mon import Monitor
+    root = str(tmpdir)
+    watcher = FsWatcher()
+    watcher.add_tree(root, 2)
+
+    def add_tree(path, depth=0):
+        raise ex.excError("inotify watch %s error: No space left on device" % path)
+
+    watcher.add_tree = add_tree
+    subdir = os.path.join(root, "ns")
+    os.makedirs(subdir)
+    drain(watcher)
+    assert watcher.unwatched == set([subdir])
+
+    monitor = Monitor()
+    monitor.log = logging.getLogger("test_fswatch")
+    monitor.fswatch = watcher
+    assert monitor.get_fswatch_changes() is True
+    assert monitor.fswatch is None
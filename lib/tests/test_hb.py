@@ -0,0 +1,39 @@
+import pytest
+
+import osvcd_shared as shared
+from hb import Hb
+from rcGlobalEnv import rcEnv
+
+
+@pytest.fixture(scope="function")
+def hb():
+    obj = Hb.__new__(Hb)
+    obj.hb_nodes = [rcEnv.nodename, "n2", "n3"]
+    return obj
+
+
+@pytest.mark.ci
+class TestPeersBinary:
+    @staticmethod
+    def test_compat_version_is_unchanged():
+        # a compat version change disables the orchestration on mixed
+        # version clusters. announce new capabilities as features instead.
+        assert shared.COMPAT_VERSION == 10
+
+    @staticmethod
+    def test_all_peers_must_announce_the_feature(hb, mocker):
+        mocker.patch.object(shared, "CLUSTER_DATA", {
+            "n2": {"compat": 10, "features": ["hb_binary"]},
+            "n3": {"compat": 10},
+        })
+        assert hb.peers_binary("n2") is True
+        assert hb.peers_binary("n3") is False
+        assert hb.peers_binary() is False
+        shared.CLUSTER_DATA["n3"]["features"] = ["hb_binary"]
+        assert hb.peers_binary() is True
+
+    @staticmethod
+    def test_unknown_peer_is_not_binary(hb, mocker):
+        mocker.patch.object(shared, "CLUSTER_DATA", {})
+        assert hb.peers_binary("n2") is False
+        assert hb.peers_binary() is False
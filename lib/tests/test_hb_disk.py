@@ -0,0 +1,48 @@
+import mmap
+import os
+
+import pytest
+
+from hb_disk import HbDisk
+
+
+@pytest.fixture(scope='function')
+def hb(tmpdir):
+    dev = os.path.join(str(tmpdir), "dev")
+    with open(dev, "wb") as filep:
+        filep.truncate(HbDisk.METASIZE + 2 * HbDisk.SLOTSIZE)
+    obj = HbDisk.__new__(HbDisk)
+    obj.dev = dev
+    obj.flags = os.O_RDWR
+    obj.fo = None
+    obj.slot_buff = mmap.mmap(-1, HbDisk.SLOTSIZE)
+    obj.meta_slot_buff = mmap.mmap(-1, 2*mmap.PAGESIZE)
+    yield obj
+    obj.close_fo()
+
+
+@pytest.mark.ci
+class TestHbDiskSlots:
+    @staticmethod
+    def test_binary_slot_round_trip(hb):
+        fo = hb.open_fo()
+        message = b"x" * (3 * mmap.PAGESIZE)
+        hb.write_slot(1, hb.format_slot(message, binary=True), fo=fo)
+        data = hb.read_slot(1, fo=fo)
+        assert data["msg"] == message
+        assert hb.read_slot(1, fo=fo, last_updated=data["updated"])["msg"] is None
+        assert hb.open_fo() is fo
+
+    @staticmethod
+    def test_legacy_slot_round_trip(hb):
+        fo = hb.open_fo()
+        for message in ("short", "y" * (2 * mmap.PAGESIZE)):
+            hb.write_slot(0, hb.format_slot(message), fo=fo)
+            assert hb.read_slot(0, fo=fo)["msg"] == message
+
+    @staticmethod
+    def test_shorter_message_overwrites_longer(hb):
+        fo = hb.open_fo()
+        hb.write_slot(0, hb.format_slot(b"z" * (2 * mmap.PAGESIZE), binary=True), fo=fo)
+        hb.write_slot(0, hb.format_slot(b"short", binary=True), fo=fo)
+        assert hb.read_slot(0, fo=fo)["msg"] == b"short"
@@ -0,0 +1,111 @@
+import logging
+import uuid
+
+import pytest
+
+import hb_mcast
+from hb_mcast import FRAGMENT_HEADER, FRAGMENT_MAGIC, Fragments, HbMcastRx
+from rcUtilities import chunker
+
+
+@pytest.fixture(scope="function")
+def rx(mocker):
+    obj = HbMcastRx.__new__(HbMcastRx)
+    obj.log = logging.getLogger("test_hb_mcast")
+    obj.fragments = {}
+    mocker.patch.object(obj, "handle")
+    return obj
+
+
+def fragment(mid, idx, total, chunk):
+    return memoryview(FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, mid.bytes, idx, total) + chunk)
+
+
+@pytest.mark.ci
+class TestFragments:
+    @staticmethod
+    @pytest.mark.parametrize("order", ["forward", "reverse"])
+    def test_binary_reassembly(order):
+        message = bytes(bytearray(range(256))) * 10
+        chunks = list(chunker(message, 1000))
+        fragments = Fragments(len(chunks), 1000)
+        indexes = list(range(1, len(chunks) + 1))
+        if order == "reverse":
+            indexes.reverse()
+        complete = [fragments.add(idx, memoryview(chunks[idx-1])) for idx in indexes]
+        assert complete == [False] * (len(chunks) - 1) + [True]
+        assert bytes(fragments.message()) == message
+
+    @staticmethod
+    def test_duplicate_fragment_is_ignored():
+        fragments = Fragments(2, 1000)
+        assert fragments.add(1, memoryview(b"ab")) is False
+        assert fragments.add(1, memoryview(b"ab")) is False
+        assert fragments.add(3, memoryview(b"ab")) is False
+        assert fragments.add(2, memoryview(b"c")) is True
+        assert bytes(fragments.message()) == b"abc"
+
+    @staticmethod
+    def test_inconsistent_fragment_size_is_rejected():
+        fragments = Fragments(3, 1000)
+        fragments.add(1, memoryview(b"ab"))
+        with pytest.raises(ValueError):
+            fragments.add(2, memoryview(b"abc"))
+
+    @staticmethod
+    def test_legacy_reassembly():
+        fragments = Fragments(2, 1000)
+        fragments.add(2, "cd")
+        assert fragments.add(1, "ab") is True
+        assert fragments.message() == "abcd"
+
+    @staticmethod
+    def test_oversized_fragment_is_rejected():
+        fragments = Fragments(3, 1000)
+        with pytest.raises(ValueError):
+            fragments.add(1, memoryview(b"a" * 1001))
+        with pytest.raises(ValueError):
+            fragments.add(2, "a" * 1001)
+        assert fragments.buff is None
+
+    @staticmethod
+    def test_allocation_over_budget_is_rejected():
+        fragments = Fragments(1000, 1000)
+        with pytest.raises(ValueError):
+            fragments.add(1, memoryview(b"a" * 1000), budget=100000)
+        assert fragments.buff is None
+        assert fragments.size == 0
+        assert fragments.add(1, memoryview(b"a" * 1000), budget=999000) is False
+        assert fragments.size == 999000
+
+
+@pytest.mark.ci
+class TestHbMcastRx:
+    @staticmethod
+    def test_fragmented_message(rx):
+        mid = uuid.uuid4()
+        rx.handle_datagram(fragment(mid, 2, 2, b"cd"), "addr1")
+        rx.handle.assert_not_called()
+        rx.handle_datagram(fragment(mid, 1, 2, b"ab"), "addr1")
+        assert bytes(rx.handle.call_args[0][0]) == b"abcd"
+        assert rx.fragments["addr1"] == {}
+
+    @staticmethod
+    def test_pending_bytes_are_capped_per_sender(rx):
+        # each first fragment reserves 999 KB
+        for _ in range(2):
+            rx.handle_datagram(fragment(uuid.uuid4(), 1, 1000, b"a" * 1000), "addr1")
+        assert len(rx.fragments["addr1"]) == 2
+        rx.handle_datagram(fragment(uuid.uuid4(), 1, 1000, b"a" * 1000), "addr1")
+        assert len(rx.fragments["addr1"]) == 2
+        pending = sum(frags.size for frags in rx.fragments["addr1"].values())
+        assert pending <= hb_mcast.MAX_PENDING_BYTES
+
+        # the other senders have their own budget
+        rx.handle_datagram(fragment(uuid.uuid4(), 1, 1000, b"a" * 1000), "addr2")
+        assert len(rx.fragments["addr2"]) == 1
+
+    @staticmethod
+    def test_oversized_fragment_header_is_dropped(rx):
+        rx.handle_datagram(fragment(uuid.uuid4(), 1, 1000, b"a" * 1400), "addr1")
+        assert rx.fragments["addr1"] == {}
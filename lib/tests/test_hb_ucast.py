@@ -0,0 +1,170 @@
+import logging
+import socket
+import time
+
+import pytest
+
+import hb_ucast
+from comm import FRAME_PREFIX
+from hb_ucast import HbUcastRx, UcastPeer
+from rcGlobalEnv import rcEnv
+from storage import Storage
+
+
+def frame(payload):
+    return FRAME_PREFIX.pack(b"OSVB", 1, len(payload)) + payload
+
+
+class FakeHb(object):
+    def __init__(self, port):
+        self.log = logging.getLogger("test_hb_ucast")
+        self.peer_config = {
+            rcEnv.nodename: {"addr": "127.0.0.1", "port": 0},
+            "peer1": {"addr": "127.0.0.1", "port": port},
+        }
+        self.sent = []
+        self.lasts = []
+
+    def set_last(self, nodename, success=True):
+        self.lasts.append(success)
+
+    def get_last(self, nodename):
+        return Storage(success=self.lasts[-1] if self.lasts else True)
+
+    def push_stats(self, _bytes=-1):
+        self.sent.append(_bytes)
+
+    def set_beating(self, nodename):
+        pass
+
+
+@pytest.fixture(scope="function")
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(8)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture(scope="function")
+def peer(listener):
+    obj = UcastPeer(FakeHb(listener.getsockname()[1]), "peer1")
+    yield obj
+    obj.stop()
+    obj.thread.join(5)
+
+
+def recv_all(listener, size):
+    conn, _ = listener.accept()
+    conn.settimeout(5)
+    buff = b""
+    try:
+        while len(buff) < size:
+            data = conn.recv(size - len(buff))
+            if not data:
+                break
+            buff += data
+    finally:
+        conn.close()
+    return buff
+
+
+@pytest.mark.ci
+class TestSplitMessages:
+    @staticmethod
+    def test_mixed_frames_and_legacy_messages():
+        rx = HbUcastRx.__new__(HbUcastRx)
+        client = Storage(buff=frame(b"abc") + b'{"a": 1}\0' + frame(b"") + b'{"b": 2}\0')
+        assert rx.split_messages(client) == [frame(b"abc"), b'{"a": 1}\0', frame(b""), b'{"b": 2}\0']
+        assert client.buff == b""
+
+    @staticmethod
+    def test_partial_frames_are_kept_in_the_buffer():
+        rx = HbUcastRx.__new__(HbUcastRx)
+        data = frame(b"0123456789") + b'{"a": 1}\0'
+        client = Storage(buff=b"")
+        messages = []
+        # feed the stream byte per byte: the prefix, the payload and the
+        # legacy message are all cut at some point
+        for idx in range(len(data)):
+            client.buff += data[idx:idx+1]
+            messages += rx.split_messages(client)
+        assert messages == [frame(b"0123456789"), b'{"a": 1}\0']
+        assert client.buff == b""
+
+    @staticmethod
+    def test_legacy_message_tail_is_kept_in_the_buffer():
+        rx = HbUcastRx.__new__(HbUcastRx)
+        client = Storage(buff=b'{"a": 1}\0{"b"')
+        assert rx.split_messages(client) == [b'{"a": 1}\0']
+        assert client.buff == b'{"b"'
+
+    @staticmethod
+    def test_corrupted_stream_is_dropped():
+        rx = HbUcastRx.__new__(HbUcastRx)
+        client = Storage(buff=b"OXXX" + b"\0" * 20)
+        assert rx.split_messages(client) == []
+        assert client.buff == b""
+
+
+@pytest.mark.ci
+class TestUcastPeer:
+    @staticmethod
+    def test_sender_thread_sends_the_queued_message(peer, listener):
+        peer.send(b"hello\0", 6)
+        assert recv_all(listener, 6) == b"hello\0"
+        limit = time.time() + 5
+        while not peer.hb.sent and time.time() < limit:
+            time.sleep(0.01)
+        assert peer.hb.sent == [6]
+        assert peer.hb.lasts == [True]
+
+    @staticmethod
+    def test_persistent_connection_is_kept_open(peer, listener):
+        peer.do(frame(b"a"), 8, True)
+        sock = peer.sock
+        assert sock is not None
+        peer.do(frame(b"b"), 8, True)
+        assert peer.sock is sock
+        data = frame(b"a") + frame(b"b")
+        assert recv_all(listener, len(data)) == data
+        assert peer.stats.reconnects == 0
+
+    @staticmethod
+    def test_only_persistent_reconnects_are_counted(peer, listener):
+        # legacy peers need a new connection per message
+        for _ in range(3):
+            peer.do(b"legacy\0", 7, False)
+            assert peer.sock is None
+        assert peer.stats.reconnects == 0
+
+        peer.do(frame(b"a"), 8, True)
+        assert peer.stats.reconnects == 0
+        # connection lost
+        peer.close()
+        peer.do(frame(b"b"), 8, True)
+        assert peer.stats.reconnects == 1
+
+    @staticmethod
+    def test_reconnect_backoff(peer, listener):
+        # nothing listens on the peer port anymore
+        listener.close()
+        peer.do(b"msg\0", 4, True)
+        assert peer.backoff == hb_ucast.MIN_BACKOFF
+        assert peer.hb.lasts == [False]
+        assert peer.next_connect > time.time()
+
+        # in backoff: no connection attempt
+        peer.do(b"msg\0", 4, True)
+        assert peer.hb.lasts == [False]
+        assert peer.backoff == hb_ucast.MIN_BACKOFF
+
+        peer.next_connect = 0
+        peer.do(b"msg\0", 4, True)
+        assert peer.backoff == 2 * hb_ucast.MIN_BACKOFF
+        assert peer.hb.lasts == [False, False]
+
+        for _ in range(10):
+            peer.set_backoff()
+        assert peer.backoff == hb_ucast.MAX_BACKOFF
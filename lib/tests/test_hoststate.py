@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+import pytest
+
+import hoststate
+import resIp
+from rcLoopLinux import sysfs_losetup_data
+from rcMountsLinux import Mounts
+from rcUtilities import set_lazy
+
+MOUNTINFO = """\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,errors=remount-ro
+30 22 0:25 / /srv/my\\040data rw,nosuid - tmpfs tmpfs rw,size=1024k
+31 22 7:0 / /srv/img rw,relatime shared:4 master:2 - xfs /dev/loop0 rw,attr2
+"""
+
+
+@pytest.fixture(scope="function")
+def loader():
+    hoststate.invalidate()
+    calls = []
+
+    def fn():
+        calls.append(time.time())
+        time.sleep(0.05)
+        return len(calls)
+
+    return fn, calls
+
+
+@pytest.mark.ci
+class TestHostState:
+    @staticmethod
+    def test_dataset_is_loaded_once(loader):
+        fn, calls = loader
+        assert hoststate.get("test", fn) == 1
+        assert hoststate.get("test", fn) == 1
+        assert len(calls) == 1
+
+    @staticmethod
+    def test_invalidate_reloads(loader):
+        fn, calls = loader
+        hoststate.get("test", fn)
+        gen = hoststate.generation()
+        hoststate.invalidate()
+        assert hoststate.generation() == gen + 1
+        assert hoststate.get("test", fn) == 2
+
+    @staticmethod
+    def test_expired_snapshot_is_reloaded(loader):
+        fn, calls = loader
+        hoststate.get("test", fn, ttl=0.1)
+        time.sleep(0.15)
+        assert hoststate.get("test", fn, ttl=0.1) == 2
+
+    @staticmethod
+    def test_concurrent_callers_share_the_load(loader):
+        fn, calls = loader
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(hoststate.get("test", fn))) for _ in range(8)]
+        for thr in threads:
+            thr.start()
+        for thr in threads:
+            thr.join()
+        assert results == [1] * 8
+        assert len(calls) == 1
+
+
+@pytest.mark.ci
+class TestSnapshotParsers:
+    @staticmethod
+    def test_parse_mountinfo(tmpdir):
+        fpath = os.path.join(str(tmpdir), "mountinfo")
+        with open(fpath, "w") as filep:
+            filep.write(MOUNTINFO)
+        mounts = Mounts.parse_mountinfo(fpath)
+        assert [(m.dev, m.mnt, m.type) for m in mounts] == [
+            ("/dev/sda1", "/", "ext4"),
+            ("tmpfs", "/srv/my data", "tmpfs"),
+            ("/dev/loop0", "/srv/img", "xfs"),
+        ]
+        assert mounts[0].mnt_opt == "rw,relatime,errors=remount-ro"
+
+    @staticmethod
+    def test_parse_mountinfo_rejects_unexpected_format(tmpdir):
+        fpath = os.path.join(str(tmpdir), "mountinfo")
+        with open(fpath, "w") as filep:
+            filep.write("/dev/sda1 on / type ext4 (rw)\n")
+        with pytest.raises(ValueError):
+            Mounts.parse_mountinfo(fpath)
+
+    @staticmethod
+    def test_sysfs_losetup_data(tmpdir):
+        for name, backfile in (("loop0", "/srv/a.img"), ("loop1", "/srv/b.img (deleted)")):
+            dpath = os.path.join(str(tmpdir), name, "loop")
+            os.makedirs(dpath)
+            with open(os.path.join(dpath, "backing_file"), "w") as filep:
+                filep.write(backfile + "\n")
+        os.makedirs(os.path.join(str(tmpdir), "loop2"))
+        data = sysfs_losetup_data(os.path.join(str(tmpdir), "loop*", "loop", "backing_file"))
+        assert sorted(data, key=lambda d: d["name"]) == [
+            {"name": "/dev/loop0", "back-file": "/srv/a.img"},
+            {"name": "/dev/loop1", "back-file": "/srv/b.img"},
+        ]
+
+
+@pytest.mark.ci
+class TestIpStartLocked:
+    @staticmethod
+    def test_stacked_dev_is_allocated_from_a_fresh_dataset(mocker):
+        hoststate.invalidate()
+        stale = mocker.Mock(name="stale")
+        fresh = mocker.Mock(name="fresh")
+        fresh.get_stacked_dev.return_value = "eth0:2"
+        # the status snapshot, loaded before the startip lock
+        assert hoststate.get("ifconfig", lambda: stale) is stale
+        mocker.patch.object(resIp.IFCONFIG_MOD, "ifconfig", return_value=fresh)
+        res = resIp.Ip.__new__(resIp.Ip)
+        res.tags = set()
+        res.ipdev = "eth0"
+        res.addr = "10.0.0.2"
+        res.mask = "24"
+        set_lazy(res, "log", mocker.Mock())
+        mocker.patch.object(res, "startip_cmd", return_value=(0, "", ""))
+        assert res.start_locked() is True
+        assert res.stacked_dev == "eth0:2"
+        assert not stale.get_stacked_dev.called
+        # the started address is visible to the next status evaluations
+        assert hoststate.get("ifconfig", lambda: fresh) is fresh
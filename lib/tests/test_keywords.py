@@ -0,0 +1,62 @@
+import pytest
+
+from keywords import Keyword, KeywordStore
+
+
+@pytest.fixture(scope="function")
+def store():
+    return KeywordStore(
+        keywords=[
+            {"section": "fs", "keyword": "type", "candidates": ["flag", "xfs"], "text": ""},
+            {"section": "fs", "keyword": "mnt", "rtype": ["xfs"], "text": ""},
+            {"section": "fs", "keyword": "mnt", "text": ""},
+            {"section": "fs", "keyword": "options", "rtype": "xfs", "default": [], "required": True, "text": ""},
+            {"section": "fs", "keyword": "mnt_opt", "rtype": "xfs", "text": ""},
+        ],
+        deprecated_keywords={
+            "fs.xfs.mount_options": "mnt_opt",
+            "fs.xfs.gone": None,
+            "fs.mountpoint": "mnt",
+        },
+    )
+
+
+@pytest.mark.ci
+class TestSection:
+    @staticmethod
+    def test_getkey_returns_the_first_declared_match(store):
+        section = store["fs"]
+        assert section.getkey("mnt", "xfs").rtype == ["xfs"]
+        assert section.getkey("mnt").rtype is None
+        assert section.getkey("mnt", "flag").rtype is None
+        assert section.getkey("options") is None
+        assert section.getkey("unknown", "xfs") is None
+
+    @staticmethod
+    def test_getkey_resolves_deprecated_aliases(store):
+        section = store["fs"]
+        assert section.getkey("mount_options", "xfs").keyword == "mnt_opt"
+        assert section.getkey("mountpoint").keyword == "mnt"
+        assert section.getkey("gone", "xfs") is None
+
+    @staticmethod
+    def test_getkey_strips_the_scope(store):
+        section = store["fs"]
+        assert section.getkey("mnt@node1", "xfs") is section.getkey("mnt", "xfs")
+        assert section.getkey("mnt@node1@node2") is None
+
+    @staticmethod
+    def test_added_keyword_invalidates_the_resolved_lookups(store):
+        assert store["fs"].getkey("dev") is None
+        store += Keyword("fs", "dev")
+        assert store["fs"].getkey("dev").keyword == "dev"
+
+
+@pytest.mark.ci
+class TestKeywordStore:
+    @staticmethod
+    def test_update_does_not_share_the_defaults(store):
+        completion = store.update("fs#1", {"type": "xfs"})
+        assert completion["options"] == []
+        completion["options"].append("noatime")
+        assert store["fs"].getkey("options", "xfs").default == []
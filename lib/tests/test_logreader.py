@@ -0,0 +1,88 @@
+import datetime
+import gzip
+import os
+import time
+
+import pytest
+
+import logreader
+
+BASE = time.mktime((2026, 10, 18, 12, 0, 0, 0, 0, -1))
+
+
+def line(t, msg, path="svc1"):
+    date = datetime.datetime.fromtimestamp(t)
+    return "%s,%03d INFO n:node1 o:%s | %s\n" % (date.strftime("%Y-%m-%d %H:%M:%S"), date.microsecond // 1000, path, msg)
+
+
+def write_log(fpath, begin, count, step=1.0, compress=False):
+    buff = ""
+    for idx in range(count):
+        buff += line(begin + idx * step, "message %d" % idx)
+        if idx % 10 == 0:
+            buff += "  continued line\n"
+    if compress:
+        with gzip.open(fpath, "wt") as filep:
+            filep.write(buff)
+    else:
+        with open(fpath, "w") as filep:
+            filep.write(buff)
+
+
+@pytest.mark.ci
+class TestLogReader:
+    @staticmethod
+    def test_parse_time():
+        for time_s in ("12:00:01,123", "23:59:59,999", "00:00:00,000"):
+            expected = datetime.datetime.strptime("2026-10-18 " + time_s, "%Y-%m-%d %H:%M:%S,%f").timestamp()
+            assert logreader.parse_time("2026-10-18", time_s) == pytest.approx(expected)
+
+    @staticmethod
+    def test_read_records(tmpdir):
+        fpath = os.path.join(str(tmpdir), "svc1.log")
+        write_log(fpath, BASE, 3)
+        with open(fpath, "r") as ofile:
+            records = logreader.read_records(ofile)
+        assert [r["m"] for r in records] == [["message 0", "  continued line"], ["message 1"], ["message 2"]]
+        assert records[1] == {"t": BASE + 1, "l": "INFO", "m": ["message 1"], "x": {"n": "node1", "o": "svc1"}}
+
+    @staticmethod
+    def test_read_since_bisects(tmpdir, mocker):
+        fpath = os.path.join(str(tmpdir), "svc1.log")
+        write_log(fpath, BASE, 20000)
+        spy = mocker.spy(logreader, "parse")
+        records = logreader.read_since(fpath, BASE + 19990)
+        assert [r["m"][0] for r in records] == ["message %d" % idx for idx in range(19990, 20000)]
+        # only the records near the range start are parsed
+        assert spy.call_count < 200
+
+    @staticmethod
+    def test_read_since_across_rotation(tmpdir):
+        fpath = os.path.join(str(tmpdir), "svc1.log")
+        write_log(fpath + ".1.gz", BASE, 100, compress=True)
+        write_log(fpath, BASE + 100, 100)
+        records = logreader.read_since(fpath, BASE + 95)
+        assert [r["t"] for r in records] == [BASE + idx for idx in range(95, 200)]
+        assert logreader.read_since(fpath, BASE + 500) == []
+
+    @staticmethod
+    def test_follow_rotation(tmpdir):
+        fpath = os.path.join(str(tmpdir), "svc1.log")
+        write_log(fpath, BASE, 1)
+        ofile = open(fpath, "r")
+        ofile.seek(0, 2)
+        assert logreader.follow(ofile) == ([], ofile)
+        with open(fpath, "a") as filep:
+            filep.write(line(BASE + 1, "appended"))
+        records, ofile = logreader.follow(ofile)
+        assert [r["m"] for r in records] == [["appended"]]
+        # rotation
+        with open(fpath, "a") as filep:
+            filep.write(line(BASE + 2, "before rotation"))
+        os.rename(fpath, fpath + ".1")
+        write_log(fpath, BASE + 3, 1)
+        records, new_ofile = logreader.follow(ofile)
+        assert new_ofile is not ofile
+        assert ofile.closed
+        assert [r["m"][0] for r in records] == ["before rotation", "message 0"]
+        new_ofile.close()
@@ -0,0 +1,97 @@
+import pytest
+
+import rcExceptions as ex
+from objselector import SelectorIndex
+from storage import Storage
+
+
+class FakeSvc(object):
+    def __init__(self, kw):
+        self.kw = kw
+
+    def _get(self, param, evaluate=True):
+        try:
+            return self.kw[param]
+        except KeyError:
+            raise ex.OptNotFound
+
+    def conf_sections(self):
+        return sorted(set(k.split(".")[0] for k in self.kw if "#" in k))
+
+
+AGG = {
+    "s1": Storage({"avail": "up"}),
+    "s2": Storage({"avail": "down"}),
+    "vol/s1": Storage({"avail": "up"}),
+    "ns1/svc/s1": Storage({"avail": "up"}),
+    "ns1/cfg/web": Storage({"avail": "n/a"}),
+}
+SERVICES = {
+    "s1": FakeSvc({"env": "PRD", "fs#1.type": "xfs"}),
+    "s2": FakeSvc({"env": "DEV"}),
+    "ns1/svc/s1": FakeSvc({"env": "PRD"}),
+}
+ALL_NS = set(["root", "ns1"])
+
+
+def select(index, selector, namespace=None, namespaces=ALL_NS, paths=None, agg=AGG):
+    return index.select(agg, SERVICES, lambda path: agg.get(path), selector=selector,
+                        namespace=namespace, namespaces=set(namespaces), paths=paths)
+
+
+@pytest.mark.ci
+class TestSelectorIndex:
+    @staticmethod
+    @pytest.mark.parametrize("selector, expected", [
+        ("**", ["s1", "s2", "vol/s1", "ns1/svc/s1", "ns1/cfg/web"]),
+        ("*", ["s1", "s2", "ns1/svc/s1"]),
+        ("s*", ["s1", "s2"]),
+        ("s2,s1", ["s2", "s1"]),
+        ("**/s1", ["s1", "vol/s1", "ns1/svc/s1"]),
+        ("**/s1+!vol/", ["s1", "ns1/svc/s1"]),
+        ("ns1/**", ["ns1/svc/s1", "ns1/cfg/web"]),
+        ("env=PRD", ["s1", "ns1/svc/s1"]),
+        ("!env=PRD+*", ["s2"]),
+        ("fs.type=xfs", ["s1"]),
+        ("fs:", ["s1"]),
+        (".avail=up+**/s1", ["s1", "vol/s1", "ns1/svc/s1"]),
+        ("vol/s1", ["vol/s1"]),
+        ("a/b/c/d", []),
+        ("", []),
+    ])
+    def test_select(selector, expected):
+        assert select(SelectorIndex(), selector) == expected
+
+    @staticmethod
+    def test_namespace_restrictions():
+        index = SelectorIndex()
+        assert select(index, "**", namespaces=["ns1"]) == ["ns1/svc/s1", "ns1/cfg/web"]
+        assert select(index, "s*", namespace="ns1") == ["ns1/svc/s1"]
+        assert select(index, "s1", namespace="ns2", namespaces=["ns1"]) == []
+
+    @staticmethod
+    def test_candidate_paths():
+        index = SelectorIndex()
+        assert select(index, "s*", paths=["s2"]) == ["s2"]
+        assert select(index, "s*", paths=["s3"]) == ["s3"]
+        assert select(index, "env=PRD", paths=["s2"]) == []
+
+    @staticmethod
+    def test_index_follows_agg_changes():
+        index = SelectorIndex()
+        assert select(index, "s*") == ["s1", "s2"]
+        agg = dict(AGG)
+        agg["s3"] = Storage({"avail": "down"})
+        assert select(index, "s*", agg=agg) == ["s1", "s2", "s3"]
+        assert select(index, ".avail=down", agg=agg) == ["s2", "s3"]
+        agg = dict(agg)
+        agg["s3"] = Storage({"avail": "up"})
+        assert select(index, ".avail=down", agg=agg) == ["s2"]
+
+    @staticmethod
+    def test_compiled_selectors_are_cached():
+        index = SelectorIndex()
+        select(index, "s*+env=PRD")
+        compiled = index.compiled[("s*+env=PRD", None)]
+        select(index, "s*+env=PRD")
+        assert index.compiled[("s*+env=PRD", None)] is compiled
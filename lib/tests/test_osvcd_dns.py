@@ -0,0 +1,163 @@
+import json
+import logging
+import socket
+
+import pytest
+
+import osvcd_shared as shared
+from osvcd_dns import Dns, RecordIndex
+from storage import Storage
+
+
+class FakeNode(object):
+    dns = ["10.0.0.53"]
+    dnsnodes = ["n1"]
+
+
+def instance(addr, updated=1, hostname=None, expose=None, scaler_slave=False):
+    info = {"ipaddr": addr}
+    if hostname:
+        info["hostname"] = hostname
+    if expose:
+        info["expose"] = expose
+    return {
+        "updated": updated,
+        "scaler_slave": scaler_slave,
+        "resources": {"ip#0": {"info": info}},
+    }
+
+
+@pytest.fixture(scope="function")
+def cluster(mocker):
+    data = {
+        "n1": {
+            "stats": {"score": 50},
+            "services": {"status": {
+                "ns1/svc/web": instance("10.0.0.1", hostname="www.example.com", expose=["80/tcp"]),
+                "db": instance("10.0.0.2"),
+                "ns1/vol/web": {"updated": 1, "resources": {}},
+            }},
+        },
+        "n2": {
+            "stats": {"score": 20},
+            "services": {"status": {
+                "ns1/svc/web": instance("10.0.0.1", expose=["80/tcp"]),
+            }},
+        },
+    }
+    gens = {"n1": 1, "n2": 1}
+    mocker.patch.object(shared, "CLUSTER_DATA", data)
+    mocker.patch.object(shared, "NODE", FakeNode())
+    mocker.patch.object(Dns, "cluster_name", "c1")
+    mocker.patch.object(Dns, "cluster_nodes", ["n1", "n2"])
+    mocker.patch.object(Dns, "get_gen", staticmethod(lambda inc=False: dict(gens)))
+    dns = Dns()
+    dns.log = logging.getLogger("test_osvcd_dns")
+    dns.zone = "c1."
+    dns.suffix = ".c1."
+    dns.suffix_len = 4
+    dns.index = RecordIndex("c1", log=dns.log)
+    dns.stats = Storage({"sessions": Storage({"accepted": 0, "tx": 0, "rx": 0})})
+    dns.clients = {}
+    dns.soa_content = "soa"
+    return dns, data, gens
+
+
+def lookup(dns, qtype, qname):
+    return sorted(rec["content"] for rec in dns.action_lookup({"qtype": qtype, "qname": qname}))
+
+
+@pytest.mark.ci
+class TestRecordIndex:
+    @staticmethod
+    def test_lookups(cluster):
+        dns, data, gens = cluster
+        assert lookup(dns, "A", "web.ns1.svc.c1.") == ["10.0.0.1"]
+        assert lookup(dns, "A", "10-0-0-1.web.ns1.svc.c1.") == ["10.0.0.1"]
+        assert lookup(dns, "A", "www.web.ns1.svc.c1.") == ["10.0.0.1"]
+        assert lookup(dns, "A", "db.root.svc.c1.") == ["10.0.0.2"]
+        assert lookup(dns, "A", "n1.c1.") == ["10.0.0.53"]
+        assert lookup(dns, "A", "unknown.root.svc.c1.") == []
+        assert lookup(dns, "PTR", "1.0.0.10.in-addr.arpa.") == ["web.ns1.svc.c1.", "www.web.ns1.svc.c1."]
+        assert lookup(dns, "PTR", "2.0.0.10.in-addr.arpa.") == ["db.root.svc.c1."]
+        assert dns.soa_records_rev() == ["0.0.10.in-addr.arpa."]
+
+    @staticmethod
+    def test_srv_served_once_per_target(cluster):
+        dns, data, gens = cluster
+        # the first node in the cluster nodes order gives the weight
+        assert lookup(dns, "SRV", "_80._tcp.web.ns1.svc.c1.") == ["0 50 80 10-0-0-1.web.ns1.svc.c1."]
+        assert lookup(dns, "SRV", "_http._tcp.web.ns1.svc.c1.") == ["0 50 80 10-0-0-1.web.ns1.svc.c1."]
+        # the score changes apply without reindex
+        data["n1"]["stats"]["score"] = 70
+        assert lookup(dns, "SRV", "_80._tcp.web.ns1.svc.c1.") == ["0 70 80 10-0-0-1.web.ns1.svc.c1."]
+        del data["n1"]["services"]["status"]["ns1/svc/web"]
+        gens["n1"] += 1
+        assert lookup(dns, "SRV", "_80._tcp.web.ns1.svc.c1.") == ["0 20 80 10-0-0-1.web.ns1.svc.c1."]
+
+    @staticmethod
+    def test_only_changed_instances_are_reindexed(cluster, mocker):
+        dns, data, gens = cluster
+        lookup(dns, "A", "db.root.svc.c1.")
+        spy = mocker.spy(dns.index, "instance_records")
+        # no gen change
+        data["n1"]["services"]["status"]["db"] = instance("10.0.0.3", updated=2)
+        assert lookup(dns, "A", "db.root.svc.c1.") == ["10.0.0.2"]
+        assert spy.call_count == 0
+        gens["n1"] += 1
+        assert lookup(dns, "A", "db.root.svc.c1.") == ["10.0.0.3"]
+        assert spy.call_count == 1
+        assert lookup(dns, "PTR", "2.0.0.10.in-addr.arpa.") == []
+        assert "10-0-0-2.db.root.svc.c1." not in dns.a_records()
+
+    @staticmethod
+    def test_shared_records_refcount(cluster):
+        dns, data, gens = cluster
+        assert lookup(dns, "A", "web.ns1.svc.c1.") == ["10.0.0.1"]
+        del data["n2"]
+        del gens["n2"]
+        assert lookup(dns, "A", "web.ns1.svc.c1.") == ["10.0.0.1"]
+        dns.cluster_nodes.remove("n1")
+        assert lookup(dns, "A", "web.ns1.svc.c1.") == []
+        assert dns.index.a == {}
+        assert dns.index.srv == {}
+        assert dns.index.ptr == {}
+        assert dns.index.rev == {}
+
+    @staticmethod
+    def test_list(cluster):
+        dns, data, gens = cluster
+        records = dns.action_list({"zonename": "c1."})
+        assert records[0]["qtype"] == "SOA"
+        assert set((rec["qtype"], rec["qname"]) for rec in records[1:]) >= set([
+            ("A", "web.ns1.svc.c1."),
+            ("A", "n1.c1."),
+            ("SRV", "_80._tcp.web.ns1.svc.c1."),
+        ])
+
+
+@pytest.mark.ci
+class TestDnsConnections:
+    @staticmethod
+    def test_persistent_connection_pipelined_requests(cluster):
+        dns = cluster[0]
+        server, client = socket.socketpair()
+        dns.clients[server] = b""
+        requests = [
+            {"method": "initialize", "parameters": {}},
+            {"method": "lookup", "parameters": {"qtype": "A", "qname": "db.root.svc.c1."}},
+        ]
+        buff = "".join(json.dumps(req) + "\n" for req in requests).encode()
+        # a request split across two reads
+        client.sendall(buff[:-10])
+        dns.receive(server)
+        client.sendall(buff[-10:])
+        dns.receive(server)
+        replies = client.recv(65536).decode().splitlines()
+        assert json.loads(replies[0]) == {"result": True}
+        assert json.loads(replies[1])["result"][0]["content"] == "10.0.0.2"
+        # idle connections are kept
+        assert server in dns.clients
+        client.close()
+        dns.receive(server)
+        assert server not in dns.clients
@@ -0,0 +1,387 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from six.moves import queue
+
+import handlerGetEvents
+import handlerGetWhoami
+import osvcd_shared as shared
+from comm import Crypt
+from osvcd_lsnr import ClientHandler, EventMessage, Listener, Workers
+from peerpool import PeerPool
+from rcGlobalEnv import rcEnv
+from rcUtilities import set_lazy
+from storage import Storage
+
+
+class EventsClient(object):
+    h2conn = None
+
+    def __init__(self, selector=None, grants=None):
+        self.selector = selector
+        self.usr = False if grants is None else "usr"
+        self.usr_grants = grants if grants is not None else {"root": None}
+        self.event_queue = queue.Queue()
+
+    def get_namespaces(self):
+        return set(self.usr_grants.get("guest") or ["root", "ns1"])
+
+
+@pytest.fixture(scope='function')
+def listener():
+    obj = Listener()
+    obj.events_grace_period = False
+    obj.clients = set()
+    obj.events_clients = []
+    return obj
+
+
+@pytest.mark.ci
+class TestListenerEvents:
+    @staticmethod
+    def test_same_filter_clients_share_the_filtered_event(listener, mocker):
+        match = mocker.patch.object(Listener, "match_object_selector", side_effect=lambda sel, namespaces=None, path=None: path == "ns1/svc/s1")
+        clients = [EventsClient("ns1/svc/s1", {"guest": set(["ns1"])}) for _ in range(10)]
+        root = EventsClient()
+        listener.events_clients = clients + [root]
+        listener.clients = set(listener.events_clients)
+        event = {
+            "kind": "patch",
+            "data": [
+                [["monitor", "services", "ns1/svc/s1", "avail"], "up"],
+                [["monitor", "services", "ns1/svc/s2", "avail"], "up"],
+            ],
+        }
+        shared.EVENT_Q.put(event)
+        listener.janitor_events()
+
+        messages = [client.event_queue.get(False) for client in clients]
+        assert all(msg is messages[0] for msg in messages)
+        assert json.loads(messages[0].json)["data"] == [[["monitor", "services", "ns1/svc/s1", "avail"], "up"]]
+        assert match.call_count == 2
+        # the source event is not modified by the filtering
+        assert len(event["data"]) == 2
+        assert json.loads(root.event_queue.get(False).json) == event
+
+    @staticmethod
+    def test_event_message_encodings_are_cached():
+        msg = EventMessage({"kind": "event"})
+        assert msg.raw() is msg.raw()
+        assert json.loads(msg.raw()[:-1].decode()) == {"kind": "event"}
+
+    @staticmethod
+    def test_encrypted_event_message_decrypts_to_a_dict():
+        crypt = Crypt()
+        crypt.log = logging.getLogger("test_osvcd_lsnr")
+        set_lazy(crypt, "cluster_name", "test")
+        set_lazy(crypt, "cluster_names", set(["test"]))
+        set_lazy(crypt, "cluster_drpnodes", [])
+        set_lazy(crypt, "cluster_key", Crypt.prepare_key("0123456789abcdef0123456789abcdef"))
+        msg = EventMessage({"a": 1, "kind": "event"})
+        assert msg.encrypted(crypt) is msg.encrypted(crypt)
+        data = crypt.decrypt(msg.encrypted(crypt)[:-1])[2]
+        assert data == {"a": 1, "kind": "event"}
+
+
+@pytest.fixture(scope="function")
+def ux_listener(tmpdir, mocker):
+    while not shared.EVENT_Q.empty():
+        shared.EVENT_Q.get()
+    handlers = {}
+    for handler in (handlerGetEvents.Handler(), handlerGetWhoami.Handler()):
+        for route in handler.routes:
+            handlers[route] = handler
+    mocker.patch.object(Listener, "handlers", handlers)
+    obj = Listener()
+    mocker.patch.object(obj, "reload_config")
+    obj.log = logging.getLogger("test_osvcd_lsnr")
+    obj.events_grace_period = False
+    obj.last_janitors = time.time() + 3600
+    obj.sock_tmo = 0.05
+    obj.clients = set()
+    obj.events_clients = []
+    obj.workers = Workers(4, obj.log, maxblocking=2)
+    obj.stats = Storage(sessions=Storage(accepted=0, auth_validated=0, tx=0, rx=0,
+                                         alive=Storage(), clients=Storage()))
+    obj.setup_wake()
+    path = os.path.join(str(tmpdir), "lsnr.sock")
+    obj.sockux = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    obj.sockux.bind(path)
+    obj.sockux.listen(8)
+    obj.sockmap = {obj.sockux.fileno(): obj.sockux}
+    yield obj, path
+    for client in list(obj.clients):
+        client.close()
+    obj.workers.stop()
+    obj.sockux.close()
+    os.close(obj.wake_r)
+    os.close(obj.wake_w)
+
+
+def loop(listener, cond, timeout=5):
+    limit = time.time() + timeout
+    while not cond():
+        assert time.time() < limit, "condition not met in time"
+        listener.do()
+
+
+def wait(cond, timeout=5):
+    limit = time.time() + timeout
+    while not cond():
+        assert time.time() < limit, "condition not met in time"
+        time.sleep(0.01)
+
+
+def ux_connect(path, data):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect(path)
+    sock.sendall((json.dumps(data) + "\0").encode())
+    return sock
+
+
+def recv_message(sock):
+    buff = b""
+    while not buff.endswith(b"\0"):
+        data = sock.recv(4096)
+        if not data:
+            break
+        buff += data
+    return json.loads(buff[:-1].decode())
+
+
+@pytest.mark.ci
+class TestListenerLoop:
+    @staticmethod
+    def test_accept_serve_close(ux_listener):
+        listener, path = ux_listener
+        sock = ux_connect(path, {"action": "whoami"})
+        try:
+            loop(listener, lambda: listener.stats.sessions.accepted == 1)
+            # the worker is released once the client is served
+            loop(listener, lambda: listener.workers.done == 1)
+            assert not listener.clients
+            assert listener.workers.busy == 0
+            assert recv_message(sock)["name"] == "root"
+            # the connection is closed by the listener after the result
+            assert sock.recv(4096) == b""
+        finally:
+            sock.close()
+
+    @staticmethod
+    def test_raw_events_streaming(ux_listener):
+        listener, path = ux_listener
+        sock = ux_connect(path, {"action": "events"})
+        try:
+            loop(listener, lambda: listener.stats.sessions.accepted == 1)
+            client = list(listener.clients)[0]
+            loop(listener, lambda: listener.workers.done == 1)
+            assert client.raw_events
+            assert listener.events_clients == [client]
+
+            # no event queued: the client is not dispatched to the workers
+            done = listener.workers.done
+            for _ in range(5):
+                listener.do()
+            assert listener.workers.done == done
+
+            shared.queue_event({"kind": "event", "data": {"n": 1}})
+            loop(listener, lambda: listener.workers.done > done)
+            assert recv_message(sock) == {"kind": "event", "data": {"n": 1}}
+
+            # the client hangs up
+            sock.close()
+            loop(listener, lambda: not listener.clients)
+            assert client.closed
+        finally:
+            sock.close()
+
+
+@pytest.mark.ci
+class TestWorkers:
+    @staticmethod
+    def run_long_poll(workers, started, release):
+        with workers.long_poll():
+            started.set()
+            release.wait(5)
+
+    def test_long_poll_releases_the_worker(self):
+        workers = Workers(1, logging.getLogger("test_osvcd_lsnr"), maxblocking=1)
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+        try:
+            workers.submit(self.run_long_poll, workers, started, release)
+            assert started.wait(5)
+            workers.submit(done.set)
+            # served by a new worker while the long poll waits
+            assert done.wait(5)
+            assert workers.status()["blocking"] == 1
+            assert len(workers.threads) == 2
+        finally:
+            release.set()
+        limit = time.time() + 5
+        while workers.blocking and time.time() < limit:
+            time.sleep(0.01)
+        assert workers.blocking == 0
+        workers.stop()
+
+    def test_long_polls_over_the_limit_hold_their_worker(self):
+        workers = Workers(1, logging.getLogger("test_osvcd_lsnr"), maxblocking=0)
+        started, release, done = threading.Event(), threading.Event(), threading.Event()
+        try:
+            workers.submit(self.run_long_poll, workers, started, release)
+            assert started.wait(5)
+            workers.submit(done.set)
+            assert not done.wait(0.2)
+            assert len(workers.threads) == 1
+        finally:
+            release.set()
+        assert done.wait(5)
+        workers.stop()
+
+
+class PeerConn(object):
+    connect_error = None
+
+    def __init__(self, nodename):
+        self.nodename = nodename
+        self.closed = False
+
+    def connect(self):
+        if self.connect_error:
+            raise self.connect_error
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(scope="function")
+def client_handler(mocker):
+    obj = ClientHandler.__new__(ClientHandler)
+    obj.parent = Storage(peer_pool=PeerPool(PeerConn))
+    obj.log = logging.getLogger("test_osvcd_lsnr")
+    mocker.patch.object(ClientHandler, "socket_parms", return_value=Storage(af=socket.AF_INET))
+    return obj
+
+
+@pytest.mark.ci
+class TestMultiplex:
+    @staticmethod
+    def test_fanout_serves_the_nodes_concurrently(client_handler):
+        nodenames = [rcEnv.nodename] + ["peer%d" % idx for idx in range(6)]
+
+        def fn(nodename):
+            time.sleep(0.2)
+            return {"status": 0, "node": nodename}
+
+        begin = time.time()
+        results = client_handler.fanout(nodenames, fn)
+        assert time.time() - begin < 0.8
+        assert list(results) == nodenames
+        assert all(results[nodename]["node"] == nodename for nodename in nodenames)
+
+    @staticmethod
+    def test_fanout_returns_partial_results_at_deadline(client_handler):
+        def fn(nodename):
+            if nodename == "slow":
+                time.sleep(2)
+            elif nodename == "bad":
+                raise Exception("unreachable")
+            return {"status": 0}
+
+        begin = time.time()
+        results = client_handler.fanout(["peer1", "slow", "bad"], fn, timeout=0.2)
+        assert time.time() - begin < 1
+        assert results["peer1"] == {"status": 0}
+        assert results["slow"]["status"] == 1
+        assert results["bad"] == {"status": 1, "error": "unreachable"}
+
+    @staticmethod
+    def test_fanout_raises_the_local_node_errors(client_handler):
+        def fn(nodename):
+            raise ValueError(nodename)
+
+        with pytest.raises(ValueError):
+            client_handler.fanout([rcEnv.nodename, "peer1"], fn)
+
+    @staticmethod
+    def test_peer_request_reuses_the_connection(client_handler, mocker):
+        conns = []
+        mocker.patch.object(ClientHandler, "h2_conn_request", side_effect=lambda conn, *a, **kw: conns.append(conn) or {"status": 0})
+        for _ in range(3):
+            assert client_handler.peer_request({"action": "whoami"}, "peer1") == {"status": 0}
+        assert len(set(conns)) == 1
+
+    @staticmethod
+    def test_peer_request_retries_on_a_stale_connection(client_handler, mocker):
+        pool = client_handler.parent.peer_pool
+        stale = PeerConn("peer1")
+        pool.release("peer1", stale)
+
+        def request(conn, *args, **kwargs):
+            if conn is stale:
+                raise socket.error("connection reset")
+            return {"status": 0}
+
+        mocker.patch.object(ClientHandler, "h2_conn_request", side_effect=request)
+        assert client_handler.peer_request({"action": "whoami"}, "peer1") == {"status": 0}
+        assert stale.closed
+        assert pool.count() == {"peer1": 1}
+
+    @staticmethod
+    def test_peer_request_uses_the_raw_relay_if_no_h2(client_handler, mocker):
+        mocker.patch.object(PeerConn, "connect_error", socket.error("connection refused"))
+        raw = mocker.patch.object(ClientHandler, "daemon_request", return_value={"status": 0, "raw": True})
+        assert client_handler.peer_request({"action": "whoami"}, "peer1", method="POST") == {"status": 0, "raw": True}
+        raw.assert_called_once_with({"action": "whoami"}, server="peer1", silent=True, method="POST")
+        assert client_handler.parent.peer_pool.count() == {}
+
+
+@pytest.mark.ci
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is linux only")
+class TestLogsFollow:
+    @staticmethod
+    def test_log_writes_and_rotations_bump_the_log_gen(tmpdir, listener):
+        listener.log = logging.getLogger("test_osvcd_lsnr")
+        listener.setup_wake()
+        listener.init_logs_watch()
+        logfile = os.path.join(str(tmpdir), "node.log")
+        with open(logfile, "w"):
+            pass
+        try:
+            assert listener.watch_log(logfile) is True
+            gen = listener.log_gen(logfile)
+            with open(logfile, "a") as filep:
+                filep.write("line\n")
+            wait(lambda: listener.log_gen(logfile) > gen)
+            gen = listener.log_gen(logfile)
+            os.rename(logfile, logfile + ".1")
+            wait(lambda: listener.log_gen(logfile) > gen)
+            assert listener.log_gen(logfile + ".1") is None
+        finally:
+            listener.logs_watch.stop()
+            os.close(listener.wake_r)
+            os.close(listener.wake_w)
+
+    @staticmethod
+    def test_watched_log_pushers_are_polled_on_change(tmpdir, client_handler):
+        logfile = os.path.join(str(tmpdir), "node.log")
+        gens = {logfile: 1}
+        client_handler.parent.log_gen = gens.get
+        client_handler.h2conn = True
+        with open(logfile, "w") as ofile:
+            pusher = {"fn": "h2_push_logs", "args": [ofile, True], "watched": True}
+            client_handler.streams = {1: {"pushers": [pusher]}}
+            assert client_handler.has_polled_pushers() is True
+            pusher["gen"] = 1
+            assert client_handler.has_polled_pushers() is False
+            gens[logfile] = 2
+            assert client_handler.has_polled_pushers() is True
+            pusher["watched"] = False
+            gens[logfile] = 1
+            assert client_handler.has_polled_pushers() is True
@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+
+import pytest
+
+import osvcd_shared as shared
+from osvcd_mon import Monitor
+from rcGlobalEnv import rcEnv
+from rcUtilities import svc_pathvar
+from statustree import StatusTree
+from storage import Storage
+
+
+def write_status(path, avail, mtime):
+    fpath = svc_pathvar(path, "status.json")
+    if not os.path.exists(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    with open(fpath, "w") as filep:
+        json.dump({"avail": avail, "updated": mtime, "resources": {}}, filep)
+    os.utime(fpath, (mtime, mtime))
+
+
+@pytest.fixture(scope="function")
+def monitor(osvc_path_tests, mocker):
+    mocker.patch.object(shared, "NODE_DATA_TREE", StatusTree(tracked=shared.NODE_DATA_TREE.tracked))
+    mocker.patch.object(shared, "CLUSTER_DATA", {rcEnv.nodename: {"services": {"status": {}, "config": {}}}})
+    mocker.patch.object(shared, "SERVICES", {"svc1": Storage(frozen=lambda: 0)})
+    mocker.patch.object(shared, "LOCAL_GEN", {"peer1": 1})
+    mocker.patch.object(shared, "GEN_DIFF", {})
+    mocker.patch.object(shared, "MON_CHANGED", [])
+    mocker.patch.object(shared.NMON_DATA, "status", "idle")
+    obj = Monitor()
+    obj.log = logging.getLogger("test_osvcd_mon")
+    mocker.patch.object(obj, "get_service_monitor", return_value=Storage(status="idle"))
+    mocker.patch.object(obj, "set_smon_l_expect_from_status")
+    mocker.patch.object(obj, "purge_log")
+    mocker.patch.object(obj, "update_daemon_status")
+    return obj
+
+
+def loop(monitor):
+    """
+    The services status part of a monitor loop.
+    """
+    data = shared.CLUSTER_DATA[rcEnv.nodename]
+    data["services"]["status"] = monitor.get_services_status(["svc1"])
+    gens = set(shared.GEN_DIFF)
+    monitor.update_hb_data()
+    return [shared.GEN_DIFF[gen] for gen in set(shared.GEN_DIFF) - gens]
+
+
+@pytest.mark.ci
+class TestMonitorGenDiff:
+    @staticmethod
+    def test_instance_status_change_produces_a_gen_diff(monitor):
+        write_status("svc1", "up", 1000000000.0)
+        # first run: full dataset, no diff
+        assert loop(monitor) == []
+
+        # unchanged status.json
+        assert loop(monitor) == []
+
+        write_status("svc1", "down", 1000000010.0)
+        diffs = loop(monitor)
+        assert len(diffs) == 1
+        changes = dict((tuple(change[0]), change[1]) for change in diffs[0] if len(change) == 2)
+        assert changes[("services", "status", "svc1", "avail")] == "down"
+        assert changes[("services", "status", "svc1", "updated")] == 1000000010.0
+
+        # unchanged again
+        assert loop(monitor) == []
@@ -0,0 +1,159 @@
+import copy
+import datetime
+import logging
+
+import pytest
+
+import osvcd_shared as shared
+from osvcd_scheduler import Scheduler
+from rcGlobalEnv import rcEnv
+from storage import Storage
+
+
+@pytest.mark.ci
+class TestSchedulerLasts:
+    @staticmethod
+    def test_get_lasts_merges_peers_without_modifying_cluster_data(mocker):
+        cluster_data = {
+            "n1": {"services": {"status": {"svc1": {"resources": {
+                "sync#1": {"info": {"sched": {"sync_update": {"last": 10}}}},
+            }}}}},
+            "n2": {"services": {"status": {"svc1": {"resources": {
+                "sync#1": {"info": {"sched": {"sync_update": {"last": 20}, "sync_all": {"last": 5}}}},
+            }}}}},
+        }
+        mocker.patch.object(shared, "CLUSTER_DATA", cluster_data)
+        orig = copy.deepcopy(cluster_data)
+        svc = Storage(path="svc1", peers=["n1", "n2"])
+        lasts = Scheduler().get_lasts(svc)
+        assert lasts == {"sync#1": {"sync_update": {"last": 20}, "sync_all": {"last": 5}}}
+        assert cluster_data == orig
+
+
+class FakeSched(object):
+    scheduler_actions = {"status": None}
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.computed = []
+        self.validated = []
+
+    def get_next_schedule(self, action, now=None, lasts=None):
+        self.computed.append((action, now))
+        return {"next_sched": now + datetime.timedelta(seconds=self.interval)}
+
+    def validate_action(self, action, lasts=None, now=None):
+        self.validated.append((action, now))
+        return 0
+
+
+class FakeSvc(object):
+    def __init__(self, path, interval=600):
+        self.path = path
+        self.peers = [rcEnv.nodename]
+        self.options = Storage()
+        self.sched = FakeSched(interval)
+
+    def configure_scheduler(self):
+        pass
+
+
+NOW = 1500000000
+
+
+@pytest.fixture(scope="function")
+def scheduler(mocker):
+    mocker.patch.object(shared, "NODE", None)
+    mocker.patch.object(shared, "SERVICES", {"svc1": FakeSvc("svc1")})
+    mocker.patch.object(shared, "AGG", {"svc1": Storage(provisioned=True)})
+    mocker.patch.object(shared, "CLUSTER_DATA", {rcEnv.nodename: {"services": {"status": {"svc1": {"resources": {}}}}}})
+    obj = Scheduler()
+    obj.log = logging.getLogger("test_osvcd_scheduler")
+    obj.delayed = {}
+    obj.running = set()
+    obj.now = NOW
+    return obj
+
+
+@pytest.mark.ci
+class TestSchedulerHeap:
+    @staticmethod
+    def test_due_tasks_are_popped_and_pushed_again(scheduler):
+        svc = shared.SERVICES["svc1"]
+        scheduler.janitor_next_fires(NOW)
+        assert scheduler.next_fires == {("svc1", "status"): NOW + 600}
+
+        # not yet due
+        scheduler.run_scheduler(NOW + 599)
+        assert svc.sched.validated == []
+
+        scheduler.run_scheduler(NOW + 600)
+        assert svc.sched.validated == [("status", NOW + 600)]
+        assert ("status", "svc1", None) in scheduler.delayed
+        # the next run search starts at the next scheduler run time
+        assert scheduler.next_fires == {("svc1", "status"): NOW + 600 + 60 + 600}
+        assert [entry[2] for entry in scheduler.heap] == [("svc1", "status")]
+
+    @staticmethod
+    def test_outdated_heap_entries_are_skipped(scheduler):
+        svc = shared.SERVICES["svc1"]
+        scheduler.sched_objs["svc1"] = svc
+        scheduler.push_next_fire("svc1", "status", NOW + 100)
+        scheduler.push_next_fire("svc1", "status", NOW + 200)
+        assert len(scheduler.heap) == 2
+
+        scheduler.run_scheduler(NOW + 150)
+        assert svc.sched.validated == []
+        assert scheduler.heap == [(NOW + 200, 1, ("svc1", "status"))]
+
+        scheduler.run_scheduler(NOW + 200)
+        assert svc.sched.validated == [("status", NOW + 200)]
+
+    @staticmethod
+    def test_config_and_lasts_changes_trigger_a_recompute(scheduler):
+        scheduler.janitor_next_fires(NOW)
+        assert len(shared.SERVICES["svc1"].sched.computed) == 1
+
+        # unchanged
+        scheduler.janitor_next_fires(NOW + 30)
+        assert len(shared.SERVICES["svc1"].sched.computed) == 1
+
+        # the object was rebuilt after a configuration change
+        shared.SERVICES["svc1"] = FakeSvc("svc1", interval=300)
+        scheduler.janitor_next_fires(NOW + 60)
+        assert len(shared.SERVICES["svc1"].sched.computed) == 1
+        assert scheduler.next_fires == {("svc1", "status"): NOW + 60 + 300}
+
+        # a peer reported a task run
+        shared.CLUSTER_DATA[rcEnv.nodename]["services"]["status"]["svc1"]["resources"] = {
+            "app#1": {"info": {"sched": {"status": {"last": NOW + 70}}}},
+        }
+        scheduler.janitor_next_fires(NOW + 90)
+        assert len(shared.SERVICES["svc1"].sched.computed) == 2
+        assert scheduler.next_fires == {("svc1", "status"): NOW + 90 + 300}
+
+    @staticmethod
+    def test_deleted_objects_are_purged(scheduler):
+        svc = shared.SERVICES["svc1"]
+        scheduler.janitor_next_fires(NOW)
+        del shared.SERVICES["svc1"]
+        scheduler.janitor_next_fires(NOW + 30)
+        assert scheduler.sched_objs == {}
+        assert scheduler.sched_lasts == {}
+        assert scheduler.next_fires == {}
+        # the remaining heap entry is outdated
+        scheduler.run_scheduler(NOW + 600)
+        assert svc.sched.validated == []
+        assert scheduler.heap == []
+
+    @staticmethod
+    def test_reconfigure_resets_the_heap(scheduler):
+        scheduler.janitor_next_fires(NOW)
+        scheduler.reconfigure()
+        assert scheduler.heap == []
+        assert scheduler.next_fires == {}
+        assert scheduler.sched_objs == {}
+        # the next janitor recomputes the next runs
+        scheduler.janitor_next_fires(NOW + 30)
+        assert scheduler.next_fires == {("svc1", "status"): NOW + 30 + 600}
+        assert len(scheduler.heap) == 1
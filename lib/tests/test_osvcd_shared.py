@@ -0,0 +1,153 @@
+import json
+
+import json_delta
+import pytest
+
+import osvcd_shared as shared
+from statustree import StatusTree
+
+
+def instance(avail="up"):
+    return {"avail": avail, "resources": {"fs#1": {"status": avail}}}
+
+
+def live_data():
+    return {
+        "monitor": {
+            "nodes": {
+                "node1": {
+                    "stats": {"load": 1},
+                    "services": {
+                        "status": {"svc1": instance(), "svc2": instance()},
+                        "config": {},
+                    },
+                },
+            },
+        },
+    }
+
+
+class FakeThread(shared.OsvcThread):
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def object_selector(selector=None, namespace=None, namespaces=None, paths=None):
+        return [path for path in ("svc1", "svc2") if selector in ("**", path)]
+
+
+@pytest.fixture(scope="function")
+def daemon_status(mocker):
+    tree = StatusTree()
+    mocker.patch.object(shared, "DAEMON_STATUS_PATCHES", shared.collections.deque(maxlen=3))
+    mocker.patch.object(shared, "PATCH_ID", 0)
+
+    def update(data):
+        diff = tree.update(data)
+        if diff:
+            shared.PATCH_ID += 1
+            shared.DAEMON_STATUS_PATCHES.append((shared.PATCH_ID, diff))
+        mocker.patch.object(shared, "LAST_DAEMON_STATUS", tree.data)
+
+    return update
+
+
+def patched(data, patch):
+    return json_delta.patch(json.loads(json.dumps(data)), json.loads(json.dumps(patch)))
+
+
+@pytest.mark.ci
+class TestInstancesStatus:
+    @staticmethod
+    def test_full_then_patches(daemon_status):
+        thr = FakeThread()
+        data = live_data()
+        daemon_status(data)
+        first = thr.instances_status(selector="svc1")
+        assert first["full"] is True
+        assert first["data"] == {"svc1": {"node1": instance()}}
+
+        # unchanged
+        second = thr.instances_status(selector="svc1", etag=first["etag"])
+        assert second == {"etag": first["etag"], "full": False, "patch": []}
+
+        # changes on a selected instance, an unselected instance and
+        # outside the instances status
+        data["monitor"]["nodes"]["node1"]["services"]["status"]["svc1"] = instance("down")
+        data["monitor"]["nodes"]["node1"]["services"]["status"]["svc2"] = instance("down")
+        data["monitor"]["nodes"]["node1"]["stats"]["load"] = 2
+        daemon_status(data)
+        third = thr.instances_status(selector="svc1", etag=second["etag"])
+        assert third["full"] is False
+        assert third["etag"] != second["etag"]
+        assert patched(first["data"], third["patch"]) == {"svc1": {"node1": instance("down")}}
+
+    @staticmethod
+    def test_new_node_instance_patch(daemon_status):
+        thr = FakeThread()
+        data = live_data()
+        daemon_status(data)
+        first = thr.instances_status()
+        data["monitor"]["nodes"]["node1"]["services"]["status"]["svc1"] = instance("down")
+        daemon_status(data)
+        data["monitor"]["nodes"]["node1"]["services"]["status"]["svc2"] = instance("warn")
+        daemon_status(data)
+        second = thr.instances_status(etag=first["etag"])
+        assert second["full"] is False
+        assert patched(first["data"], second["patch"]) == thr.instances_status()["data"]
+
+    @staticmethod
+    def test_full_when_the_patches_are_lost(daemon_status):
+        thr = FakeThread()
+        data = live_data()
+        daemon_status(data)
+        first = thr.instances_status()
+        for load in range(5):
+            data["monitor"]["nodes"]["node1"]["stats"]["load"] = load + 10
+            daemon_status(data)
+        assert thr.instances_status(etag=first["etag"])["full"] is True
+
+    @staticmethod
+    def test_full_when_the_selection_changes(daemon_status):
+        thr = FakeThread()
+        daemon_status(live_data())
+        first = thr.instances_status(selector="svc1")
+        assert thr.instances_status(selector="**", etag=first["etag"])["full"] is True
+
+    @staticmethod
+    def test_full_when_a_node_is_added(daemon_status):
+        thr = FakeThread()
+        data = live_data()
+        daemon_status(data)
+        first = thr.instances_status()
+        data["monitor"]["nodes"]["node2"] = {"services": {"status": {"svc1": instance()}}}
+        daemon_status(data)
+        second = thr.instances_status(etag=first["etag"])
+        assert second["full"] is True
+        assert second["data"]["svc1"] == {"node1": instance(), "node2": instance()}
+
+    @staticmethod
+    def test_full_when_the_daemon_restarted(daemon_status, mocker):
+        thr = FakeThread()
+        data = live_data()
+        daemon_status(data)
+        first = thr.instances_status()
+        # the restarted daemon patch ids catch up with the client etag gen,
+        # with an instance change patch after the etag gen
+        mocker.patch.object(shared, "DAEMON_STATUS_EPOCH", "restarted")
+        mocker.patch.object(shared, "PATCH_ID", 0)
+        shared.DAEMON_STATUS_PATCHES.clear()
+        daemon_status(live_data())
+        data = live_data()
+        data["monitor"]["nodes"]["node1"]["services"]["status"]["svc1"] = instance("down")
+        daemon_status(data)
+        second = thr.instances_status(etag=first["etag"])
+        assert second["full"] is True
+        assert second["data"]["svc1"] == {"node1": instance("down")}
+        assert second["etag"].startswith("restarted-")
+
+    @staticmethod
+    @pytest.mark.parametrize("etag", ["", "foo", "x-y", "99-abc", "x-1-abc"])
+    def test_invalid_etag(daemon_status, etag):
+        daemon_status(live_data())
+        assert FakeThread().instances_status(etag=etag)["full"] is True
@@ -0,0 +1,61 @@
+import pytest
+
+from peerpool import PeerPool
+
+
+class FakeConn(object):
+    def __init__(self, nodename):
+        self.nodename = nodename
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(scope="function")
+def pool():
+    return PeerPool(FakeConn, max_idle=2, idle_timeout=60)
+
+
+@pytest.mark.ci
+class TestPeerPool:
+    @staticmethod
+    def test_released_connections_are_reused(pool):
+        conn, reused = pool.acquire("node2")
+        assert not reused
+        pool.release("node2", conn)
+        assert pool.acquire("node2") == (conn, True)
+        other, reused = pool.acquire("node3")
+        assert other is not conn
+        assert not reused
+
+    @staticmethod
+    def test_idle_connections_are_bounded(pool):
+        conns = [pool.acquire("node2")[0] for _ in range(3)]
+        for conn in conns:
+            pool.release("node2", conn)
+        assert pool.count() == {"node2": 2}
+        assert [conn.closed for conn in conns] == [False, False, True]
+
+    @staticmethod
+    def test_expired_connections_are_closed(pool, mocker):
+        conn = pool.acquire("node2")[0]
+        pool.release("node2", conn)
+        mocker.patch("peerpool.time.time", return_value=pool.idle["node2"][0][1] + 61)
+        new, reused = pool.acquire("node2")
+        assert not reused
+        assert conn.closed
+
+    @staticmethod
+    def test_janitor_and_close(pool, mocker):
+        old = pool.acquire("node2")[0]
+        pool.release("node2", old)
+        mocker.patch("peerpool.time.time", return_value=pool.idle["node2"][0][1] + 61)
+        recent = pool.acquire("node3")[0]
+        pool.release("node3", recent)
+        pool.janitor()
+        assert old.closed
+        assert pool.count() == {"node3": 1}
+        pool.close()
+        assert recent.closed
+        assert pool.count() == {}
@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+import rcLogger
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.gate = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.gate.wait(5)
+        self.messages.append(self.format(record))
+
+
+@pytest.fixture(autouse=True)
+def enable_logging():
+    # other test modules disable the logging at import
+    disabled = logging.root.manager.disable
+    logging.disable(logging.NOTSET)
+    yield
+    logging.disable(disabled)
+
+
+@pytest.fixture(scope="function")
+def file_handler(tmpdir):
+    handler = rcLogger.OsvcFileHandler(os.path.join(str(tmpdir), "node.log"))
+    handler.setFormatter(rcLogger.OsvcFormatter("%(levelname)s %(context)s | %(message)s"))
+    handler.setLevel(logging.INFO)
+    yield handler
+    handler.close()
+
+
+def make_logger(name, handler):
+    log = logging.getLogger(name)
+    log.propagate = False
+    log.handlers = [handler]
+    log.setLevel(logging.DEBUG)
+    return log
+
+
+@pytest.mark.ci
+class TestQueueHandler:
+    @staticmethod
+    def test_records_are_written_in_order(file_handler):
+        stats = rcLogger.LogStats()
+        handler = rcLogger.QueueHandler([file_handler], stats=stats)
+        log = logging.LoggerAdapter(make_logger("test_rclogger.order", handler), {"component": "listener/1.2.3.4"})
+        args = ["mutable"]
+        log.info("message %s", args)
+        args.append("changed")
+        for idx in range(500):
+            log.info("line %d", idx)
+        log.debug("filtered")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            log.exception("error")
+        handler.close()
+        with open(file_handler.baseFilename) as filep:
+            lines = filep.read().splitlines()
+        assert lines[0] == "INFO c:listener/1.2.3.4 | message ['mutable']"
+        assert lines[1:501] == ["INFO c:listener/1.2.3.4 | line %d" % idx for idx in range(500)]
+        assert lines[501] == "ERROR c:listener/1.2.3.4 | error"
+        assert lines[-1] == "ValueError: boom"
+        assert stats.get("listener") == {"records": 502, "dropped": 0, "rate": 0.0}
+
+    @staticmethod
+    def test_full_queue_drops_without_blocking():
+        slow = SlowHandler()
+        stats = rcLogger.LogStats()
+        handler = rcLogger.QueueHandler([slow], maxsize=10, stats=stats)
+        log = make_logger("test_rclogger.full", handler)
+        begin = time.time()
+        for idx in range(100):
+            log.info("line %d", idx)
+        assert time.time() - begin < 1
+        dropped = stats.get("test_rclogger.full")["dropped"]
+        # the writer holds one batch, the queue holds 10 records
+        assert dropped >= 100 - 10 - rcLogger.BATCH_SIZE
+        assert dropped > 0
+        slow.gate.set()
+        handler.close()
+        assert len(slow.messages) == 100 - dropped
+
+    @staticmethod
+    def test_log_rate(mocker):
+        stats = rcLogger.LogStats()
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "msg", None, None)
+        now = [1000.0]
+        mocker.patch("rcLogger.time.time", side_effect=lambda: now[0])
+        for _ in range(30):
+            stats.add(record)
+        now[0] += rcLogger.STATS_WINDOW
+        assert stats.get("test")["rate"] == 30.0 / rcLogger.STATS_WINDOW
+        now[0] += 2 * rcLogger.STATS_WINDOW
+        assert stats.get("test")["rate"] == 0.0
+        assert stats.get("test")["records"] == 30
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import handlerGetRelaySlots
+import handlerPostRelayTx
+import osvcd_shared as shared
+from hb_relay import HbRelayRx
+
+
+def relay_tx(nodename, msg, cluster_id="c1"):
+    return handlerPostRelayTx.Handler().action(nodename, options={"cluster_id": cluster_id, "msg": msg})
+
+
+def relay_slots(**options):
+    return handlerGetRelaySlots.Handler().action("relay", options=options)
+
+
+@pytest.fixture(scope="function")
+def relay(mocker):
+    mocker.patch.object(shared, "RELAY_DATA", {})
+    mocker.patch.object(shared, "RELAY_GEN", 0)
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures("relay")
+class TestRelaySlots:
+    @staticmethod
+    def test_all_cluster_slots_are_returned():
+        relay_tx("n1", "m1")
+        relay_tx("n2", "m2")
+        relay_tx("n3", "m3", cluster_id="c2")
+        resp = relay_slots(cluster_id="c1")
+        assert resp["status"] == 0
+        assert resp["epoch"] == shared.RELAY_EPOCH
+        assert resp["gen"] == 3
+        assert sorted(resp["slots"]) == ["n1", "n2"]
+        assert resp["slots"]["n1"]["data"] == "m1"
+        assert sorted(relay_slots(cluster_id="c1", slots=["n2"])["slots"]) == ["n2"]
+
+    @staticmethod
+    def test_unchanged_slots_are_omitted():
+        relay_tx("n1", "m1")
+        relay_tx("n2", "m2")
+        resp = relay_slots(cluster_id="c1")
+        assert relay_slots(cluster_id="c1", epoch=resp["epoch"], gen=resp["gen"])["slots"] == {}
+        relay_tx("n2", "m2bis")
+        resp = relay_slots(cluster_id="c1", epoch=resp["epoch"], gen=resp["gen"])
+        assert list(resp["slots"]) == ["n2"]
+        assert resp["slots"]["n2"]["data"] == "m2bis"
+
+    @staticmethod
+    def test_other_epoch_returns_all_slots():
+        relay_tx("n1", "m1")
+        resp = relay_slots(cluster_id="c1", epoch="restarted", gen=100)
+        assert list(resp["slots"]) == ["n1"]
+
+    @staticmethod
+    def test_long_poll_returns_on_update():
+        relay_tx("n1", "m1")
+        gen = relay_slots(cluster_id="c1")["gen"]
+        timer = threading.Timer(0.2, relay_tx, args=("n1", "m1bis"))
+        timer.start()
+        begin = time.time()
+        resp = relay_slots(cluster_id="c1", epoch=shared.RELAY_EPOCH, gen=gen, timeout=5)
+        assert time.time() - begin < 2
+        assert resp["slots"]["n1"]["data"] == "m1bis"
+
+    @staticmethod
+    def test_long_poll_timeout():
+        begin = time.time()
+        assert relay_slots(cluster_id="c1", timeout=1)["slots"] == {}
+        assert time.time() - begin >= 1
+
+
+@pytest.fixture(scope="function")
+def relay_rx(mocker):
+    rx = HbRelayRx.__new__(HbRelayRx)
+    rx.last_updated = {}
+    rx.relay_epoch = ""
+    rx.relay_gen = 0
+    rx.relay_slots = True
+    rx.relay = "relay"
+    rx.secret = "secret"
+    rx.hb_nodes = ["n1", "n2", "n3"]
+    rx.handled = []
+    rx.log = logging.getLogger("test_relay")
+    for name in ("push_stats", "set_last", "set_beating", "get_last", "janitor_procs", "reload_config"):
+        mocker.patch.object(HbRelayRx, name)
+    mocker.patch.object(HbRelayRx, "handle_slot", side_effect=lambda *args: rx.handled.append(args))
+    mocker.patch.object(HbRelayRx, "cluster_id", "c1")
+    mocker.patch("hb_relay.rcEnv.nodename", "n1")
+    return rx
+
+
+@pytest.mark.ci
+class TestHbRelayRx:
+    @staticmethod
+    def test_slots_are_fetched_in_one_request(relay_rx, mocker):
+        daemon_get = mocker.patch.object(HbRelayRx, "daemon_get", return_value={
+            "status": 0,
+            "epoch": "e1",
+            "gen": 12,
+            "slots": {"n2": {"data": "m2", "updated": 1.0}},
+        })
+        relay_rx.do()
+        assert daemon_get.call_count == 1
+        assert daemon_get.call_args[0][0]["options"]["slots"] == ["n2", "n3"]
+        assert relay_rx.handled == [("n2", 1.0, b"m2")]
+        assert (relay_rx.relay_epoch, relay_rx.relay_gen) == ("e1", 12)
+        assert relay_rx.set_beating.call_count == 2
+        relay_rx.do()
+        assert daemon_get.call_args[0][0]["options"]["gen"] == 12
+
+    @staticmethod
+    def test_fall_back_to_slot_by_slot(relay_rx, mocker):
+        def daemon_get(request, **kwargs):
+            if request["action"] == "relay_slots":
+                return {"status": 501, "error": "handler GET relay_slots is not supported"}
+            return {"status": 0, "data": "m", "updated": 1.0}
+
+        mocker.patch.object(HbRelayRx, "daemon_get", side_effect=daemon_get)
+        relay_rx.do()
+        assert not relay_rx.relay_slots
+        assert relay_rx.handled == [("n2", 1.0, b"m"), ("n3", 1.0, b"m")]
@@ -1,4 +1,10 @@
+import datetime
+import logging
+
+import pytest
+
 import rcScheduler
+from storage import Storage
 
 
 class TestSchedules:
@@ -73,3 +79,75 @@ class TestSchedules:
         sched = rcScheduler.Scheduler()
         for test in tests:
             assert sched.test_schedule(*test)
+
+
+def brute_force_next(sched, schedules, now, last, horizon):
+    """
+    The reference implementation: test each minute until <horizon>.
+    """
+    future = now
+    while future < horizon:
+        try:
+            sched.in_schedule(schedules, now=future, last=last)
+            return future
+        except Exception:
+            pass
+        future += datetime.timedelta(minutes=1)
+
+
+NEXT_SCHEDULE_CORPUS = [
+    "",
+    "@0",
+    "*",
+    "*@61",
+    "@10",
+    "09:00-09:20",
+    "09:00-09:20@31",
+    "09:00-09:00",
+    "09:20-09:00",
+    "09:00",
+    "23:00-00:59",
+    "22:00-02:00@2h sat",
+    "* fri",
+    "* *:last",
+    "* *:-2",
+    "* :-2",
+    "* :5",
+    "* :first",
+    "* * 45-46",
+    "* * * %2+1",
+    "18:00-18:59@60 wed",
+    "23:00-23:59@61 *:first",
+    "23:00-23:59@61 freday",
+    '["09:00-18:00@30 mon-fri", "!12:00-14:00"]',
+    '["!12:00-14:00", "09:00-18:00@30 mon-fri"]',
+    '["!* sat-sun", "*@120"]',
+    '["00:00-06:00@1h", "!03:00-04:00 *:last"]',
+    '["01:00-02:00 tue", "!* tue", "05:00"]',
+]
+
+
+class TestNextSchedule:
+    @staticmethod
+    @pytest.mark.ci
+    @pytest.mark.parametrize("schedule_s", NEXT_SCHEDULE_CORPUS)
+    @pytest.mark.parametrize("now_s,last_s", [
+        ("2016-08-31 18:00", None),
+        ("2016-10-28 23:30", "2016-10-28 22:10"),
+        ("2016-11-05 09:05", "2016-11-05 09:00"),
+    ])
+    def test_compare_with_brute_force(schedule_s, now_s, last_s):
+        sched = rcScheduler.Scheduler(node=Storage(log=logging.getLogger("test_scheduler")))
+        now = sched._str_to_datetime(now_s)
+        last = sched._str_to_datetime(last_s) if last_s else None
+        horizon = now + datetime.timedelta(days=8)
+        try:
+            schedules = sched.sched_get_schedule("dummy", "dummy", schedules=schedule_s)
+        except rcScheduler.SchedSyntaxError:
+            return
+        expected = brute_force_next(sched, schedules, now, last, horizon)
+        try:
+            result = sched.next_in_schedule(schedules, now=now, last=last, horizon=horizon)
+        except rcScheduler.SchedSyntaxError:
+            result = None
+        assert result == expected
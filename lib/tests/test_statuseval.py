@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import pytest
+
+import rcGlobalEnv
+import rcStatus
+from node import Node
+from statuseval import StatusEvaluator
+from svc import Svc
+
+
+class FakeResource(object):
+    def __init__(self, rid, type, delay=0.0, events=None):
+        self.rid = rid
+        self.type = type
+        self.delay = delay
+        self.events = events if events is not None else []
+        self.rstatus = None
+        self.status_logs = []
+        self.status_expired = False
+
+    def status(self, refresh=False, verbose=False):
+        self.events.append(("begin", self.rid))
+        time.sleep(self.delay)
+        self.events.append(("end", self.rid))
+        if self.status_expired:
+            return self.rstatus
+        self.rstatus = rcStatus.UP
+        return self.rstatus
+
+    def status_log(self, text, level="warn"):
+        self.status_logs.append((level, text))
+
+
+@pytest.mark.ci
+class TestStatusEvaluator:
+    @staticmethod
+    def test_resources_are_evaluated_in_parallel():
+        resources = [FakeResource("fs#%d" % idx, "fs.flag", delay=0.2) for idx in range(10)]
+        begin = time.time()
+        StatusEvaluator(resources, 10).run(refresh=True)
+        assert time.time() - begin < 1
+        assert [res.rstatus for res in resources] == [rcStatus.UP] * 10
+
+    @staticmethod
+    def test_parallelism_is_bounded():
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+
+        class Res(FakeResource):
+            def status(self, **kwargs):
+                with lock:
+                    running.append(self.rid)
+                    peak[0] = max(peak[0], len(running))
+                time.sleep(0.05)
+                with lock:
+                    running.remove(self.rid)
+
+        resources = [Res("app#%d" % idx, "app.simple") for idx in range(8)]
+        StatusEvaluator(resources, 3).run()
+        assert peak[0] == 3
+
+    @staticmethod
+    def test_containers_are_evaluated_first():
+        events = []
+        resources = [
+            FakeResource("ip#1", "ip", delay=0.01, events=events),
+            FakeResource("container#1", "container.docker", delay=0.1, events=events),
+            FakeResource("fs#1", "fs.flag", events=events),
+        ]
+        StatusEvaluator(resources, 4).run()
+        assert events[:2] == [("begin", "container#1"), ("end", "container#1")]
+
+    @staticmethod
+    def test_timeout_sets_warn():
+        slow = FakeResource("app#1", "app.simple", delay=1)
+        fast = [FakeResource("app#%d" % idx, "app.simple", delay=0.05) for idx in range(2, 5)]
+        begin = time.time()
+        # a single thread: the remaining resources are evaluated by a new
+        # thread when the slow one expires
+        StatusEvaluator([slow] + fast, 1, timeout=0.2).run()
+        assert time.time() - begin < 0.8
+        assert slow.rstatus == rcStatus.WARN
+        assert len(slow.status_logs) == 1
+        assert slow.status_logs[0][1].startswith("status evaluation timeout")
+        assert [res.rstatus for res in fast] == [rcStatus.UP] * 3
+        # the late evaluation does not override the warn status
+        time.sleep(1)
+        assert slow.rstatus == rcStatus.WARN
+
+
+@pytest.fixture(scope="function")
+def has_service_with_parallel_status(osvc_path_tests):
+    pathetc = rcGlobalEnv.rcEnv.paths.pathetc
+    os.mkdir(pathetc)
+    with open(os.path.join(pathetc, "svc.conf"), mode="w+") as svc_file:
+        svc_file.write("""
+[DEFAULT]
+id = abcd
+status_max_parallel = 4
+
+[fs#flag1]
+type = flag
+
+[fs#flag2]
+type = flag
+""")
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures("has_service_with_parallel_status")
+class TestSvcParallelStatus:
+    @staticmethod
+    def test_status_data(mock_sysname):
+        mock_sysname("Linux")
+        svc = Svc(name="svc", node=Node())
+        assert svc.status_max_parallel == 4
+        data = svc.print_status_data_eval(refresh=True, write_data=False)
+        for rid in ("fs#flag1", "fs#flag2"):
+            assert data["resources"][rid]["status"] == "down"
+            assert data["resources"][rid]["eval_duration"] >= 0
+        assert data["avail"] == "down"
@@ -0,0 +1,156 @@
+import json
+import time
+
+import json_delta
+import pytest
+
+from statustree import StatusTree, copy
+
+TRACKED = [("nodes", "*", "services", "status", "*")]
+
+
+def dataset(nodes=2, objects=10):
+    data = {"nodes": {}}
+    for node_idx in range(nodes):
+        node = "node%d" % node_idx
+        status = {}
+        for idx in range(objects):
+            status["svc%d" % idx] = {
+                "avail": "up",
+                "frozen": 0,
+                "updated": 1.0,
+                "monitor": {"status": "idle"},
+                "resources": dict(("fs#%d" % rid, {"status": "up", "label": "/srv/%d" % rid}) for rid in range(10)),
+            }
+        data["nodes"][node] = {
+            "monitor": {"status": "idle"},
+            "services": {"status": status, "config": {}},
+        }
+    return data
+
+
+def patched(data, patch):
+    data = json.loads(json.dumps(data))
+    return json_delta.patch(data, json.loads(json.dumps(patch)))
+
+
+@pytest.mark.ci
+class TestStatusTree:
+    @staticmethod
+    def test_copy_normalizes_like_json():
+        data = {1: (1, 2), "a": {None: True}}
+        assert copy(data) == json.loads(json.dumps(data))
+
+    @staticmethod
+    def test_tuples_are_compared_normalized():
+        live = {"a": (1, 2), "b": {"c": [(1,), {1: ("x",)}]}}
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        snap = tree.data
+        assert tree.update(live) == []
+        assert tree.data is snap
+        live["a"] = (1, 3)
+        assert tree.update(live) == [[["a"], [1, 3]]]
+
+    @staticmethod
+    def test_first_update_is_a_full_snapshot():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        patch = tree.update(live)
+        assert tree.data == live
+        assert tree.data is not live
+        assert patched({}, patch) == live
+
+    @staticmethod
+    def test_no_change_produces_no_patch_and_shares_snapshot():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        snap = tree.data
+        assert tree.update(live) == []
+        assert tree.data is snap
+
+    @staticmethod
+    def test_marked_instance_change_is_patched():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        previous = tree.data
+        live["nodes"]["node1"]["services"]["status"]["svc3"]["avail"] = "down"
+        tree.mark(("nodes", "node1", "services", "status", "svc3"))
+        patch = tree.update(live)
+        assert patch == [[["nodes", "node1", "services", "status", "svc3", "avail"], "down"]]
+        assert patched(previous, patch) == tree.data == live
+        # the published snapshot is not modified
+        assert previous["nodes"]["node1"]["services"]["status"]["svc3"]["avail"] == "up"
+        # unchanged subtrees are shared
+        assert previous["nodes"]["node0"] is tree.data["nodes"]["node0"]
+
+    @staticmethod
+    def test_unmarked_instance_change_is_ignored_until_marked():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        live["nodes"]["node1"]["services"]["status"]["svc3"]["avail"] = "down"
+        assert tree.update(live) == []
+        tree.mark(("nodes", "node1"))
+        assert tree.update(live) != []
+        assert tree.data == live
+
+    @staticmethod
+    def test_full_update_compares_unmarked_instances():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        live["nodes"]["node1"]["services"]["status"]["svc3"]["avail"] = "down"
+        assert tree.update(live, full=True) != []
+        assert tree.data == live
+
+    @staticmethod
+    def test_untracked_changes_and_deletions_are_patched():
+        live = dataset()
+        tree = StatusTree(tracked=TRACKED)
+        tree.update(live)
+        previous = tree.data
+        live["nodes"]["node0"]["monitor"]["status"] = "thawing"
+        del live["nodes"]["node0"]["services"]["status"]["svc1"]
+        del live["nodes"]["node1"]
+        live["nodes"]["node2"] = {"monitor": {"status": "init"}}
+        patch = tree.update(live)
+        assert patched(previous, patch) == tree.data == live
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("objects", [100, 1000, 5000])
+def test_benchmark_against_json_delta(objects):
+    """
+    Compare the json round-trip + json_delta diff path with the status tree
+    path, with a few instances changed per pass.
+    """
+    live = dataset(nodes=2, objects=objects)
+    changes = ["svc%d" % idx for idx in range(0, objects, max(1, objects // 3))]
+    passes = 5
+
+    last = json.loads(json.dumps(live))
+    begin = time.time()
+    for idx in range(passes):
+        for path in changes:
+            live["nodes"]["node0"]["services"]["status"][path]["updated"] = float(idx)
+        current = json.loads(json.dumps(live))
+        diff = json_delta.diff(last, current, verbose=False, array_align=False, compare_lengths=False)
+        last = current
+    json_delta_duration = (time.time() - begin) / passes
+
+    tree = StatusTree(tracked=TRACKED)
+    tree.update(live)
+    begin = time.time()
+    for idx in range(passes):
+        for path in changes:
+            live["nodes"]["node0"]["services"]["status"][path]["updated"] = float(idx + passes)
+            tree.mark(("nodes", "node0", "services", "status", path))
+        patch = tree.update(live)
+    tree_duration = (time.time() - begin) / passes
+
+    print("%d objects: json_delta %.4fs/pass, status tree %.4fs/pass" % (objects, json_delta_duration, tree_duration))
+    assert len(patch) == len(diff) == len(changes)
+    assert tree.data == live
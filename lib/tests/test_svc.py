@@ -1,3 +1,5 @@
+import os
+
 from svc import Svc
 import pytest
 
@@ -54,3 +56,97 @@ class TestSvcFsFlag:
         mock_sysname('Linux')
         flag_resource = svc.get_resource('fs#flag1')
         assert flag_resource.type == 'fs.flag'
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('has_service_with_fs_flag')
+class TestSvcConfigCache:
+    @staticmethod
+    def test_parsed_config_is_cached_until_changed(mocker, svc):
+        assert svc.cd["fs#flag1"]["type"] == "flag"
+        parse = mocker.spy(svc, "_parse_config_file")
+        assert svc.parse_config_file()["fs#flag1"]["type"] == "flag"
+        assert parse.call_count == 0
+
+        svc.set_multi(["fs#flag1.type=flag", "DEFAULT.comment=foo"])
+        assert svc.parse_config_file()["DEFAULT"]["comment"] == "foo"
+        assert parse.call_count == 1
+
+    @staticmethod
+    def test_parsed_config_is_loaded_from_the_disk_cache(mocker, svc):
+        import extconfig
+        svc.cd
+        assert os.path.exists(os.path.join(svc.var_d, "config.cache"))
+        mocker.patch.object(extconfig, "CONFIG_CACHE", {})
+        parse = mocker.spy(Svc, "_parse_config_file")
+        assert Svc(name="svc").cd["fs#flag1"]["type"] == "flag"
+        assert parse.call_count == 0
+
+    @staticmethod
+    def test_rewrite_drops_the_files_lists_caches(mocker, svc):
+        import extconfig
+        mocker.patch.object(extconfig, "CONFIG_CACHE", {
+            svc.paths.cf: None,
+            ("/etc/cluster.conf", svc.paths.cf): None,
+            ("/etc/cluster.conf", "/etc/node.conf"): None,
+        })
+        svc.drop_config_cache(svc.paths.cf)
+        assert list(extconfig.CONFIG_CACHE) == [("/etc/cluster.conf", "/etc/node.conf")]
+
+    @staticmethod
+    def test_returned_config_can_be_modified(svc):
+        svc.parse_config_file()["fs#flag1"]["type"] = "xfs"
+        assert svc.parse_config_file()["fs#flag1"]["type"] == "flag"
+
+    @staticmethod
+    def test_print_config_eval_does_not_build_resources(svc):
+        data = svc.print_config_data(evaluate=True)
+        assert data["fs#flag1"]["type"] == "flag"
+        assert svc.resources_initialized is False
+
+
+@pytest.fixture(scope='function')
+def has_service_with_section_references(osvc_path_tests):
+    import rcGlobalEnv
+    pathetc = rcGlobalEnv.rcEnv.paths.pathetc
+    os.mkdir(pathetc)
+    with open(os.path.join(pathetc, 'svc.conf'), mode='w+') as svc_file:
+        svc_file.write("""
+[DEFAULT]
+id = abcd
+size = 0
+
+[fs#flag1]
+type = flag
+size = 1
+
+[fs#flag2]
+type = flag
+size = 2
+""")
+
+
+@pytest.mark.ci
+@pytest.mark.usefixtures('has_service_with_section_references')
+class TestSvcReferencesCache:
+    @staticmethod
+    def test_references_are_resolved_per_section(svc):
+        for _ in range(2):
+            assert svc.handle_references("{size}", section="fs#flag1") == "1"
+            assert svc.handle_references("{size}", section="fs#flag2") == "2"
+            assert svc.handle_references("{size}", section="DEFAULT") == "0"
+            assert svc.handle_references("{rindex}-$(1+{size})", section="fs#flag2") == "flag2-3"
+
+    @staticmethod
+    def test_resolved_references_are_cached(mocker, svc):
+        resolve = mocker.spy(svc, "_handle_references")
+        assert svc.handle_references("{rid}", section="fs#flag1") == "fs#flag1"
+        count = resolve.call_count
+        assert svc.handle_references("{rid}", section="fs#flag1") == "fs#flag1"
+        assert resolve.call_count == count
+
+    @staticmethod
+    def test_plain_values_are_not_cached(svc):
+        assert svc.handle_references("flag", section="fs#flag1") == "flag"
+        assert svc.handle_references(3, section="fs#flag1") == 3
+        assert svc.ref_cache == {}
@@ -42,6 +42,18 @@ class TestUtilities:
         except:
             assert False
 
+    @staticmethod
+    def test_eval_expr_cache(mocker):
+        """
+        eval_expr() parses an expression once
+        """
+        import rcUtilities
+        mocker.patch.object(rcUtilities, "EXPR_CACHE", {})
+        parse = mocker.spy(rcUtilities.ast, "parse")
+        assert eval_expr("1 + 2") == 3
+        assert eval_expr("1 + 2") == 3
+        assert parse.call_count == 1
+
     @staticmethod
     def test_cache():
         """